@@ -11,8 +11,15 @@ USAGE:
 - Call the functions with required parameters:
   prompt = get_egg_creation_prompt(description, descriptors_text)
 
+- Chat calls send a template's messages instead, so its static part is the system message:
+  messages = VOICE_DESCRIPTION_TEMPLATE.messages(descriptors_text=..., care_context=...)
+
 MODIFYING PROMPTS:
-- Edit the prompt text directly in the function return statements
+- Each prompt is a PromptTemplate (prompt_templates.py): edit its static text
+  (instructions and style, the same on every call) or its dynamic text (the
+  {placeholders} filled per call)
+- Keep anything that varies per call out of the static text: the static part
+  goes first so the provider can cache it as a prompt prefix
 - Test changes by running the application
 - All prompts are automatically used when the functions are called
 
@@ -24,24 +31,24 @@ PROMPT CATEGORIES:
 5. Care Questions: Questions asked during egg incubation
 
 TIPS:
+- Per-call values are cut to the template's token budget (PROMPT_TOKEN_BUDGETS overrides them)
 - Keep prompts clear and specific
 - Test with different inputs to ensure robustness
 - Consider adding more negative prompts for image generation if needed
 - Voice and name prompts should be concise for better AI responses
 """
 
+from prompt_templates import PromptTemplate
+
 # ============================================================================
 # EGG CREATION PROMPTS
 # ============================================================================
 
-def get_egg_creation_prompt(description: str, descriptors_text: str) -> str:
-    """Generate the prompt for creating egg images from metadata"""
-    return f"""
-    Create a beautiful, mystical egg that represents the following:
-    
-    Description: {description}
-    Descriptors: {descriptors_text}
-    
+EGG_CREATION_TEMPLATE = PromptTemplate(
+    "egg_image",
+    static="""
+    Create a beautiful, mystical egg that represents the description and descriptors given at the end.
+
     The egg should be:
     - In a 2D Japanese anime inspired style (see below)
     - Visually stunning and detailed
@@ -49,56 +56,76 @@ def get_egg_creation_prompt(description: str, descriptors_text: str) -> str:
     - Unique and one-of-a-kind
     - Suitable for a creature that will hatch from it
     - Against an aesthetically pleasing background that doesn't distract from the egg
-    
+
     Style: A whimsical, emotionally resonant 2D animation style characterized by soft, painterly environments and clean-lined character design. It blends naturalistic scenery with a gentle sense of fantasy, emphasizing warmth, nostalgia, and childlike wonder. Characters are designed with rounded, approachable forms and expressive features, using a simplified but charming aesthetic. The color palette is vibrant but balanced, often evoking seasonal atmospheres. Lighting is natural and gentle, contributing to a dreamlike but grounded mood. The overall tone is optimistic, quiet, and heartfelt, suitable for adventures rooted in connection with nature, community, and magical realism.
-    """
+    """,
+    dynamic="""
+    Description: {description}
+    Descriptors: {descriptors_text}
+    """,
+    budget=600
+)
+
+def get_egg_creation_prompt(description: str, descriptors_text: str) -> str:
+    """Generate the prompt for creating egg images from metadata"""
+    return EGG_CREATION_TEMPLATE.render(description=description, descriptors_text=descriptors_text)
 
 # ============================================================================
 # IMAGE ANALYSIS PROMPTS
 # ============================================================================
 
-def get_image_analysis_prompt() -> str:
-    """Generate the prompt for analyzing images to create egg metadata"""
-    return """
+# Entirely static: the uploaded image follows it in the same message
+IMAGE_ANALYSIS_TEMPLATE = PromptTemplate(
+    "image_analysis",
+    static="""
     Analyze this image and provide:
     1. A detailed description of an egg inspired by what you see (focus on visual elements, colors, textures, patterns). The egg should not directly recreate the image, it should capture the spirit and aesthetics of the image.
     2. A list of 5-8 descriptive keywords/traits that capture the essence of this image
-    
+
     Format your response as JSON with these keys:
     - description: (string)
     - descriptors: (array of strings)
-    """
+    """,
+    operation="chat.analyze_image"
+)
+
+def get_image_analysis_prompt() -> str:
+    """Generate the prompt for analyzing images to create egg metadata"""
+    return IMAGE_ANALYSIS_TEMPLATE.render()
 
 # ============================================================================
 # CREATURE CREATION PROMPTS
 # ============================================================================
 
-def get_creature_concept_prompt(descriptors_text: str, care_context: str) -> str:
-    """Generate the prompt for creating a creature concept with name and image prompt"""
-    return f"""
-    Create a creature and then name and generate a prompt that I can use to create a pixel art sprite of it using dall-e. 
+CREATURE_CONCEPT_TEMPLATE = PromptTemplate(
+    "creature_concept",
+    static="""
+    Create a creature from the subject given at the end and then name and generate a prompt that I can use to create a pixel art sprite of it using dall-e.
     The dall-e prompt should be a fully copy-paste ready prompt that describes a simple 40x40 pixel sprite of the creature. Make sure the prompt leads with "40x40 pixel art sprite of" and keep the description relatively short, no more than 16 words.
 
-    Subject:
-    - Cute, fantastical infant inspired by {descriptors_text}
-    - Personality reflects {care_context}
-    - Surprising, delightful, unexpected details
-
     Style:
     - Pixel art style consisting of a 40x40 pixel image
+    - Surprising, delightful, unexpected details
 
     Return JSON with these keys: name: (name), image_prompt: (image_prompt).
-    """
+    """,
+    dynamic="""
+    Subject:
+    - Cute, fantastical infant inspired by {descriptors_text}
+    - Personality reflects {care_context}
+    """,
+    budget=300,
+    operation="chat.concept"
+)
 
-def get_creature_creation_prompt(descriptors_text: str, care_context: str) -> str:
-    """Generate the prompt for creating creature images from egg data and care responses"""
-    return f"""
-    Full-body portrait of a newborn magical creature — absolutely NO text, letters, numbers, captions, watermarks, or logos.
+def get_creature_concept_prompt(descriptors_text: str, care_context: str) -> str:
+    """Generate the prompt for creating a creature concept with name and image prompt"""
+    return CREATURE_CONCEPT_TEMPLATE.render(descriptors_text=descriptors_text, care_context=care_context)
 
-    Subject:
-    - Cute, fantastical infant inspired by → {descriptors_text}
-    - Personality reflects → {care_context}
-    - Surprising, delightful design details
+CREATURE_CREATION_TEMPLATE = PromptTemplate(
+    "creature_image",
+    static="""
+    Full-body portrait of a newborn magical creature — absolutely NO text, letters, numbers, captions, watermarks, or logos. Surprising, delightful design details.
 
     Style:
     - 2-D Japanese anime–inspired illustration
@@ -109,24 +136,43 @@ def get_creature_creation_prompt(descriptors_text: str, care_context: str) -> st
     - No environment, props, patterns, or particles
 
     Negative prompt: text, lettering, type, logo, caption, watermark, signature, calligraphy, symbols, glyphs
-    """
+    """,
+    dynamic="""
+    Subject:
+    - Cute, fantastical infant inspired by → {descriptors_text}
+    - Personality reflects → {care_context}
+    """,
+    budget=300
+)
+
+def get_creature_creation_prompt(descriptors_text: str, care_context: str) -> str:
+    """Generate the prompt for creating creature images from egg data and care responses"""
+    return CREATURE_CREATION_TEMPLATE.render(descriptors_text=descriptors_text, care_context=care_context)
+
+VOICE_DESCRIPTION_TEMPLATE = PromptTemplate(
+    "voice_description",
+    static="""
+    Based on the creature characteristics given at the end, describe the voice qualities for a baby creature sound.
 
-def get_voice_description_prompt(descriptors_text: str, care_context: str) -> str:
-    """Generate the prompt for describing creature voice characteristics"""
-    return f"""
-    Based on this creature's characteristics, describe the voice qualities for a baby creature sound:
-    
-    EGG TRAITS: {descriptors_text}
-    CARE CONTEXT: {care_context}
-    
     Describe the voice in 1-2 sentences, focusing on:
     - Pitch (high/low)
     - Speed (fast/slow)
     - Emotion (happy/sleepy/excited/curious)
     - Quality (soft/harsh/melodic/whispery)
-    
+
     Keep it brief and focused on voice characteristics.
-    """
+    """,
+    dynamic="""
+    EGG TRAITS: {descriptors_text}
+    CARE CONTEXT: {care_context}
+    """,
+    budget=300,
+    operation="chat.voice"
+)
+
+def get_voice_description_prompt(descriptors_text: str, care_context: str) -> str:
+    """Generate the prompt for describing creature voice characteristics"""
+    return VOICE_DESCRIPTION_TEMPLATE.render(descriptors_text=descriptors_text, care_context=care_context)
 
 
 
@@ -0,0 +1,149 @@
+"""
+Shared OpenAI Client for the Hatch Application
+
+One OpenAI client per process on an explicitly configured httpx connection
+pool. The egg and hatch pipelines, the prefetch threads and the kiosk pool
+filler all go through it, so they reuse keep-alive connections instead of
+paying a TCP + TLS handshake to the API on every call.
+
+- Built once, under a lock (safe under gthread workers; gevent patches the lock)
+- Rebuilt in a forked child (gunicorn --preload), so workers never share sockets
+- Pool size, keep-alive and HTTP/2 come from config.py:
+  OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_KEEPALIVE_EXPIRY, OPENAI_HTTP2
+- Connection reuse statistics from httpcore's trace hook: API requests sent on
+  a new vs. an already open connection, and TLS handshakes
+
+USAGE:
+  clients = OpenAIClientFactory(api_key=key, max_connections=20, http2=True)
+  clients.get().chat.completions.create(...)     # openai.OpenAI
+  await clients.get_async().images.generate(...)  # openai.AsyncOpenAI (app_async.py)
+  clients.stats()   # {"requests": 42, "new_connections": 3, "reused": 39, "tls_handshakes": 3, ...}
+"""
+
+import importlib.util
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIClientFactory:
+    def __init__(self, api_key, base_url=None, max_connections=20, max_keepalive=10,
+                 keepalive_expiry=60.0, http2=False, max_retries=2, on_event=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.max_retries = max_retries
+        self.on_event = on_event  # on_event(name) for "new", "reused" and "tls_handshake"
+
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+            self.http2 = False
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._async_client = None
+        self._stats = {"requests": 0, "new_connections": 0, "reused": 0, "tls_handshakes": 0}
+
+    def _check_process(self):
+        """After a fork, forget the parent's clients and counts (called under lock)"""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._client = None
+            self._async_client = None
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def _pool_options(self):
+        import httpx
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            "http2": self.http2,
+        }
+
+    def get(self):
+        """The process's openai.OpenAI client"""
+        with self._lock:
+            self._check_process()
+            if self._client is None:
+                import openai
+
+                http_client = openai.DefaultHttpxClient(
+                    event_hooks={"request": [self._trace_request]},
+                    **self._pool_options()
+                )
+                self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                             max_retries=self.max_retries, http_client=http_client)
+            return self._client
+
+    def get_async(self):
+        """The process's openai.AsyncOpenAI client (one event loop per process)"""
+        with self._lock:
+            self._check_process()
+            if self._async_client is None:
+                import openai
+
+                async def trace_request(request):
+                    self._trace_request(request, asynchronous=True)
+
+                http_client = openai.DefaultAsyncHttpxClient(
+                    event_hooks={"request": [trace_request]},
+                    **self._pool_options()
+                )
+                self._async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                        max_retries=self.max_retries, http_client=http_client)
+            return self._async_client
+
+    # ------------------------------------------------------------------
+    # Connection reuse statistics
+    # ------------------------------------------------------------------
+
+    def _trace_request(self, request, asynchronous=False):
+        """httpx request hook: follow this request's connection events through httpcore"""
+        connected = False
+
+        def trace(event, info):
+            nonlocal connected
+            if event == "connection.connect_tcp.complete":
+                connected = True
+                self._count("new_connections", "new")
+            elif event == "connection.start_tls.complete":
+                self._count("tls_handshakes", "tls_handshake")
+            elif event.endswith(".send_request_headers.started"):
+                self._count("requests")
+                if not connected:
+                    self._count("reused", "reused")
+
+        async def async_trace(event, info):
+            trace(event, info)
+
+        # httpcore's async connections await the trace callback
+        request.extensions["trace"] = async_trace if asynchronous else trace
+
+    def _count(self, key, event=None):
+        with self._lock:
+            self._stats[key] += 1
+        if event and self.on_event:
+            self.on_event(event)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["reuse_ratio"] = round(stats["reused"] / stats["requests"], 4) if stats["requests"] else None
+        stats["pool"] = {
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+        }
+        return stats
@@ -1,50 +1,70 @@
-from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template, send_file, send_from_directory, session, redirect, url_for, g, Response
 from flask_cors import CORS
-import openai
 import os
 import base64
-import io
-from PIL import Image
 import json
-from dotenv import load_dotenv
+import re
 import uuid
+import random
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import datetime
 import logging
-import requests
+import mimetypes
 from functools import wraps
 from ai_prompts import (
     get_egg_creation_prompt,
-    get_image_analysis_prompt,
     get_creature_creation_prompt,
-    get_voice_description_prompt,
-    get_creature_concept_prompt,
+    IMAGE_ANALYSIS_TEMPLATE,
+    CREATURE_CONCEPT_TEMPLATE,
+    VOICE_DESCRIPTION_TEMPLATE,
     PHONETIC_SOUNDS,
     CARE_QUESTIONS
 )
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('hatch.log'),
-        logging.StreamHandler()
-    ]
+import prompt_templates
+from api_client import OpenAIClientFactory
+from deadline import (
+    Deadline,
+    DeadlineExceeded,
+    ClientDisconnected,
+    set_deadline,
+    current_deadline,
+    check_deadline,
+    parse_budget,
+    socket_disconnected
 )
-logger = logging.getLogger(__name__)
+from search_index import SearchIndex
+from prompt_cache import PromptCache
+from record_store import RecordStore
+from media_urls import signer_from_config
+from image_selection import ImageSelector
+from egg_pool import EggPool, parse_clusters
+from prefetch import HatchPrefetcher
+from scheduler import FairScheduler, QueueFull, QueueTimeout
+from metrics import Metrics, API_BUCKETS, IO_BUCKETS
+from usage import UsageLedger, set_usage_scope, update_usage_scope, current_scope
+from structured_logging import configure_logging, init_request_logging
 
-# Load environment variables
-load_dotenv()
+# openai, requests and numpy (similarity.py) are imported on first use: together
+# they are most of the import time, and only the generation routes need them.
+# So are the media store, archive, sound processing, static asset and profiling
+# modules (and what they import: sqlite3, tarfile/zipfile, subprocess, gzip, cProfile).
+# See benchmarks/import_time.py for the startup budget.
+
+logger = logging.getLogger(__name__)
 
 def create_app(config_name=None):
-    if config_name is None:
-        config_name = os.getenv('FLASK_ENV', 'production')
-    
     app = Flask(__name__)
     
     try:
         # Import config after app creation to avoid circular imports
+        # (importing it also loads .env, before FLASK_ENV is read)
         from config import config
+        if config_name is None:
+            config_name = os.getenv('FLASK_ENV', 'production')
         app.config.from_object(config[config_name])
         config[config_name].init_app(app)
         
@@ -57,14 +77,18 @@ def create_app(config_name=None):
         CORS(app)
         print(f"Warning: Config loading failed, using fallback: {e}")
     
+    # Set up logging (JSON records, written off the request path by a queue listener)
+    configure_logging(app.config)
+    init_request_logging(app)
+    
+    # Per-stage token budgets for the variable part of each prompt
+    prompt_templates.configure_budgets(prompt_templates.parse_budgets(app.config.get('PROMPT_TOKEN_BUDGETS')))
+    
     return app
 
 # Create the app instance
 app = create_app()
 
-# Configure OpenAI
-openai.api_key = app.config['OPENAI_API_KEY']
-
 # Authentication decorator
 def login_required(f):
     @wraps(f)
@@ -83,6 +107,7 @@ def login():
         
         if password == correct_password:
             session['authenticated'] = True
+            session['usage_id'] = uuid.uuid4().hex
             return redirect(url_for('index'))
         else:
             return render_template('login.html', error='Invalid password')
@@ -97,71 +122,62 @@ def logout():
 
 class EggCreator:
     def __init__(self):
-        self.client = openai.OpenAI(api_key=app.config['OPENAI_API_KEY'])
+        self.client = get_openai_client()
     
-    def create_egg_from_metadata(self, description, descriptors):
+    def create_egg_from_metadata(self, description, descriptors, fresh=False, candidates=None):
         """
         Function 1: Creates an egg image from metadata
         Input: description (string) and descriptors (array of strings)
         Output: Generated egg image
+        Set fresh=True to skip the prompt cache and always generate a new image.
+        candidates: images to generate and pick the best of (default IMAGE_CANDIDATES).
         """
+        stages = get_metrics().stages("hatch_stage_duration_seconds", pipeline="egg")
+        egg_id = str(uuid.uuid4())
+        update_usage_scope(kind="egg", record_id=egg_id)
+        generated_url, cache = None, None
         try:
             # Build a detailed prompt for egg creation
             descriptors_text = ", ".join(descriptors)
             prompt = get_egg_creation_prompt(description, descriptors_text)
+            chain_start = self._start_image_attempt("egg", prompt)
             
-            # Generate image using DALL-E
-            response = self.client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                size="1024x1024",
-                quality="standard",
-                n=1,
-            )
-            
-            # Download and save the image locally
-            image_url = response.data[0].url
-            logger.info(f"Downloading image from: {image_url}")
-            
-            image_response = requests.get(image_url)
-            image_response.raise_for_status()  # Raise an exception for bad status codes
-            
-            # Create images directory if it doesn't exist
-            os.makedirs("static/images", exist_ok=True)
+            # Reuse a previously generated (or pooled) image for a near-identical request
+            image_url, source, cache = self._reusable_egg_image(prompt, description, descriptors, fresh)
+            stages.mark("lookup")
             
-            # Save image with unique filename
-            image_filename = f"egg_{str(uuid.uuid4())}.png"
-            image_path = os.path.join("static", "images", image_filename)
+            selection = None
+            if not image_url:
+                selection = self._generate_images(prompt, "egg", candidates, chain_start)
+                image_url = generated_url = selection['image_url']
+                if cache:
+                    cache.store(prompt, description, descriptors, image_url)
+            stages.mark("image")
             
-            with open(image_path, 'wb') as f:
-                f.write(image_response.content)
-            
-            logger.info(f"Image saved to: {image_path}")
-            
-            # Create relative URL for web access
-            image_url = f"/static/images/{image_filename}"
-            
-            # Create egg metadata
-            egg_id = str(uuid.uuid4())
-            egg_data = {
-                "id": egg_id,
-                "description": description,
-                "descriptors": descriptors,
-                "image_url": image_url,
-                "created_at": datetime.now().isoformat(),
-                "status": "created",
-                "incubation_stage": 0
-            }
+            egg_data = self._new_egg_record(egg_id, description, descriptors, image_url)
+            if selection:
+                self._add_selection(egg_data, selection)
             
             # Save egg data (in a real app, this would go to a database)
+            check_deadline("save")
             self._save_egg_data(egg_data)
+            stages.mark("save")
+            self._index_record('egg', egg_data)
+            stages.mark("index")
             
             return {
                 "success": True,
                 "egg": egg_data,
+                "cache": source,
+                "usage": self._usage_for('egg', egg_id),
                 "message": "Egg created successfully!"
             }
             
+        except DeadlineExceeded:
+            # A cached image is kept: the client's retry will be served from the cache
+            if generated_url and not cache:
+                self._discard_files(generated_url, *(selection or {}).get('alternate_image_urls', []))
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -169,78 +185,306 @@ class EggCreator:
                 "message": "Failed to create egg"
             }
     
+    def _reusable_egg_image(self, prompt, description, descriptors, fresh):
+        """
+        An existing image for this request from the prompt cache or the kiosk pool
+        Returns (image_url or None, source, cache)
+        """
+        cached = None
+        cache = get_prompt_cache()
+        if cache and fresh:
+            cache.record_bypass()
+            get_metrics().inc("hatch_prompt_cache_lookups_total", result="bypassed")
+        elif cache:
+            cached = cache.lookup(prompt, description, descriptors)
+            get_metrics().inc("hatch_prompt_cache_lookups_total", result=cached['match'] if cached else "miss")
+            if cached and not get_media_store().exists(cached['image_url']):
+                logger.warning(f"Cached image missing, regenerating: {cached['image_url']}")
+                cache.invalidate(cached['image_url'])
+                cached = None
+        
+        # Kiosk mode: take a pre-generated egg for a popular descriptor cluster
+        pooled = None
+        pool = get_egg_pool()
+        if pool and not fresh and not cached:
+            pooled = pool.take(descriptors)
+            get_metrics().inc("hatch_egg_pool_requests_total", result="hit" if pooled else "miss")
+            if pooled and not get_media_store().exists(pooled['image_url']):
+                logger.warning(f"Pooled image missing, regenerating: {pooled['image_url']}")
+                pooled = None
+        
+        if cached:
+            logger.info(f"Prompt cache {cached['match']} hit: {cached['image_url']}")
+            return cached['image_url'], cached['match'], cache
+        if pooled:
+            logger.info(f"Egg pool hit [{pooled['cluster']}]: {pooled['image_url']}")
+            return pooled['image_url'], "pool", cache
+        return None, None, cache
+    
+    def _new_egg_record(self, egg_id, description, descriptors, image_url):
+        return {
+            "id": egg_id,
+            "description": description,
+            "descriptors": descriptors,
+            "image_url": image_url,
+            "created_at": datetime.now().isoformat(),
+            "status": "created",
+            "incubation_stage": 0
+        }
+    
+    def _generate_egg_image(self, prompt):
+        """Generate an egg image with DALL-E, save it locally and return its web URL"""
+        return self._generate_images(prompt, "egg", candidates=1)['image_url']
+    
+    def _generate_images(self, prompt, kind, candidates=None, chain_start=None):
+        """
+        Generate candidate images for an egg/creature concurrently and keep the best by the local
+        score (see image_selection); the others are saved as alternates. A single image is scored
+        too, so acceptance is comparable. Returns {"image_url", "alternate_image_urls", "image_score"}
+        """
+        count = _candidate_count(candidates)
+        if count == 1:
+            return self._keep_best_image([self._fetch_image(prompt, kind)], [], kind, chain_start)
+        
+        contents, errors = [], []
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix=f"hatch-{kind}-image") as executor:
+            # Each candidate runs in a copy of this request's context (deadline, usage scope)
+            futures = [executor.submit(contextvars.copy_context().run, self._fetch_image, prompt, kind)
+                       for _ in range(count)]
+            for future in as_completed(futures):
+                try:
+                    contents.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+        return self._keep_best_image(contents, errors, kind, chain_start)
+    
+    def _keep_best_image(self, contents, errors, kind, chain_start):
+        """Pick the best of the downloaded candidates by score and save them all"""
+        metrics = get_metrics()
+        if errors:
+            metrics.inc("hatch_image_candidates_total", len(errors), pipeline=kind, result="failed")
+            logger.warning(f"{len(errors)} of {len(errors) + len(contents)} {kind} image candidates failed: {errors[0]}")
+        deadline_errors = [e for e in errors if isinstance(e, DeadlineExceeded)]
+        if deadline_errors or not contents:
+            raise (deadline_errors or errors)[0]
+        
+        best, scores = self._select_image(contents)
+        check_deadline("image_save")
+        urls = [self._save_image(content, kind) for content in contents]
+        
+        if scores:
+            accepted = sum(1 for score in scores if score['acceptable'])
+            metrics.inc("hatch_image_candidates_total", accepted, pipeline=kind, result="accepted")
+            metrics.inc("hatch_image_candidates_total", len(scores) - accepted, pipeline=kind, result="rejected")
+            metrics.inc("hatch_image_selections_total", pipeline=kind,
+                        outcome="accepted" if scores[best]['acceptable'] else "best_effort")
+            seconds = get_image_selector().finish(scores[best], chain_start) if chain_start else None
+            if seconds is not None:
+                metrics.observe("hatch_time_to_satisfactory_image_seconds", seconds, pipeline=kind)
+            logger.info(f"Picked {kind} image candidate {best + 1} of {len(urls)}", extra={"scores": scores})
+        return {
+            "image_url": urls[best],
+            "alternate_image_urls": [url for i, url in enumerate(urls) if i != best and url != urls[best]],
+            "image_score": scores[best] if scores else None
+        }
+    
+    def _add_selection(self, record, selection):
+        """Keep the image's score and the alternates on its record"""
+        if selection['image_score']:
+            record['image_score'] = selection['image_score']
+        if selection['alternate_image_urls']:
+            record['alternate_image_urls'] = selection['alternate_image_urls']
+    
+    def _fetch_image(self, prompt, kind):
+        """Generate one image with DALL-E and download it; returns its bytes"""
+        response = self._call_openai(
+            "images.generate",
+            self.client.images.generate,
+            **self._image_request(prompt)
+        )
+        logger.info(f"Downloading image from: {response.data[0].url}")
+        return self._download(response.data[0].url, kind=kind)
+    
+    def _select_image(self, contents):
+        """(index of the best image, scores), or (0, None) when the images can't be scored"""
+        try:
+            with get_metrics().time("hatch_image_scoring_duration_seconds"):
+                return get_image_selector().select(contents)
+        except Exception as e:
+            # NumPy/Pillow missing or an undecodable image: keep the first to arrive
+            logger.error(f"Error scoring image candidates: {e}")
+            return 0, None
+    
+    def _start_image_attempt(self, kind, key):
+        """Note a generation attempt for re-run tracking; returns when its attempt chain started"""
+        session_id = current_scope().get('session_id')
+        if not session_id:
+            return None
+        chain_start, rerun = get_image_selector().start_attempt(session_id, f"{kind}:{key}")
+        if rerun:
+            get_metrics().inc("hatch_image_reruns_total", pipeline=kind)
+        return chain_start
+    
+    def _save_image(self, content, prefix):
+        """Save a generated image in the media store and return its web URL"""
+        image_url = self._store_media(content, "image", kind=f"{prefix}_image")
+        logger.info(f"Image saved to: {image_url}")
+        return image_url
+    
+    def _call_openai(self, operation, create, **kwargs):
+        """
+        Make an OpenAI API call, recording its latency, outcome and token usage.
+        Under a request deadline each attempt's timeout is what is left of it.
+        """
+        deadline = current_deadline()
+        attempt = 0
+        while True:
+            if deadline is not None:
+                kwargs['timeout'] = deadline.call_timeout(operation)
+            start = time.perf_counter()
+            try:
+                response = create(**kwargs)
+            except Exception as e:
+                self._observe_openai(operation, kwargs, start, error=e)
+                delay = self._retry_delay(e, attempt, deadline, operation)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._observe_openai(operation, kwargs, start, response=response)
+            return response
+    
+    def _retry_delay(self, error, attempt, deadline, operation):
+        """
+        Seconds to wait before retrying a failed OpenAI call, or None to give up.
+        The client itself doesn't retry (see get_openai_clients) so that retries
+        can stop at the request deadline.
+        """
+        import openai
+        
+        if deadline is not None and deadline.remaining() <= 0:
+            raise DeadlineExceeded(operation) from error
+        status = getattr(error, 'status_code', None)
+        retryable = isinstance(error, openai.APIConnectionError) or status in (408, 409, 429) or (status or 0) >= 500
+        if not retryable or attempt >= app.config.get('OPENAI_MAX_RETRIES', 2):
+            return None
+        
+        delay = min(0.5 * 2 ** attempt, 8.0) * random.uniform(0.75, 1.0)
+        response = getattr(error, 'response', None)
+        try:
+            delay = min(float(response.headers.get('retry-after')), 60.0)
+        except (AttributeError, TypeError, ValueError):
+            pass
+        if deadline is not None and not deadline.allows(delay + 1.0):
+            return None
+        logger.warning(f"{operation} failed ({error}), retrying in {delay:.1f}s")
+        return delay
+    
+    def _observe_openai(self, operation, kwargs, start, response=None, error=None):
+        """Latency, token and cost bookkeeping for one finished OpenAI call"""
+        metrics = get_metrics()
+        model = kwargs.get('model', 'none')
+        seconds = time.perf_counter() - start
+        metrics.observe("hatch_openai_request_duration_seconds", seconds,
+                        operation=operation, model=model, outcome=type(error).__name__ if error else "ok")
+        if error is not None:
+            return
+        
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+            cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', 0) or 0
+            metrics.inc("hatch_openai_tokens_total", prompt_tokens,
+                        operation=operation, model=model, type="prompt")
+            metrics.inc("hatch_openai_tokens_total", cached_tokens,
+                        operation=operation, model=model, type="cached")
+            metrics.inc("hatch_openai_tokens_total", getattr(usage, 'completion_tokens', 0) or 0,
+                        operation=operation, model=model, type="completion")
+            prompt_templates.observe_usage(operation, prompt_tokens, cached_tokens, seconds)
+        
+        self._record_usage(operation, model, response, kwargs)
+    
+    def _record_usage(self, operation, model, response, kwargs):
+        """Write a billable call to the usage ledger, attributed to the current session/record"""
+        if operation == "models.list":
+            return
+        try:
+            usage = getattr(response, 'usage', None)
+            details = getattr(usage, 'prompt_tokens_details', None)
+            cost = get_usage_ledger().record(
+                operation,
+                model,
+                prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+                cached_tokens=getattr(details, 'cached_tokens', 0) or 0,
+                images=len(getattr(response, 'data', None) or []) if operation.startswith("images.") else 0,
+                image_variant=f"{kwargs.get('quality', 'standard')}:{kwargs.get('size', '1024x1024')}",
+                characters=len(kwargs.get('input', '')) if operation.startswith("audio.") else 0,
+                **current_scope()
+            )
+            get_metrics().inc("hatch_openai_cost_usd_total", cost, operation=operation, model=model)
+        except Exception as e:
+            logger.error(f"Error recording usage: {e}")
+    
+    def _download(self, url, kind):
+        """Download a generated asset, recording latency and size"""
+        import requests
+        
+        deadline = current_deadline()
+        timeout = deadline.call_timeout(f"{kind}_download") if deadline is not None else None
+        with get_metrics().time("hatch_download_duration_seconds", kind=kind):
+            response = requests.get(url, timeout=timeout)
+            response.raise_for_status()  # Raise an exception for bad status codes
+        get_metrics().inc("hatch_download_bytes_total", len(response.content), kind=kind)
+        return response.content
+    
+    def _discard_files(self, *urls):
+        """
+        Assets of a pipeline that was abandoned. They are left to the media GC rather than
+        deleted: with content addressing another request may have been handed the same file.
+        """
+        for url in urls:
+            if url:
+                logger.info(f"Asset of abandoned request left for media GC: {url}")
+    
+    def _optional_stage(self, stage, pipeline):
+        """Whether an optional stage fits in what is left of the request deadline (skips are counted)"""
+        deadline = current_deadline()
+        if deadline is None:
+            return True
+        deadline.check(stage)
+        if deadline.allows(app.config.get('DEADLINE_OPTIONAL_STAGE_SECONDS', 8)):
+            return True
+        logger.warning(f"Skipping {pipeline} stage {stage}: {deadline.remaining():.1f}s left of the request deadline")
+        get_metrics().inc("hatch_stages_skipped_total", pipeline=pipeline, stage=stage)
+        return False
+    
+    def _store_media(self, content, media_kind, kind):
+        """Write an asset to the media store (deduplicated), recording latency and size"""
+        with get_metrics().time("hatch_file_write_duration_seconds", kind=kind):
+            url = get_media_store().put(content, media_kind)
+        get_metrics().inc("hatch_file_write_bytes_total", len(content), kind=kind)
+        return url
+    
     def analyze_image_to_metadata(self, image_data):
         """
         Function 2: Analyzes an image and generates description and metadata
         Input: image (base64 or file)
         Output: description and descriptors for egg creation
         """
+        update_usage_scope(kind="analysis")
         try:
-            # Convert image data to base64 if it's a file
-            if hasattr(image_data, 'read'):
-                # Reset file pointer to beginning
-                image_data.seek(0)
-                image_bytes = image_data.read()
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                
-                # Determine image format from file extension or content
-                filename = image_data.filename.lower() if hasattr(image_data, 'filename') else ''
-                if filename.endswith(('.png', '.PNG')):
-                    mime_type = "image/png"
-                elif filename.endswith(('.gif', '.GIF')):
-                    mime_type = "image/gif"
-                elif filename.endswith(('.webp', '.WEBP')):
-                    mime_type = "image/webp"
-                else:
-                    mime_type = "image/jpeg"  # Default to JPEG
-            else:
-                image_base64 = image_data
-                mime_type = "image/jpeg"  # Default to JPEG
+            image_base64, mime_type = self._encode_image(image_data)
             
             # Analyze image with GPT-4 Vision
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": get_image_analysis_prompt()
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500
+            response = self._call_openai(
+                "chat.analyze_image",
+                self.client.chat.completions.create,
+                **self._analysis_request(image_base64, mime_type)
             )
             
-            # Parse the response
-            analysis_text = response.choices[0].message.content
-            logger.info(f"GPT-4 Vision response: {analysis_text}")
-            
-            # Try to extract JSON from the response
-            try:
-                # Find JSON in the response
-                start_idx = analysis_text.find('{')
-                end_idx = analysis_text.rfind('}') + 1
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = analysis_text[start_idx:end_idx]
-                    analysis_data = json.loads(json_str)
-                else:
-                    raise ValueError("No JSON found in response")
-            except Exception as json_error:
-                logger.error(f"JSON parsing error: {json_error}")
-                # Fallback: create structured data from text
-                analysis_data = {
-                    "description": analysis_text,
-                    "descriptors": ["mystical", "unique", "beautiful", "magical"]
-                }
+            analysis_data = self._parse_analysis(response.choices[0].message.content)
             
             return {
                 "success": True,
@@ -248,6 +492,8 @@ class EggCreator:
                 "message": "Image analyzed successfully!"
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Image analysis error: {str(e)}")
             return {
@@ -256,229 +502,192 @@ class EggCreator:
                 "message": "Failed to analyze image"
             }
     
+    def _encode_image(self, image_data):
+        """(base64 string, mime type) for an uploaded file or a base64 string"""
+        if hasattr(image_data, 'read'):
+            # Reset file pointer to beginning
+            image_data.seek(0)
+            image_bytes = image_data.read()
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            
+            # Determine image format from file extension or content
+            filename = image_data.filename.lower() if hasattr(image_data, 'filename') else ''
+            if filename.endswith(('.png', '.PNG')):
+                mime_type = "image/png"
+            elif filename.endswith(('.gif', '.GIF')):
+                mime_type = "image/gif"
+            elif filename.endswith(('.webp', '.WEBP')):
+                mime_type = "image/webp"
+            else:
+                mime_type = "image/jpeg"  # Default to JPEG
+        else:
+            image_base64 = image_data
+            mime_type = "image/jpeg"  # Default to JPEG
+        return image_base64, mime_type
+    
+    def _analysis_request(self, image_base64, mime_type):
+        """Chat completion arguments for the image analysis call"""
+        return {
+            "model": "gpt-4o",
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": IMAGE_ANALYSIS_TEMPLATE.render()
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{image_base64}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": 500
+        }
+    
+    def _parse_analysis(self, analysis_text):
+        """Description and descriptors from the analysis response (with a fallback for non-JSON replies)"""
+        logger.info(f"GPT-4 Vision response: {analysis_text}")
+        
+        # Try to extract JSON from the response
+        try:
+            # Find JSON in the response
+            start_idx = analysis_text.find('{')
+            end_idx = analysis_text.rfind('}') + 1
+            if start_idx != -1 and end_idx > start_idx:
+                json_str = analysis_text[start_idx:end_idx]
+                return json.loads(json_str)
+            else:
+                raise ValueError("No JSON found in response")
+        except Exception as json_error:
+            logger.error(f"JSON parsing error: {json_error}")
+            # Fallback: create structured data from text
+            return {
+                "description": analysis_text,
+                "descriptors": ["mystical", "unique", "beautiful", "magical"]
+            }
+    
     def _save_egg_data(self, egg_data):
         """Save egg data to a simple JSON file (in production, use a database)"""
         try:
-            eggs_file = "eggs_data.json"
-            eggs = []
-            
-            if os.path.exists(eggs_file):
-                with open(eggs_file, 'r') as f:
-                    eggs = json.load(f)
-            
-            eggs.append(egg_data)
-            
-            with open(eggs_file, 'w') as f:
-                json.dump(eggs, f, indent=2)
+            with get_metrics().time("hatch_storage_duration_seconds", store="eggs", op="write"):
+                get_record_store("eggs_data.json").append(egg_data)
+            get_media_store().ref(egg_data.get('image_url'), *egg_data.get('alternate_image_urls', []))
                 
         except Exception as e:
             logger.error(f"Error saving egg data: {e}")
     
-    def create_creature_from_egg(self, egg, care_responses):
+    def _index_record(self, kind, record):
+        """Keep the descriptor search index in step with the JSON files"""
+        try:
+            if kind == 'egg':
+                get_search_index().add_egg(record)
+            else:
+                get_search_index().add_creature(record)
+        except Exception as e:
+            logger.error(f"Error updating search index: {e}")
+        
+        if kind == 'egg':
+            try:
+                get_similarity_index().add(record['id'], record.get('description', ''), record.get('descriptors', []))
+            except Exception as e:
+                logger.error(f"Error updating similarity index: {e}")
+    
+    def create_creature_from_egg(self, egg, care_responses, prefetched=None, candidates=None):
         """
         Generate a unique creature based on egg data and care responses
+        prefetched holds stages already run while the care question was open (see prefetch_hatch)
+        candidates: creature images to generate and pick the best of (default IMAGE_CANDIDATES)
         """
+        prefetched = prefetched or {}
+        stages = get_metrics().stages("hatch_stage_duration_seconds", pipeline="hatch")
+        
+        # The creature id is fixed up front (or by the prefetched sound) so every call is attributed to it
+        sound, creature_id, selected_sound = self._pick_creature_sound(prefetched)
+        update_usage_scope(kind="creature", record_id=creature_id)
+        creature_image_url = generated_audio_url = None
+        alternate_urls = []
+        chain_start = self._start_image_attempt("creature", egg.get('id'))
+        
         try:
-            # Build a comprehensive prompt for creature generation
-            # Get the single care response (could be any of the question types)
-            care_response = list(care_responses.values())[0] if care_responses else 'with love and care'
-            care_question_id = list(care_responses.keys())[0] if care_responses else 'general'
-            
-            # Create context based on the type of question asked
-            if care_question_id == 'activities':
-                care_context = f"enjoyed activities like {care_response}"
-            elif care_question_id == 'feelings':
-                care_context = f"made you feel {care_response}"
-            elif care_question_id == 'time_spent':
-                care_context = f"spent {care_response} together"
-            elif care_question_id == 'description':
-                care_context = f"described as {care_response}"
-            elif care_question_id == 'sounds':
-                care_context = f"made sounds like {care_response}"
-            elif care_question_id == 'favorite_thing':
-                care_context = f"loved for {care_response}"
-            elif care_question_id == 'comfort':
-                care_context = f"comforted by {care_response}"
-            elif care_question_id == 'whispers':
-                care_context = f"heard whispers of {care_response}"
-            elif care_question_id == 'favorite_spot':
-                care_context = f"loved being in {care_response}"
-            elif care_question_id == 'celebration':
-                care_context = f"celebrated with {care_response}"
-            else:
-                care_context = f"cared for with {care_response}"
-            
+            care_context = self._care_context(care_responses)
             descriptors_text = ", ".join(egg.get('descriptors', []))
             
-            # Generate creature concept (name and image prompt) using GPT
-            concept_prompt = get_creature_concept_prompt(descriptors_text, care_context)
-            
-            concept_response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": concept_prompt
-                    }
-                ],
-                max_tokens=300
-            )
-            
-            concept_content = concept_response.choices[0].message.content.strip()
-            logger.info(f"Creature concept response: {concept_content}")
-            
-            # Parse the JSON response to get name and image prompt
-            try:
-                import json
-                import re
-                
-                # Clean the response content - remove markdown code blocks if present
-                cleaned_content = concept_content.strip()
-                if cleaned_content.startswith('```json'):
-                    # Remove markdown code block formatting
-                    cleaned_content = re.sub(r'^```json\s*', '', cleaned_content)
-                    cleaned_content = re.sub(r'\s*```$', '', cleaned_content)
-                elif cleaned_content.startswith('```'):
-                    # Remove generic markdown code block formatting
-                    cleaned_content = re.sub(r'^```\s*', '', cleaned_content)
-                    cleaned_content = re.sub(r'\s*```$', '', cleaned_content)
-                
-                concept_data = json.loads(cleaned_content)
-                creature_name = concept_data.get('name', 'Unknown')
-                image_prompt = concept_data.get('image_prompt', '')
-                
-                if not image_prompt:
-                    # Fallback to original prompt if parsing fails
-                    image_prompt = get_creature_creation_prompt(descriptors_text, care_context)
-                    logger.warning("Failed to parse image prompt from concept response, using fallback")
-                
-                logger.info(f"Generated creature name: {creature_name}")
-                logger.info(f"Generated image prompt: {image_prompt}")
-                
-            except (json.JSONDecodeError, KeyError) as e:
-                logger.error(f"Error parsing concept response: {e}")
-                logger.error(f"Raw response content: {concept_content}")
-                # Fallback to original prompt and generate name separately
-                image_prompt = get_creature_creation_prompt(descriptors_text, care_context)
-                creature_name = "Unknown"
-                logger.warning("Using fallback prompts due to parsing error")
-            
-            # Generate creature image using DALL-E with the dynamic prompt
-            response = self.client.images.generate(
-                model="dall-e-3",
-                prompt=image_prompt,
-                size="1024x1024",
-                quality="standard",
-                n=1,
-            )
-            
-            # Download and save the creature image locally
-            creature_image_url = response.data[0].url
-            logger.info(f"Downloading creature image from: {creature_image_url}")
-            
-            creature_image_response = requests.get(creature_image_url)
-            creature_image_response.raise_for_status()  # Raise an exception for bad status codes
-            
-            # Save creature image with unique filename
-            creature_image_filename = f"creature_{str(uuid.uuid4())}.png"
-            creature_image_path = os.path.join("static", "images", creature_image_filename)
-            
-            with open(creature_image_path, 'wb') as f:
-                f.write(creature_image_response.content)
-            
-            logger.info(f"Creature image saved to: {creature_image_path}")
+            draft = prefetched.get('concept')
+            if draft:
+                # Refine the concept drafted from the descriptors with the care answer
+                creature_name = draft['name']
+                image_prompt = f"{draft['image_prompt']} Personality reflects {care_context}."
+                logger.info(f"Using prefetched creature concept: {creature_name}")
+            else:
+                creature_name, image_prompt = self._generate_creature_concept(descriptors_text, care_context)
+            stages.mark("concept")
             
-            # Create relative URL for web access
-            creature_image_url = f"/static/images/{creature_image_filename}"
+            # Generate creature image(s) using DALL-E with the dynamic prompt, keeping the best
+            selection = self._generate_images(image_prompt, "creature", candidates, chain_start)
+            creature_image_url, alternate_urls = selection['image_url'], selection['alternate_image_urls']
+            stages.mark("image")
             
-            # Generate creature sound using Text-to-Speech
-            # Phonetic sound bank for baby creatures - unique single words
-            import random
-            selected_sound = random.choice(PHONETIC_SOUNDS)
+            # Generate voice characteristics based on creature traits (optional under a tight deadline)
+            if self._optional_stage("voice", pipeline="hatch"):
+                voice_response = self._call_openai(
+                    "chat.voice",
+                    self.client.chat.completions.create,
+                    **self._voice_request(descriptors_text, care_context)
+                )
+                voice_description = voice_response.choices[0].message.content.strip()
+            else:
+                voice_description = f"A {descriptors_text} voice"
+            stages.mark("voice")
             
-            # Generate voice characteristics based on creature traits
-            voice_prompt = get_voice_description_prompt(descriptors_text, care_context)
+            # Generate audio using Text-to-Speech (unless it was prefetched; optional under a tight deadline)
+            audio_encoding = None
+            if sound:
+                audio_url, audio_encoding = sound['audio_url'], sound.get('audio_encoding')
+            elif self._optional_stage("sound", pipeline="hatch"):
+                try:
+                    generated = self._generate_creature_sound(creature_id, selected_sound)
+                    audio_url = generated_audio_url = generated['audio_url']
+                    audio_encoding = generated['audio_encoding']
+                except DeadlineExceeded:
+                    raise
+                except Exception as audio_error:
+                    logger.error(f"Audio generation error: {audio_error}")
+                    audio_url = None
+            else:
+                audio_url = None
+            stages.mark("sound")
             
-            voice_response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": voice_prompt
-                    }
-                ],
-                max_tokens=100
+            creature_data = self._new_creature_record(
+                creature_id, creature_name, egg, creature_image_url,
+                selected_sound, voice_description, audio_url, care_responses
             )
-            
-            voice_description = voice_response.choices[0].message.content.strip()
-            
-            # Creature name is already generated from the concept call above
-            
-            # Generate audio using Text-to-Speech
-            try:
-                audio_response = self.client.audio.speech.create(
-                    model="tts-1",
-                    voice="alloy",  # Good for creature-like sounds
-                    input=selected_sound
-                )
-                
-                # Create creature ID first for audio filename
-                creature_id = str(uuid.uuid4())
-                
-                # Save audio file
-                audio_filename = f"creature_sound_{creature_id}.mp3"
-                audio_path = os.path.join("static", "audio", audio_filename)
-                
-                # Ensure audio directory exists
-                os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-                
-                # Save the audio file
-                audio_response.stream_to_file(audio_path)
-                
-                # Create relative URL for web access
-                audio_url = f"/static/audio/{audio_filename}"
-                
-                sound_data = {
-                    "sound_text": selected_sound,
-                    "sound_name": f"{selected_sound.lower().replace('!', '').replace(' ', '_')}_sound",
-                    "voice_description": voice_description,
-                    "audio_url": audio_url
-                }
-                
-            except Exception as audio_error:
-                logger.error(f"Audio generation error: {audio_error}")
-                sound_data = {
-                    "sound_text": selected_sound,
-                    "sound_name": f"{selected_sound.lower().replace('!', '').replace(' ', '_')}_sound",
-                    "voice_description": voice_description,
-                    "audio_url": None
-                }
-            
-            # Create creature data
-            creature_data = {
-                "id": creature_id,
-                "name": creature_name,
-                "egg_id": egg.get('id'),
-                "image_url": creature_image_url,
-                "sound_text": sound_data.get("sound_text", ""),
-                "sound_name": sound_data.get("sound_name", ""),
-                "voice_description": sound_data.get("voice_description", ""),
-                "audio_url": sound_data.get("audio_url", ""),
-                "care_responses": care_responses,
-                "hatched_at": datetime.now().isoformat(),
-                "egg_traits": egg.get('descriptors', []),
-                "egg_description": egg.get('description', '')
-            }
+            self._add_selection(creature_data, selection)
+            if audio_encoding:
+                from audio_processing import ENCODING_FIELD
+                creature_data[ENCODING_FIELD] = audio_encoding
             
             # Save creature data
+            check_deadline("save")
             self._save_creature_data(creature_data)
+            stages.mark("save")
+            self._index_record('creature', creature_data)
+            stages.mark("index")
             
             return {
                 "success": True,
                 "creature": creature_data,
+                "usage": self._usage_for('creature', creature_id),
                 "message": "Creature hatched successfully!"
             }
             
+        except DeadlineExceeded:
+            self._discard_files(creature_image_url, generated_audio_url, *alternate_urls)
+            raise
         except Exception as e:
             logger.error(f"Error creating creature: {str(e)}")
             return {
@@ -487,20 +696,262 @@ class EggCreator:
                 "message": "Failed to create creature"
             }
     
-    def _save_creature_data(self, creature_data):
-        """Save creature data to a JSON file"""
+    def _pick_creature_sound(self, prefetched):
+        """(prefetched sound or None, creature id, phonetic sound text) for a hatch"""
+        sound = prefetched.get('sound')
+        if sound:
+            return sound, sound['creature_id'], sound['sound_text']
+        return None, str(uuid.uuid4()), random.choice(PHONETIC_SOUNDS)
+    
+    def _care_context(self, care_responses):
+        """Phrase describing the care answer, for the concept and voice prompts"""
+        # Get the single care response (could be any of the question types)
+        care_response = list(care_responses.values())[0] if care_responses else 'with love and care'
+        care_question_id = list(care_responses.keys())[0] if care_responses else 'general'
+        
+        # Create context based on the type of question asked
+        if care_question_id == 'activities':
+            return f"enjoyed activities like {care_response}"
+        elif care_question_id == 'feelings':
+            return f"made you feel {care_response}"
+        elif care_question_id == 'time_spent':
+            return f"spent {care_response} together"
+        elif care_question_id == 'description':
+            return f"described as {care_response}"
+        elif care_question_id == 'sounds':
+            return f"made sounds like {care_response}"
+        elif care_question_id == 'favorite_thing':
+            return f"loved for {care_response}"
+        elif care_question_id == 'comfort':
+            return f"comforted by {care_response}"
+        elif care_question_id == 'whispers':
+            return f"heard whispers of {care_response}"
+        elif care_question_id == 'favorite_spot':
+            return f"loved being in {care_response}"
+        elif care_question_id == 'celebration':
+            return f"celebrated with {care_response}"
+        else:
+            return f"cared for with {care_response}"
+    
+    def _image_request(self, prompt):
+        """Image generation arguments shared by eggs and creatures"""
+        return {
+            "model": "dall-e-3",
+            "prompt": prompt,
+            "size": "1024x1024",
+            "quality": "standard",
+            "n": 1
+        }
+    
+    def _voice_request(self, descriptors_text, care_context):
+        """Chat completion arguments for the voice description call"""
+        return {
+            "model": "gpt-4o",
+            "messages": VOICE_DESCRIPTION_TEMPLATE.messages(descriptors_text=descriptors_text, care_context=care_context),
+            "max_tokens": 100
+        }
+    
+    def _new_creature_record(self, creature_id, creature_name, egg, image_url, sound_text,
+                             voice_description, audio_url, care_responses):
+        return {
+            "id": creature_id,
+            "name": creature_name,
+            "egg_id": egg.get('id'),
+            "image_url": image_url,
+            "sound_text": sound_text,
+            "sound_name": f"{sound_text.lower().replace('!', '').replace(' ', '_')}_sound",
+            "voice_description": voice_description,
+            "audio_url": audio_url,
+            "care_responses": care_responses,
+            "hatched_at": datetime.now().isoformat(),
+            "egg_traits": egg.get('descriptors', []),
+            "egg_description": egg.get('description', '')
+        }
+    
+    def _usage_for(self, kind, record_id):
+        """Token/cost roll-up for a record, or None if the ledger is unavailable"""
         try:
-            creatures_file = "creatures_data.json"
-            creatures = []
+            return get_usage_ledger().record_usage(kind, record_id)
+        except Exception as e:
+            logger.error(f"Error reading usage: {e}")
+            return None
+    
+    def _generate_creature_concept(self, descriptors_text, care_context):
+        """Generate a creature name and image prompt using GPT"""
+        concept_response = self._call_openai(
+            "chat.concept",
+            self.client.chat.completions.create,
+            **self._concept_request(descriptors_text, care_context)
+        )
+        return self._parse_creature_concept(
+            concept_response.choices[0].message.content, descriptors_text, care_context
+        )
+    
+    def _concept_request(self, descriptors_text, care_context):
+        """Chat completion arguments for the creature concept call"""
+        return {
+            "model": "gpt-4o",
+            "messages": CREATURE_CONCEPT_TEMPLATE.messages(descriptors_text=descriptors_text, care_context=care_context),
+            "max_tokens": 300
+        }
+    
+    def _parse_creature_concept(self, concept_content, descriptors_text, care_context):
+        """Creature name and image prompt from the concept response (fallback prompt if it isn't JSON)"""
+        concept_content = concept_content.strip()
+        logger.info(f"Creature concept response: {concept_content}")
+        
+        # Parse the JSON response to get name and image prompt
+        try:
+            # Clean the response content - remove markdown code blocks if present
+            cleaned_content = concept_content.strip()
+            if cleaned_content.startswith('```json'):
+                # Remove markdown code block formatting
+                cleaned_content = re.sub(r'^```json\s*', '', cleaned_content)
+                cleaned_content = re.sub(r'\s*```$', '', cleaned_content)
+            elif cleaned_content.startswith('```'):
+                # Remove generic markdown code block formatting
+                cleaned_content = re.sub(r'^```\s*', '', cleaned_content)
+                cleaned_content = re.sub(r'\s*```$', '', cleaned_content)
             
-            if os.path.exists(creatures_file):
-                with open(creatures_file, 'r') as f:
-                    creatures = json.load(f)
+            concept_data = json.loads(cleaned_content)
+            creature_name = concept_data.get('name', 'Unknown')
+            image_prompt = concept_data.get('image_prompt', '')
             
-            creatures.append(creature_data)
+            if not image_prompt:
+                # Fallback to original prompt if parsing fails
+                image_prompt = get_creature_creation_prompt(descriptors_text, care_context)
+                logger.warning("Failed to parse image prompt from concept response, using fallback")
             
-            with open(creatures_file, 'w') as f:
-                json.dump(creatures, f, indent=2)
+            logger.info(f"Generated creature name: {creature_name}")
+            logger.info(f"Generated image prompt: {image_prompt}")
+            
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Error parsing concept response: {e}")
+            logger.error(f"Raw response content: {concept_content}")
+            # Fallback to original prompt and generate name separately
+            image_prompt = get_creature_creation_prompt(descriptors_text, care_context)
+            creature_name = "Unknown"
+            logger.warning("Using fallback prompts due to parsing error")
+        
+        return creature_name, image_prompt
+    
+    def _generate_creature_sound(self, creature_id, selected_sound):
+        """
+        Speak the creature's sound with TTS, compact and save it.
+        Returns {"audio_url", "audio_encoding" (None if it was kept as TTS returned it)}
+        """
+        audio_response = self._call_openai(
+            "audio.speech",
+            self.client.audio.speech.create,
+            **self._speech_request(selected_sound)
+        )
+        store = get_media_store()
+        audio_path = store.temp_path("audio")
+        
+        # Stream the audio to a temp file, then move it into the media store under its hash
+        with get_metrics().time("hatch_file_write_duration_seconds", kind="audio"):
+            audio_response.stream_to_file(audio_path)
+        encoding = None
+        if get_audio_processor():
+            with open(audio_path, 'rb') as f:
+                content, encoding = self._compact_sound(f.read())
+            if encoding:
+                with open(audio_path, 'wb') as f:
+                    f.write(content)
+        with get_metrics().time("hatch_file_write_duration_seconds", kind="audio"):
+            size = os.path.getsize(audio_path)
+            audio_url = store.put_file(audio_path, "audio")
+        get_metrics().inc("hatch_file_write_bytes_total", size, kind="audio")
+        
+        return {"audio_url": audio_url, "audio_encoding": encoding}
+    
+    def _save_sound(self, content):
+        """_generate_creature_sound's result for TTS bytes already in memory"""
+        content, encoding = self._compact_sound(content)
+        return {"audio_url": self._store_media(content, "audio", "audio"), "audio_encoding": encoding}
+    
+    def _compact_sound(self, content):
+        """(content, encoding): the clip trimmed, normalized and re-encoded, or as it was (encoding None)"""
+        from audio_processing import AudioProcessingError
+        
+        processor = get_audio_processor()
+        if processor is None:
+            return content, None
+        metrics = get_metrics()
+        try:
+            with metrics.time("hatch_audio_processing_duration_seconds"):
+                compacted, info = processor.compact(content)
+        except AudioProcessingError as e:
+            logger.error(f"Audio processing error, keeping the TTS clip: {e}")
+            metrics.inc("hatch_audio_processing_total", result="failed")
+            return content, None
+        metrics.inc("hatch_audio_processing_total", result="compacted")
+        metrics.inc("hatch_audio_bytes_saved_total", info['bytes_before'] - info['bytes_after'])
+        logger.info(f"Compacted creature sound: {info['bytes_before']} -> {info['bytes_after']} bytes, "
+                    f"{info['seconds_before']} -> {info['seconds_after']} s", extra=info)
+        return compacted, info['encoding']
+    
+    def _speech_request(self, selected_sound):
+        return {
+            "model": "tts-1",
+            "voice": "alloy",  # Good for creature-like sounds
+            "input": selected_sound
+        }
+    
+    def prefetch_hatch(self, egg_id, draft_concept=False):
+        """
+        Stages of create_creature_from_egg that don't depend on the care answer,
+        as callables for the HatchPrefetcher
+        """
+        scope = current_scope()
+        
+        def lookup_egg():
+            egg = _find_egg(egg_id)
+            if egg is None:
+                raise ValueError(f"Egg {egg_id} not found")
+            return egg
+        
+        def make_sound():
+            creature_id = str(uuid.uuid4())
+            selected_sound = random.choice(PHONETIC_SOUNDS)
+            set_usage_scope(**{**scope, "kind": "creature", "record_id": creature_id})
+            return {
+                "creature_id": creature_id,
+                "sound_text": selected_sound,
+                **self._generate_creature_sound(creature_id, selected_sound)
+            }
+        
+        def warm_connection():
+            # Cheap authenticated request so the hatch reuses an open TLS connection
+            self._call_openai("models.list", self.client.models.list)
+            return True
+        
+        tasks = {
+            "egg": lookup_egg,
+            "sound": make_sound,
+            "warm": warm_connection
+        }
+        
+        if draft_concept:
+            def draft():
+                set_usage_scope(**{**scope, "kind": "concept_draft", "record_id": egg_id})
+                egg = lookup_egg()
+                name, image_prompt = self._generate_creature_concept(
+                    ", ".join(egg.get('descriptors', [])),
+                    "cared for with love and care"
+                )
+                return {"name": name, "image_prompt": image_prompt}
+            tasks["concept"] = draft
+        
+        return tasks
+    
+    def _save_creature_data(self, creature_data):
+        """Save creature data to a JSON file"""
+        try:
+            with get_metrics().time("hatch_storage_duration_seconds", store="creatures", op="write"):
+                get_record_store("creatures_data.json").append(creature_data)
+            get_media_store().ref(creature_data.get('image_url'), creature_data.get('audio_url'),
+                                  *creature_data.get('alternate_image_urls', []))
             
             # Update egg status to hatched
             self._update_egg_status(creature_data.get('egg_id'), 'hatched')
@@ -511,32 +962,692 @@ class EggCreator:
     def _update_egg_status(self, egg_id, status):
         """Update egg status in eggs_data.json"""
         try:
-            eggs_file = "eggs_data.json"
-            if os.path.exists(eggs_file):
-                with open(eggs_file, 'r') as f:
-                    eggs = json.load(f)
+            if os.path.exists("eggs_data.json"):
+                with get_metrics().time("hatch_storage_duration_seconds", store="eggs", op="write"):
+                    updated_egg = get_record_store("eggs_data.json").update(egg_id, status=status)
                 
-                # Find and update the egg status
-                for egg in eggs:
-                    if egg['id'] == egg_id:
-                        egg['status'] = status
-                        break
-                
-                with open(eggs_file, 'w') as f:
-                    json.dump(eggs, f, indent=2)
+                if updated_egg:
+                    self._index_record('egg', updated_egg)
                     
         except Exception as e:
             logger.error(f"Error updating egg status: {e}")
 
+# Guards the construction of the process-wide clients below (gthread workers
+# can otherwise race to build them on their first concurrent requests)
+_clients_lock = threading.RLock()
+
+# Initialize OpenAI client factory - one pooled client per process, built on first use
+openai_clients = None
+
+def get_openai_clients():
+    global openai_clients
+    if openai_clients is None:
+        with _clients_lock:
+            if openai_clients is None:
+                openai_clients = OpenAIClientFactory(
+                    api_key=app.config['OPENAI_API_KEY'],
+                    base_url=app.config.get('OPENAI_BASE_URL'),
+                    max_connections=app.config.get('OPENAI_MAX_CONNECTIONS', 20),
+                    max_keepalive=app.config.get('OPENAI_MAX_KEEPALIVE', 10),
+                    keepalive_expiry=app.config.get('OPENAI_KEEPALIVE_EXPIRY', 60.0),
+                    http2=app.config.get('OPENAI_HTTP2', False),
+                    # EggCreator._call_openai retries, so retries can stop at the request deadline
+                    max_retries=0,
+                    on_event=lambda event: get_metrics().inc("hatch_openai_connections_total", event=event)
+                )
+    return openai_clients
+
+def get_openai_client():
+    return get_openai_clients().get()
+
 # Initialize egg creator - will be created when needed
 egg_creator = None
 
 def get_egg_creator():
     global egg_creator
     if egg_creator is None:
-        egg_creator = EggCreator()
+        with _clients_lock:
+            if egg_creator is None:
+                egg_creator = EggCreator()
     return egg_creator
 
+def _reset_clients_after_fork():
+    """
+    Under gunicorn --preload the app is imported once in the master and forked.
+    An egg creator built there holds the master's client; the workers build
+    their own (the client factory also rebuilds its client per process).
+    Each worker also schedules its own generation slots and follows its own image re-runs.
+    """
+    global egg_creator, scheduler, record_stores, media_store, image_selector, audio_sprites, search_index, usage_ledger
+    egg_creator = None
+    scheduler = None
+    image_selector = None
+    audio_sprites = None
+    record_stores = {}
+    # SQLite connections must not cross a fork
+    media_store = None
+    search_index = None
+    usage_ledger = None
+
+os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+# Initialize metrics - shared across gunicorn workers through METRICS_DIR
+metrics = None
+
+def _build_metrics():
+    """The registry with every metric the app records declared"""
+    registry = Metrics(
+        app.config.get('METRICS_DIR', 'metrics_data'),
+        enabled=app.config.get('METRICS_ENABLED', True)
+    )
+    registry.histogram("hatch_http_request_duration_seconds", "Flask request latency by route",
+                       buckets=sorted(set(IO_BUCKETS + API_BUCKETS)))
+    registry.histogram("hatch_openai_request_duration_seconds", "OpenAI API call latency", buckets=API_BUCKETS)
+    registry.counter("hatch_openai_tokens_total", "Tokens reported by OpenAI API responses")
+    registry.counter("hatch_openai_cost_usd_total", "Estimated OpenAI spend in USD")
+    registry.counter("hatch_openai_connections_total",
+                     "OpenAI API requests on a new vs. reused pooled connection, and TLS handshakes")
+    registry.histogram("hatch_download_duration_seconds", "Generated image download latency",
+                       buckets=sorted(set(IO_BUCKETS + API_BUCKETS)))
+    registry.counter("hatch_download_bytes_total", "Bytes of generated images downloaded")
+    registry.histogram("hatch_file_write_duration_seconds", "Image and audio file write latency")
+    registry.counter("hatch_file_write_bytes_total", "Bytes of images and audio written")
+    registry.histogram("hatch_storage_duration_seconds", "Egg/creature JSON storage read and write latency")
+    registry.histogram("hatch_storage_commit_batch_size", "Writes applied per egg/creature JSON group commit",
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+    registry.counter("hatch_storage_commit_bytes_total", "Bytes written by egg/creature JSON group commits")
+    registry.counter("hatch_media_puts_total", "Media writes by kind and result (stored or deduplicated)")
+    registry.counter("hatch_media_deduplicated_bytes_total", "Bytes not written because identical media was already stored")
+    registry.counter("hatch_media_served_total", "Media responses by how they were served (redirect or file)")
+    registry.counter("hatch_media_url_checks_total",
+                     "Media requests by how they were authorized (signed URL, session) or why they were refused")
+    registry.counter("hatch_spend_alarms_total", "Spend alarms triggered")
+    registry.histogram("hatch_stage_duration_seconds", "Egg creation and hatch pipeline stage latency",
+                       buckets=sorted(set(IO_BUCKETS + API_BUCKETS)))
+    registry.gauge("hatch_scheduler_queue_depth", "Generation requests waiting for a scheduler slot, by lane")
+    registry.gauge("hatch_scheduler_running", "Generation requests holding a scheduler slot, by lane")
+    registry.histogram("hatch_scheduler_wait_seconds", "Time generation requests waited for a scheduler slot",
+                       buckets=sorted(set(IO_BUCKETS + API_BUCKETS)))
+    registry.counter("hatch_scheduler_rejected_total", "Generation requests turned away by the scheduler")
+    registry.counter("hatch_request_aborts_total",
+                     "Generation requests stopped by their deadline or a client disconnect, by stage")
+    registry.counter("hatch_stages_skipped_total", "Optional pipeline stages skipped for lack of deadline budget")
+    registry.counter("hatch_image_candidates_total",
+                     "Generated image candidates by pipeline and result (accepted, rejected by the score, failed)")
+    registry.counter("hatch_image_selections_total",
+                     "Multi-candidate image selections by whether an acceptable candidate was found")
+    registry.counter("hatch_audio_processing_total", "Creature sounds compacted, or kept as TTS returned them after a failure")
+    registry.counter("hatch_audio_bytes_saved_total", "Bytes of creature sounds saved by compacting them")
+    registry.histogram("hatch_audio_processing_duration_seconds", "Time to trim, normalize and re-encode a creature sound")
+    registry.counter("hatch_audio_sprites_total",
+                     "Gallery audio sprite requests by result (cached, stale while a new one builds, building)")
+    registry.counter("hatch_response_compression_total", "Dynamic responses compressed on the fly, by encoding")
+    registry.counter("hatch_response_compression_bytes_saved_total", "Bytes saved by compressing dynamic responses")
+    registry.histogram("hatch_response_compression_duration_seconds", "Time to compress a dynamic response")
+    registry.counter("hatch_static_assets_served_total", "Fingerprinted static assets served, by pre-encoded variant")
+    registry.counter("hatch_image_reruns_total", "Create-egg / hatch requests repeating an earlier one within the re-run window")
+    registry.histogram("hatch_image_scoring_duration_seconds", "Local scoring time of a set of image candidates")
+    registry.histogram("hatch_time_to_satisfactory_image_seconds",
+                       "Time from the first attempt of a create-egg / hatch (re-runs included) to an acceptable image",
+                       buckets=sorted(set(API_BUCKETS + (120, 300, 600))))
+    registry.counter("hatch_prompt_cache_lookups_total",
+                     "Create-egg prompt cache lookups by result (exact or fingerprint hit, miss, bypassed by fresh)")
+    registry.counter("hatch_egg_pool_requests_total", "Create-egg requests the kiosk pool served (hit) or couldn't (miss)")
+    registry.gauge("hatch_egg_pool_depth", "Ready eggs in the kiosk pool, by cluster")
+    registry.gauge("hatch_egg_pool_oldest_age_seconds", "Age of the oldest ready egg in the kiosk pool, by cluster")
+    registry.gauge("hatch_egg_pool_budget_remaining", "Kiosk pool generations left in the current hourly budget")
+    registry.stage_listeners.append(_log_stage)
+    registry.collectors.append(_egg_pool_gauges)
+    return registry
+
+def get_metrics():
+    global metrics
+    if metrics is None:
+        with _clients_lock:
+            if metrics is None:
+                metrics = _build_metrics()
+    return metrics
+
+# Initialize usage ledger - will be opened when needed
+usage_ledger = None
+
+def get_usage_ledger():
+    global usage_ledger
+    if usage_ledger is None:
+        with _clients_lock:
+            if usage_ledger is None:
+                prices = app.config.get('USAGE_PRICES')
+                usage_ledger = UsageLedger(
+                    app.config.get('USAGE_DB_PATH', 'usage.db'),
+                    prices=json.loads(prices) if prices else None,
+                    daily_alarm_usd=app.config.get('USAGE_ALARM_DAILY_USD'),
+                    session_alarm_usd=app.config.get('USAGE_ALARM_SESSION_USD'),
+                    record_alarm_usd=app.config.get('USAGE_ALARM_RECORD_USD'),
+                    on_alarm=lambda alarm: get_metrics().inc("hatch_spend_alarms_total", scope=alarm['scope'])
+                )
+    return usage_ledger
+
+def _usage_session_id():
+    """Stable id for the logged-in browser session (sessions from before usage tracking get one lazily)"""
+    if 'authenticated' not in session:
+        return None
+    if 'usage_id' not in session:
+        session['usage_id'] = uuid.uuid4().hex
+    return session['usage_id']
+
+# Initialize generation scheduler - one per worker process, built on first use
+scheduler = None
+
+def _scheduler_depth(lane, waiting, running):
+    get_metrics().set("hatch_scheduler_queue_depth", waiting, lane=lane)
+    get_metrics().set("hatch_scheduler_running", running, lane=lane)
+
+def get_scheduler():
+    global scheduler
+    if scheduler is None and app.config.get('SCHEDULER_ENABLED', True):
+        with _clients_lock:
+            if scheduler is None:
+                scheduler = FairScheduler(
+                    slots=app.config.get('SCHEDULER_SLOTS', 8),
+                    batch_slots=app.config.get('SCHEDULER_BATCH_SLOTS', 4),
+                    interactive_weight=app.config.get('SCHEDULER_INTERACTIVE_WEIGHT', 4),
+                    max_queued_per_session=app.config.get('SCHEDULER_MAX_QUEUED_PER_SESSION', 4),
+                    max_wait_seconds=app.config.get('SCHEDULER_MAX_WAIT_SECONDS', 120.0),
+                    on_wait=lambda lane, seconds: get_metrics().observe("hatch_scheduler_wait_seconds", seconds, lane=lane),
+                    on_depth=_scheduler_depth
+                )
+    return scheduler
+
+def _request_lane():
+    """Bulk clients mark their requests with X-Hatch-Priority: batch"""
+    return "batch" if request.headers.get('X-Hatch-Priority', '').lower() == 'batch' else "interactive"
+
+def _generation_slot(lane=None, session_id=None):
+    """Wait for this session's turn to run generation work (a no-op when scheduling is disabled)"""
+    current = get_scheduler()
+    if current is None:
+        return nullcontext()
+    deadline = current_deadline()
+    timeout = min(current.max_wait_seconds, max(deadline.remaining(), 0)) if deadline is not None else None
+    return current.slot(session_id or _usage_session_id(), lane or _request_lane(), timeout=timeout)
+
+def _start_deadline():
+    """
+    Deadline for this generation request, from X-Hatch-Deadline or REQUEST_DEADLINE_SECONDS.
+    Under gunicorn (and the dev server) the client's socket is polled between stages.
+    """
+    seconds = parse_budget(
+        request.headers.get('X-Hatch-Deadline'),
+        app.config.get('REQUEST_DEADLINE_SECONDS', 90),
+        app.config.get('REQUEST_DEADLINE_MAX_SECONDS', 300)
+    )
+    deadline = None
+    if seconds is not None:
+        sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+        deadline = Deadline(seconds, is_disconnected=(lambda: socket_disconnected(sock)) if sock is not None else None)
+    set_deadline(deadline)
+    return deadline
+
+def _deadline_response(error):
+    """504 when the budget ran out; nobody reads the response of a client that disconnected"""
+    route = request.url_rule.rule if request.url_rule else request.path
+    get_metrics().inc("hatch_request_aborts_total", route=route, stage=error.stage, reason=error.reason)
+    logger.warning(f"Stopped {route} at {error.stage}: {error}", extra={"stage": error.stage, "reason": error.reason})
+    return jsonify({
+        "success": False,
+        "error": str(error),
+        "message": "Request took longer than its deadline" if error.reason == "deadline" else "Client disconnected"
+    }), 499 if isinstance(error, ClientDisconnected) else 504
+
+def _scheduler_busy(error):
+    """429 when the session has too much queued, 503 when no slot freed up in time"""
+    full = isinstance(error, QueueFull)
+    get_metrics().inc("hatch_scheduler_rejected_total", reason="queue_full" if full else "timeout")
+    response = jsonify({
+        "success": False,
+        "error": str(error),
+        "message": "Too many requests waiting, try again shortly" if full else "Server busy, try again shortly"
+    })
+    response.headers['Retry-After'] = '5' if full else '30'
+    return response, 429 if full else 503
+
+def _log_stage(labels, stage, start, end):
+    """Stage timings as (sampled) debug records, tagged with the request id"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"{labels.get('pipeline')} stage {stage} took {(end - start) * 1000:.1f}ms",
+                     extra={**labels, "stage": stage, "duration_ms": round((end - start) * 1000, 2)})
+
+# Initialize record stores - one group-committing writer per JSON file per process
+record_stores = {}
+
+def get_record_store(records_file):
+    store = record_stores.get(records_file)
+    if store is None:
+        with _clients_lock:
+            store = record_stores.get(records_file)
+            if store is None:
+                name = os.path.splitext(os.path.basename(records_file))[0].replace('_data', '')
+                
+                def on_commit(batch_size, seconds, size_bytes):
+                    get_metrics().observe("hatch_storage_duration_seconds", seconds, store=name, op="commit")
+                    get_metrics().observe("hatch_storage_commit_batch_size", batch_size, store=name)
+                    get_metrics().inc("hatch_storage_commit_bytes_total", size_bytes, store=name)
+                
+                store = record_stores[records_file] = RecordStore(
+                    records_file,
+                    fsync=app.config.get('RECORDS_FSYNC', True),
+                    commit_window=app.config.get('RECORDS_COMMIT_WINDOW_MS', 0) / 1000,
+                    on_commit=on_commit
+                )
+    return store
+
+# Initialize media store - content-addressed images and audio, opened when needed
+media_store = None
+
+def _media_stored(kind, size, deduplicated):
+    get_metrics().inc("hatch_media_puts_total", kind=kind, result="deduplicated" if deduplicated else "stored")
+    if deduplicated:
+        get_metrics().inc("hatch_media_deduplicated_bytes_total", size, kind=kind)
+
+def get_media_store():
+    global media_store
+    if media_store is None:
+        with _clients_lock:
+            if media_store is None:
+                from media_backends import backend_from_config
+                from media_store import MediaStore
+                
+                root = app.config.get('STATIC_FOLDER', 'static')
+                media_store = MediaStore(
+                    root,
+                    app.config.get('MEDIA_INDEX_PATH', 'media_index.db'),
+                    on_put=_media_stored,
+                    backend=backend_from_config(app.config, root=root)
+                )
+    return media_store
+
+# Initialize media URL signer - stateless, so one per process is fine across forks
+media_url_signer = None
+
+def get_media_url_signer():
+    """The signer for media URLs handed out by the API, or None when MEDIA_SIGNED_URLS is off"""
+    global media_url_signer
+    if media_url_signer is None and app.config.get('MEDIA_SIGNED_URLS', True):
+        with _clients_lock:
+            if media_url_signer is None:
+                media_url_signer = signer_from_config(app.config)
+    return media_url_signer
+
+def _signed_records(records):
+    """Copies of egg/creature records with signed media URLs (the stored records keep the plain ones)"""
+    signer = get_media_url_signer()
+    if signer is None:
+        return records
+    return [signer.sign_record(record) for record in records]
+
+def _signed_result(result):
+    """A create-egg / hatch-creature response with the new record's media URLs signed"""
+    signer = get_media_url_signer()
+    if signer is None or not isinstance(result, dict):
+        return result
+    result = dict(result)
+    for key in ('egg', 'creature'):
+        if isinstance(result.get(key), dict):
+            result[key] = signer.sign_record(result[key])
+    return result
+
+def get_collection_archive():
+    """Export/import of the egg and creature files plus their media (cheap; built per request)"""
+    from collection_archive import CollectionArchive
+    
+    return CollectionArchive(get_media_store(), {
+        "eggs": get_record_store("eggs_data.json"),
+        "creatures": get_record_store("creatures_data.json")
+    })
+
+def _index_imported(kind, records):
+    """Add a batch of imported records to the search and similarity indexes"""
+    try:
+        index = get_search_index()
+        for record in records:
+            if kind == 'eggs':
+                index.add_egg(record)
+            else:
+                index.add_creature(record)
+        if kind == 'eggs':
+            similar = get_similarity_index()
+            for record in records:
+                similar.add(record['id'], record.get('description', ''), record.get('descriptors', []))
+    except Exception as e:
+        logger.error(f"Error indexing imported {kind}: {e}")
+
+def _load_records(records_file):
+    """Load a JSON list of records, or an empty list if the file doesn't exist yet"""
+    store = os.path.splitext(os.path.basename(records_file))[0].replace('_data', '')
+    with get_metrics().time("hatch_storage_duration_seconds", store=store, op="read"):
+        if os.path.exists(records_file):
+            with open(records_file, 'r') as f:
+                return json.load(f)
+        return []
+
+def _find_egg(egg_id):
+    """Look up a single egg record by id"""
+    return next((e for e in _load_records("eggs_data.json") if e['id'] == egg_id), None)
+
+# Initialize search index - will be opened (and rebuilt if stale) when needed
+search_index = None
+
+def get_search_index():
+    global search_index
+    if search_index is None:
+        with _clients_lock:
+            if search_index is None:
+                index = SearchIndex(app.config.get('SEARCH_INDEX_PATH', 'search_index.db'))
+                
+                # Rebuild from the JSON files if the index is missing records
+                eggs = _load_records("eggs_data.json")
+                creatures = _load_records("creatures_data.json")
+                if index.count() != len(eggs) + len(creatures):
+                    index.rebuild(eggs, creatures)
+                
+                search_index = index
+    return search_index
+
+# Initialize similarity index - will be opened (and rebuilt if stale) when needed
+similarity_index = None
+
+def get_similarity_index():
+    global similarity_index
+    if similarity_index is None:
+        with _clients_lock:
+            if similarity_index is None:
+                from similarity import SimilarityIndex
+                
+                index = SimilarityIndex(
+                    app.config.get('SIMILARITY_INDEX_DIR', 'similarity_index'),
+                    dimensions=app.config.get('SIMILARITY_DIMENSIONS', 512)
+                )
+                
+                eggs = _load_records("eggs_data.json")
+                if len(index) != len(eggs):
+                    index.rebuild(eggs)
+                
+                similarity_index = index
+    return similarity_index
+
+# Initialize image selector - scores candidate images and follows re-runs
+image_selector = None
+
+def get_image_selector():
+    global image_selector
+    if image_selector is None:
+        with _clients_lock:
+            if image_selector is None:
+                image_selector = ImageSelector(
+                    threshold=app.config.get('IMAGE_SCORE_THRESHOLD', 0.55),
+                    max_text=app.config.get('IMAGE_MAX_TEXT', 0.05),
+                    rerun_window=app.config.get('IMAGE_RERUN_WINDOW_SECONDS', 900)
+                )
+    return image_selector
+
+# Initialize audio processor - None when disabled or ffmpeg isn't installed
+audio_processor = None
+audio_sprites = None
+
+def get_audio_processor():
+    global audio_processor
+    if audio_processor is None and app.config.get('AUDIO_PROCESSING_ENABLED', True):
+        from audio_processing import AudioProcessor
+        
+        processor = AudioProcessor(
+            ffmpeg=app.config.get('FFMPEG_PATH', 'ffmpeg'),
+            bitrate=app.config.get('AUDIO_BITRATE', '32k')
+        )
+        if not processor.available():
+            logger.warning(f"ffmpeg not found ({processor.ffmpeg}): creature sounds are stored as TTS returns them")
+            app.config['AUDIO_PROCESSING_ENABLED'] = False
+            return None
+        audio_processor = processor
+    return audio_processor
+
+def get_audio_sprites():
+    global audio_sprites
+    if audio_sprites is None and get_audio_processor():
+        with _clients_lock:
+            if audio_sprites is None:
+                from audio_processing import AudioSprites
+                
+                audio_sprites = AudioSprites(
+                    app.config.get('AUDIO_SPRITE_PATH', 'audio_sprites.json'),
+                    get_audio_processor(),
+                    get_media_store()
+                )
+    return audio_sprites
+
+def _read_media(url):
+    path = get_media_store().local_path(url)
+    if not path:
+        raise FileNotFoundError(url)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _candidate_count(requested=None):
+    """Image candidates for one generation: the request's choice or IMAGE_CANDIDATES, within 1..IMAGE_CANDIDATES_MAX"""
+    count = requested if requested is not None else app.config.get('IMAGE_CANDIDATES', 1)
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        count = 1
+    return min(max(count, 1), app.config.get('IMAGE_CANDIDATES_MAX', 4))
+
+# Initialize prompt cache - only when enabled in config
+prompt_cache = None
+
+def get_prompt_cache():
+    global prompt_cache
+    if prompt_cache is None and app.config.get('PROMPT_CACHE_ENABLED'):
+        with _clients_lock:
+            if prompt_cache is None:
+                prompt_cache = PromptCache(
+                    app.config.get('PROMPT_CACHE_PATH', 'prompt_cache.json'),
+                    ttl_seconds=app.config.get('PROMPT_CACHE_TTL_SECONDS', 7 * 24 * 3600),
+                    use_fingerprint=app.config.get('PROMPT_CACHE_FINGERPRINT', True),
+                    similarity_threshold=app.config.get('PROMPT_CACHE_SIMILARITY', 0.8)
+                )
+    return prompt_cache
+
+def _generate_pool_image(description, descriptors):
+    """Pre-generate an egg image for the kiosk pool"""
+    prompt = get_egg_creation_prompt(description, ", ".join(descriptors))
+    set_usage_scope(kind="pool")
+    with _generation_slot("batch", session_id="egg-pool"):
+        return get_egg_creator()._generate_egg_image(prompt)
+
+# Initialize egg pool - only when enabled in config (kiosk/event mode)
+egg_pool = None
+
+def get_egg_pool():
+    global egg_pool
+    if egg_pool is None and app.config.get('EGG_POOL_ENABLED'):
+        # Runs from a before_request hook: concurrent first requests must not each start a filler
+        with _clients_lock:
+            if egg_pool is None:
+                clusters = parse_clusters(app.config.get('EGG_POOL_CLUSTERS', ''))
+                if not clusters:
+                    # Fall back to the most popular descriptors in the collection
+                    top = get_search_index().search(limit=0, facet_limit=app.config.get('EGG_POOL_CLUSTER_COUNT', 5))
+                    clusters = [[facet['descriptor']] for facet in top['facets']['descriptors']]
+                
+                pool = EggPool(
+                    app.config.get('EGG_POOL_PATH', 'egg_pool.json'),
+                    generate_image=_generate_pool_image,
+                    clusters=clusters,
+                    depth=app.config.get('EGG_POOL_DEPTH', 3),
+                    budget_per_hour=app.config.get('EGG_POOL_BUDGET_PER_HOUR', 20),
+                    max_age_seconds=app.config.get('EGG_POOL_MAX_AGE_SECONDS', 24 * 3600),
+                    refill_interval=app.config.get('EGG_POOL_REFILL_INTERVAL', 30)
+                )
+                pool.start()
+                egg_pool = pool
+    return egg_pool
+
+def _egg_pool_gauges():
+    """The pool's depth and staleness for /metrics (the pool file is shared, so it is read at scrape time)"""
+    pool = get_egg_pool()
+    if pool is None:
+        return []
+    stats = pool.stats()
+    gauges = [("hatch_egg_pool_budget_remaining", {}, stats["budget_remaining"])]
+    for cluster, depth in stats["clusters"].items():
+        gauges.append(("hatch_egg_pool_depth", {"cluster": cluster}, depth["depth"]))
+        if depth["oldest_age_seconds"] is not None:
+            gauges.append(("hatch_egg_pool_oldest_age_seconds", {"cluster": cluster}, depth["oldest_age_seconds"]))
+    return gauges
+
+# Initialize hatch prefetcher - only when enabled in config
+hatch_prefetcher = None
+
+def get_hatch_prefetcher():
+    global hatch_prefetcher
+    if hatch_prefetcher is None and app.config.get('PREFETCH_ENABLED', True):
+        # One per process: a prefetch started on one instance is invisible to a hatch reading another
+        with _clients_lock:
+            if hatch_prefetcher is None:
+                hatch_prefetcher = HatchPrefetcher(
+                    max_workers=app.config.get('PREFETCH_WORKERS', 4),
+                    ttl_seconds=app.config.get('PREFETCH_TTL_SECONDS', 600)
+                )
+    return hatch_prefetcher
+
+def _discard_prefetched(results):
+    """The TTS clip of an abandoned prefetch is unreferenced; the media GC reclaims it"""
+    sound = results.get('sound')
+    if sound and sound.get('audio_url'):
+        logger.info(f"Abandoned prefetched audio left for media GC: {sound['audio_url']}")
+
+@app.before_request
+def start_egg_pool():
+    """Start the kiosk pool filler on the first request (after any gunicorn fork)"""
+    get_egg_pool()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Media is served from signed URLs without opening the session (see _authorize_media)
+    set_usage_scope(session_id=None if request.endpoint in SESSIONLESS_ENDPOINTS else _usage_session_id())
+    set_deadline(None)  # generation routes start their own; gthread threads are reused
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe route latency, labelled by the URL rule so ids don't explode the label set"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        get_metrics().observe(
+            "hatch_http_request_duration_seconds",
+            time.perf_counter() - start,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip / br a dynamic response (JSON, HTML) above COMPRESS_MIN_BYTES if the client accepts it"""
+    from static_assets import COMPRESSIBLE_TYPES, compress_body
+    
+    if (not app.config.get('COMPRESS_ENABLED', True) or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 206, 304)):
+        return response
+    # Whether or not this client gets it compressed, the body depends on Accept-Encoding
+    response.vary.add('Accept-Encoding')
+    start = time.perf_counter()
+    data = response.get_data()
+    compressed = compress_body(
+        data, response.mimetype, request.headers.get('Accept-Encoding'),
+        min_bytes=app.config.get('COMPRESS_MIN_BYTES', 1024),
+        gzip_level=app.config.get('COMPRESS_GZIP_LEVEL', 6),
+        brotli_quality=app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+    )
+    if compressed is None:
+        return response
+    encoding, body = compressed
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    metrics = get_metrics()
+    metrics.observe("hatch_response_compression_duration_seconds", time.perf_counter() - start)
+    metrics.inc("hatch_response_compression_total", encoding=encoding)
+    metrics.inc("hatch_response_compression_bytes_saved_total", len(data) - len(body))
+    return response
+
+def asset_url(name):
+    """URL of a static asset: its fingerprinted build if there is a current one, else the original file"""
+    from static_assets import get_manifest
+    
+    path = get_manifest().path_for(name)
+    if path is None:
+        return url_for('static', filename=name)
+    return url_for('serve_asset', filename=path)
+
+@app.context_processor
+def static_asset_urls():
+    return {'asset_url': asset_url}
+
+# Initialize request profiler - the hooks are only registered when enabled
+request_profiler = None
+
+if app.config.get('PROFILING_ENABLED'):
+    from profiling import RequestProfiler, record_stage
+    
+    request_profiler = RequestProfiler(
+        app.config.get('PROFILING_DIR', 'profiles'),
+        token=app.config.get('PROFILING_TOKEN'),
+        sample_rate=app.config.get('PROFILING_SAMPLE_RATE', 0.0),
+        mode=app.config.get('PROFILING_MODE', 'sampling'),
+        interval_ms=app.config.get('PROFILING_INTERVAL_MS', 5),
+        max_profiles=app.config.get('PROFILING_MAX_PROFILES', 50)
+    )
+    get_metrics().stage_listeners.append(record_stage)
+    
+    @app.before_request
+    def start_profile():
+        """Profile this request if it carries the admin header or is sampled"""
+        if request_profiler.should_profile(request.headers):
+            try:
+                g.profile = request_profiler.start()
+            except Exception as e:
+                logger.warning(f"Could not start profiler: {e}")
+    
+    def _finish_profile(status):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return None
+        return request_profiler.finish(profile, {
+            "route": request.url_rule.rule if request.url_rule else request.path,
+            "path": request.path,
+            "method": request.method,
+            "status": status
+        })
+    
+    @app.after_request
+    def finish_profile(response):
+        profile_id = _finish_profile(response.status_code)
+        if profile_id:
+            response.headers['X-Hatch-Profile-Id'] = profile_id
+        return response
+    
+    @app.teardown_request
+    def abandon_profile(error=None):
+        """Stop a profile whose request never reached after_request"""
+        _finish_profile(500)
+
+# Routes that must not touch the session: reading it adds Vary: Cookie, which defeats shared caches
+SESSIONLESS_ENDPOINTS = frozenset({'serve_audio', 'serve_image', 'serve_asset', 'authorize_media'})
+
 @app.route('/')
 @login_required
 def index():
@@ -551,6 +1662,14 @@ def health_check():
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint, aggregated across workers (bearer token if METRICS_TOKEN is set)"""
+    token = app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/create-egg', methods=['POST'])
 @login_required
 def create_egg():
@@ -559,6 +1678,8 @@ def create_egg():
         data = request.get_json()
         description = data.get('description', '')
         descriptors = data.get('descriptors', [])
+        fresh = bool(data.get('fresh', False))
+        candidates = data.get('candidates')
         
         if not description or not descriptors:
             return jsonify({
@@ -566,9 +1687,16 @@ def create_egg():
                 "message": "Description and descriptors are required"
             }), 400
         
-        result = get_egg_creator().create_egg_from_metadata(description, descriptors)
-        return jsonify(result)
+        _start_deadline()
+        with _generation_slot():
+            result = get_egg_creator().create_egg_from_metadata(description, descriptors, fresh=fresh,
+                                                                candidates=candidates)
+        return jsonify(_signed_result(result))
         
+    except (QueueFull, QueueTimeout) as e:
+        return _scheduler_busy(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -581,6 +1709,7 @@ def create_egg():
 def analyze_image():
     """API endpoint to analyze an image and generate metadata"""
     try:
+        _start_deadline()
         if 'image' in request.files:
             image_file = request.files['image']
             
@@ -602,7 +1731,8 @@ def analyze_image():
                 }), 400
             
             logger.info(f"Processing image: {image_file.filename}")
-            result = get_egg_creator().analyze_image_to_metadata(image_file)
+            with _generation_slot():
+                result = get_egg_creator().analyze_image_to_metadata(image_file)
             
         else:
             # Handle JSON data (for base64 images)
@@ -620,10 +1750,15 @@ def analyze_image():
                     "message": "No image_data in request"
                 }), 400
             
-            result = get_egg_creator().analyze_image_to_metadata(image_data)
+            with _generation_slot():
+                result = get_egg_creator().analyze_image_to_metadata(image_data)
         
         return jsonify(result)
         
+    except (QueueFull, QueueTimeout) as e:
+        return _scheduler_busy(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
     except Exception as e:
         logger.error(f"API error in analyze_image: {str(e)}")
         return jsonify({
@@ -637,24 +1772,54 @@ def analyze_image():
 def get_eggs():
     """Get all created eggs"""
     try:
-        eggs_file = "eggs_data.json"
-        if os.path.exists(eggs_file):
-            with open(eggs_file, 'r') as f:
-                eggs = json.load(f)
+        return jsonify({
+            "success": True,
+            "eggs": _signed_records(_load_records("eggs_data.json"))
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to retrieve eggs"
+        }), 500
+
+@app.route('/api/eggs/<egg_id>/similar', methods=['GET'])
+@login_required
+def get_similar_eggs(egg_id):
+    """Get the eggs most similar to this one (local TF-IDF cosine similarity)"""
+    try:
+        try:
+            k = min(max(int(request.args.get('k', 5)), 1), 50)
+        except ValueError:
             return jsonify({
-                "success": True,
-                "eggs": eggs
-            })
-        else:
+                "success": False,
+                "message": "k must be an integer"
+            }), 400
+        
+        eggs = {egg['id']: egg for egg in _load_records("eggs_data.json")}
+        if egg_id not in eggs:
             return jsonify({
-                "success": True,
-                "eggs": []
-            })
+                "success": False,
+                "message": "Egg not found"
+            }), 404
+        
+        similar = []
+        for other_id, score in get_similarity_index().similar(egg_id, k=k):
+            if other_id in eggs:
+                similar.append({**eggs[other_id], "similarity": round(score, 4)})
+        
+        return jsonify({
+            "success": True,
+            "egg_id": egg_id,
+            "similar": _signed_records(similar)
+        })
+        
     except Exception as e:
+        logger.error(f"Error finding similar eggs: {str(e)}")
         return jsonify({
             "success": False,
             "error": str(e),
-            "message": "Failed to retrieve eggs"
+            "message": "Failed to find similar eggs"
         }), 500
 
 @app.route('/api/creatures', methods=['GET'])
@@ -662,38 +1827,392 @@ def get_eggs():
 def get_creatures():
     """Get all hatched creatures"""
     try:
-        creatures_file = "creatures_data.json"
-        if os.path.exists(creatures_file):
-            with open(creatures_file, 'r') as f:
-                creatures = json.load(f)
+        return jsonify({
+            "success": True,
+            "creatures": _signed_records(_load_records("creatures_data.json"))
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to retrieve creatures"
+        }), 500
+
+@app.route('/api/creatures/audio-sprite', methods=['GET'])
+@login_required
+def get_creature_audio_sprite():
+    """
+    All creature sounds (or those of ?ids=a,b,c) in one MP3 with an offset map,
+    so a gallery page preloads them in one request
+    """
+    try:
+        sprites = get_audio_sprites()
+        if sprites is None:
             return jsonify({
-                "success": True,
-                "creatures": creatures
-            })
-        else:
+                "success": False,
+                "message": "Audio sprites need ffmpeg (FFMPEG_PATH)"
+            }), 503
+        
+        creatures = _load_records("creatures_data.json")
+        ids = [creature_id for creature_id in request.args.get('ids', '').split(',') if creature_id]
+        if ids:
+            wanted = set(ids)
+            creatures = [creature for creature in creatures if creature.get('id') in wanted]
+        creatures = [creature for creature in creatures
+                     if creature.get('audio_url') and get_media_store().exists(creature['audio_url'])]
+        if not creatures:
+            return jsonify({"success": True, "url": None, "clips": {}})
+        
+        audio_urls = sorted({creature['audio_url'] for creature in creatures})
+        # Never built on the request path: a new sprite is built in the background,
+        # and until then the last one covers the sounds it has
+        sprite, state = sprites.get(audio_urls, _read_media)
+        get_metrics().inc("hatch_audio_sprites_total", result=state)
+        if sprite is None:
+            return jsonify({"success": True, "url": None, "clips": {}, "state": state})
+        
+        clips = {creature['id']: sprite['clips'][creature['audio_url']]
+                 for creature in creatures if creature['audio_url'] in sprite['clips']}
+        signer = get_media_url_signer()
+        return jsonify({
+            "success": True,
+            "url": signer.sign(sprite['url']) if signer else sprite['url'],
+            "bytes": sprite['bytes'],
+            "clips": clips,
+            "state": state
+        })
+    except Exception as e:
+        logger.error(f"Error building audio sprite: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to build audio sprite"
+        }), 500
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search():
+    """Search eggs and creatures by descriptor (AND/OR) and description text"""
+    try:
+        # Accept both ?descriptor=a&descriptor=b and ?descriptor=a,b
+        descriptors = []
+        for value in request.args.getlist('descriptor'):
+            descriptors.extend(d.strip() for d in value.split(',') if d.strip())
+        
+        q = request.args.get('q', '').strip()
+        mode = request.args.get('mode', 'and').lower()
+        kind = request.args.get('type')
+        
+        if mode not in ('and', 'or'):
+            return jsonify({
+                "success": False,
+                "message": "mode must be 'and' or 'or'"
+            }), 400
+        
+        if kind and kind not in ('egg', 'creature'):
+            return jsonify({
+                "success": False,
+                "message": "type must be 'egg' or 'creature'"
+            }), 400
+        
+        try:
+            limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError:
+            return jsonify({
+                "success": False,
+                "message": "limit and offset must be integers"
+            }), 400
+        
+        results = get_search_index().search(
+            descriptors=descriptors,
+            q=q,
+            mode=mode,
+            kind=kind,
+            limit=limit,
+            offset=offset
+        )
+        results["eggs"] = _signed_records(results["eggs"])
+        results["creatures"] = _signed_records(results["creatures"])
+        
+        return jsonify({
+            "success": True,
+            **results
+        })
+        
+    except Exception as e:
+        logger.error(f"Error searching collection: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to search collection"
+        }), 500
+
+@app.route('/api/usage', methods=['GET'])
+@login_required
+def get_usage():
+    """
+    Token and cost summary by stage, model and record
+    ?period=today|all (default today), ?session=current to restrict to this browser session,
+    ?egg_id= / ?creature_id= for a single record
+    """
+    try:
+        ledger = get_usage_ledger()
+        
+        if request.args.get('egg_id'):
+            return jsonify({"success": True, "usage": ledger.record_usage('egg', request.args['egg_id'])})
+        if request.args.get('creature_id'):
+            return jsonify({"success": True, "usage": ledger.record_usage('creature', request.args['creature_id'])})
+        
+        period = request.args.get('period', 'today')
+        if period not in ('today', 'all'):
+            return jsonify({
+                "success": False,
+                "message": "period must be 'today' or 'all'"
+            }), 400
+        
+        since = None
+        if period == 'today':
+            since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        session_id = _usage_session_id() if request.args.get('session') == 'current' else None
+        
+        return jsonify({
+            "success": True,
+            "period": period,
+            "usage": ledger.summary(since=since, session_id=session_id)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting usage: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to get usage"
+        }), 500
+
+@app.route('/api/profiles', methods=['GET'])
+@login_required
+def get_profiles():
+    """List the stored request profiles, newest first"""
+    if request_profiler is None:
+        return jsonify({
+            "success": True,
+            "enabled": False
+        })
+    
+    return jsonify({
+        "success": True,
+        "enabled": True,
+        "profiles": request_profiler.list_profiles()
+    })
+
+@app.route('/api/profiles/<filename>', methods=['GET'])
+@login_required
+def get_profile_file(filename):
+    """Download a profile file (.svg flamegraph, .collapsed stacks, .prof, .txt or .json timeline)"""
+    if request_profiler is None:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    return send_from_directory(os.path.abspath(request_profiler.directory), filename)
+
+@app.route('/api/prompt-cache/stats', methods=['GET'])
+@login_required
+def get_prompt_cache_stats():
+    """Get prompt cache hit/miss metrics"""
+    cache = get_prompt_cache()
+    if cache is None:
+        return jsonify({
+            "success": True,
+            "enabled": False
+        })
+    
+    return jsonify({
+        "success": True,
+        "enabled": True,
+        "stats": cache.stats()
+    })
+
+@app.route('/api/prompt-templates/stats', methods=['GET'])
+@login_required
+def get_prompt_template_stats():
+    """Get each prompt template's static prefix size, token budget use and this worker's cached-token ratio"""
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "min_cacheable_prefix_tokens": prompt_templates.MIN_CACHEABLE_PREFIX_TOKENS,
+        "templates": prompt_templates.stats()
+    })
+
+@app.route('/api/image-selection/stats', methods=['GET'])
+@login_required
+def get_image_selection_stats():
+    """Get this worker's image candidate acceptance rate, re-run rate and mean time to a satisfactory image"""
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "candidates": _candidate_count(),
+        "stats": get_image_selector().stats()
+    })
+
+@app.route('/api/openai-client/stats', methods=['GET'])
+@login_required
+def get_openai_client_stats():
+    """Get this worker's OpenAI connection pool settings and connection reuse counts"""
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "stats": get_openai_clients().stats()
+    })
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+@login_required
+def get_scheduler_stats():
+    """Get this worker's generation queue depth, running slots and wait times per lane"""
+    current = get_scheduler()
+    if current is None:
+        return jsonify({
+            "success": True,
+            "enabled": False
+        })
+    
+    return jsonify({
+        "success": True,
+        "enabled": True,
+        "pid": os.getpid(),
+        "stats": current.stats()
+    })
+
+@app.route('/api/storage/stats', methods=['GET'])
+@login_required
+def get_storage_stats():
+    """Get this worker's egg/creature group-commit counts and batch sizes"""
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "stores": {path: store.stats() for path, store in list(record_stores.items())}
+    })
+
+@app.route('/api/media/stats', methods=['GET'])
+@login_required
+def get_media_stats():
+    """Get stored media files, bytes and reference counts, and this worker's deduplication counts"""
+    try:
+        return jsonify({
+            "success": True,
+            "pid": os.getpid(),
+            "stats": get_media_store().stats(),
+            "signed_urls": get_media_url_signer().stats() if get_media_url_signer() else None
+        })
+    except Exception as e:
+        logger.error(f"Error getting media stats: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def export_collection():
+    """
+    Stream every egg, creature and media file as one archive (?format=zip|tar|tar.gz).
+    A multi-GB archive outlives gunicorn's --timeout (30 s) on a sync worker, which is then
+    killed mid-stream: serve it from gthread workers (the Procfile) or the ASGI mode, or use the CLI.
+    """
+    from collection_archive import ARCHIVE_FORMATS
+    
+    fmt = request.args.get('format', 'zip')
+    if fmt not in ARCHIVE_FORMATS:
+        return jsonify({"error": f"Unknown format, expected one of: {', '.join(ARCHIVE_FORMATS)}"}), 400
+    
+    extension, mimetype = ARCHIVE_FORMATS[fmt]
+    filename = f"hatch-{datetime.now().strftime('%Y%m%d-%H%M%S')}{extension}"
+    response = Response(get_collection_archive().export(fmt), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def import_collection():
+    """
+    Add the records and media of an /api/export archive (the request body, or an
+    'archive' file upload). Existing records and media are skipped, so a failed import can be re-sent.
+    Like /api/export, a large archive needs gthread workers (the Procfile), the ASGI mode or the
+    CLI; a sync worker is killed at gunicorn's --timeout.
+    """
+    from collection_archive import ArchiveError
+    
+    upload = request.files.get('archive')
+    try:
+        report = get_collection_archive().import_archive(
+            upload.stream if upload else request.stream,
+            batch_size=request.args.get('batch_size', 1000, type=int),
+            on_batch=_index_imported
+        )
+        return jsonify({
+            "success": True,
+            "report": report
+        })
+    except ArchiveError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error importing collection: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/api/egg-pool/stats', methods=['GET'])
+@login_required
+def get_egg_pool_stats():
+    """Get kiosk egg pool depth, hit rate and staleness"""
+    try:
+        pool = get_egg_pool()
+        if pool is None:
             return jsonify({
                 "success": True,
-                "creatures": []
+                "enabled": False
             })
+        
+        return jsonify({
+            "success": True,
+            "enabled": True,
+            "stats": pool.stats()
+        })
+        
     except Exception as e:
+        logger.error(f"Error getting egg pool stats: {str(e)}")
         return jsonify({
             "success": False,
             "error": str(e),
-            "message": "Failed to retrieve creatures"
+            "message": "Failed to get egg pool stats"
         }), 500
 
 @app.route('/api/care-questions', methods=['GET'])
 @login_required
 def get_care_questions():
-    """Get a single dynamic care question for egg incubation"""
+    """
+    Get a single dynamic care question for egg incubation
+    Pass ?egg_id= to start prefetching the hatch stages that don't depend on the answer
+    """
     try:
-        import random
         selected_question = random.choice(CARE_QUESTIONS)
         
         questions = {
             "questions": [selected_question]
         }
         
+        egg_id = request.args.get('egg_id')
+        prefetcher = get_hatch_prefetcher()
+        if egg_id and prefetcher:
+            tasks = get_egg_creator().prefetch_hatch(
+                egg_id,
+                draft_concept=app.config.get('PREFETCH_DRAFT_CONCEPT', False)
+            )
+            prefetcher.start(egg_id, tasks, cleanup=_discard_prefetched)
+        
         return jsonify({
             "success": True,
             "questions": questions
@@ -707,6 +2226,20 @@ def get_care_questions():
             "message": "Failed to get care questions"
         }), 500
 
+@app.route('/api/care-questions/cancel', methods=['POST'])
+@login_required
+def cancel_care_questions():
+    """Abandon the hatch prefetch started for an egg's care question"""
+    data = request.get_json(silent=True) or {}
+    egg_id = data.get('egg_id')
+    prefetcher = get_hatch_prefetcher()
+    
+    cancelled = bool(egg_id and prefetcher and prefetcher.cancel(egg_id))
+    return jsonify({
+        "success": True,
+        "cancelled": cancelled
+    })
+
 @app.route('/api/hatch-creature', methods=['POST'])
 @login_required
 def hatch_creature():
@@ -715,6 +2248,7 @@ def hatch_creature():
         data = request.get_json()
         egg_id = data.get('egg_id')
         care_responses = data.get('care_responses', {})
+        candidates = data.get('candidates')
         
         if not egg_id:
             return jsonify({
@@ -722,27 +2256,33 @@ def hatch_creature():
                 "message": "Egg ID is required"
             }), 400
         
-        # Get egg data
-        eggs_file = "eggs_data.json"
-        if not os.path.exists(eggs_file):
-            return jsonify({
-                "success": False,
-                "message": "Egg not found"
-            }), 404
+        _start_deadline()
         
-        with open(eggs_file, 'r') as f:
-            eggs = json.load(f)
+        # Use whatever was prefetched while the care question was open
+        prefetcher = get_hatch_prefetcher()
+        prefetched = prefetcher.claim(egg_id) if prefetcher else {}
         
-        egg = next((e for e in eggs if e['id'] == egg_id), None)
+        # Get egg data
+        egg = prefetched.get('egg') or _find_egg(egg_id)
         if not egg:
+            _discard_prefetched(prefetched)
             return jsonify({
                 "success": False,
                 "message": "Egg not found"
             }), 404
         
         # Generate creature using the egg creator
-        result = get_egg_creator().create_creature_from_egg(egg, care_responses)
-        return jsonify(result)
+        try:
+            with _generation_slot():
+                result = get_egg_creator().create_creature_from_egg(egg, care_responses, prefetched=prefetched,
+                                                                    candidates=candidates)
+        except (QueueFull, QueueTimeout) as e:
+            _discard_prefetched(prefetched)
+            return _scheduler_busy(e)
+        except DeadlineExceeded as e:
+            _discard_prefetched(prefetched)
+            return _deadline_response(e)
+        return jsonify(_signed_result(result))
         
     except Exception as e:
         logger.error(f"Error hatching creature: {str(e)}")
@@ -752,14 +2292,65 @@ def hatch_creature():
             "message": "Failed to hatch creature"
         }), 500
 
+def _authorize_media(url):
+    """
+    How a media request is allowed, as (Cache-Control max-age or None, reason); (None, None) if it isn't.
+    A valid signed URL needs no session and may be cached publicly until it expires;
+    an unsigned one (or an expired one from a page left open) falls back to the login session.
+    """
+    signer = get_media_url_signer()
+    if signer is not None and 'sig' in request.args:
+        remaining = signer.verify(url, request.args.get('exp'), request.args.get('sig'))
+        if remaining is not None:
+            return remaining, "signed"
+    if 'authenticated' in session:
+        return None, "session"
+    return None, None
+
+def _serve_media(url, **send_options):
+    """
+    A media file from the media store: a redirect to the backend (presigned or public URL)
+    when it has one, otherwise the local file (or the read-through cache's copy); None if missing
+    """
+    max_age, reason = _authorize_media(url)
+    get_metrics().inc("hatch_media_url_checks_total", result=reason or "denied")
+    if reason is None:
+        if 'sig' in request.args:
+            return jsonify({"error": "Media URL expired or invalid"}), 403
+        return redirect(url_for('login'))
+    
+    store = get_media_store()
+    target = store.redirect_url(url)
+    if target:
+        get_metrics().inc("hatch_media_served_total", via="redirect")
+        response = redirect(target)
+        if max_age is not None and app.config.get('MEDIA_SERVE', 'presign') == 'presign':
+            # Don't let a cached redirect outlive the presigned URL it points to
+            max_age = min(max_age, app.config.get('MEDIA_PRESIGN_SECONDS', 3600) // 2)
+    else:
+        path = store.local_path(url)
+        if path is None:
+            return None
+        get_metrics().inc("hatch_media_served_total", via="file")
+        response = send_file(os.path.abspath(path), **send_options)
+    
+    if max_age is not None:
+        # Content-addressed files never change, and the signed URL is the credential
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.private = True
+    return response
+
 @app.route('/static/audio/<filename>')
-@login_required
 def serve_audio(filename):
-    """Serve audio files with proper headers"""
+    """Serve audio files with proper headers (signed URL or logged-in session)"""
     try:
-        audio_path = os.path.join("static", "audio", filename)
-        if os.path.exists(audio_path):
-            return send_file(audio_path, mimetype='audio/mpeg')
+        response = _serve_media(f"/static/audio/{filename}", mimetype='audio/mpeg')
+        if response is not None:
+            return response
         else:
             return jsonify({"error": "Audio file not found"}), 404
     except Exception as e:
@@ -767,19 +2358,53 @@ def serve_audio(filename):
         return jsonify({"error": "Failed to serve audio"}), 500
 
 @app.route('/static/images/<filename>')
-@login_required
 def serve_image(filename):
-    """Serve image files"""
+    """Serve image files (signed URL or logged-in session)"""
     try:
-        image_path = os.path.join("static", "images", filename)
-        if os.path.exists(image_path):
-            return send_file(image_path)
+        response = _serve_media(f"/static/images/{filename}")
+        if response is not None:
+            return response
         else:
             return jsonify({"error": "Image file not found"}), 404
     except Exception as e:
         logger.error(f"Error serving image: {str(e)}")
         return jsonify({"error": "Failed to serve image"}), 500
 
+@app.route('/static/dist/<path:filename>')
+def serve_asset(filename):
+    """A fingerprinted asset from `python static_assets.py build`, pre-encoded as the client accepts (br, then gzip)"""
+    from static_assets import DIST_DIR, get_manifest
+    
+    variant = get_manifest().variant(filename, request.headers.get('Accept-Encoding'))
+    if variant is None:
+        return jsonify({"error": "Asset not found"}), 404
+    stored, encoding = variant
+    response = send_from_directory(DIST_DIR, stored, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=app.config.get('STATIC_ASSET_MAX_AGE', 31536000))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The name changes with the content, so the file can be cached for good
+    response.cache_control.immutable = True
+    get_metrics().inc("hatch_static_assets_served_total", encoding=encoding or "identity")
+    return response
+
+@app.route('/api/media/authorize')
+def authorize_media():
+    """
+    Signed media URL check for a front proxy (nginx auth_request): the original
+    URI comes in X-Original-URI; 204 if it is a valid signed URL, else 403. No session.
+    """
+    signer = get_media_url_signer()
+    original = request.headers.get('X-Original-URI', '')
+    remaining = signer.verify_url(original) if signer is not None and original else None
+    get_metrics().inc("hatch_media_url_checks_total", result="proxy_signed" if remaining is not None else "proxy_denied")
+    if remaining is None:
+        return "", 403
+    response = Response(status=204)
+    response.headers['X-Media-Max-Age'] = str(remaining)
+    return response
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     app.run(debug=True, host='0.0.0.0', port=port) 
\ No newline at end of file
@@ -0,0 +1,607 @@
+"""
+Async Serving Mode for the Hatch Application
+
+Under sync gunicorn workers a worker is blocked for the whole 20-40 s of a
+hatch, so concurrency equals the worker count. In async mode the three
+generation routes (create-egg, analyze-image, hatch-creature) are served by a
+Quart app whose EggCreator awaits openai.AsyncOpenAI and an httpx.AsyncClient,
+so one process can hold hundreds of generations in flight. Every other route
+is still served by the Flask app in app.py (asgi.py routes between the two),
+so sessions, config, metrics, the usage ledger and logging are shared.
+
+Local work that blocks - the JSON record files, the search/similarity indexes,
+the prompt cache and the usage ledger - runs in the default thread pool via
+asyncio.to_thread; the event loop only ever waits on sockets.
+
+USAGE:
+  gunicorn asgi:app -k uvicorn.workers.UvicornWorker -w 2
+  uvicorn asgi:app --workers 2          # or without gunicorn
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import nullcontext
+from functools import wraps
+
+import httpx
+from quart import Quart, g, jsonify, redirect, request, session
+
+from ai_prompts import get_egg_creation_prompt
+from audio_processing import ENCODING_FIELD
+from app import EggCreator, app as flask_app, get_metrics, get_openai_clients, get_hatch_prefetcher, get_scheduler, _candidate_count, _discard_prefetched, _find_egg, _signed_result
+from deadline import Deadline, DeadlineExceeded, check_deadline, current_deadline, parse_budget, set_deadline
+from scheduler import QueueFull, QueueTimeout
+from static_assets import COMPRESSIBLE_TYPES, compress_body
+from structured_logging import init_async_request_logging
+from usage import set_usage_scope, update_usage_scope
+
+logger = logging.getLogger(__name__)
+
+
+def create_async_app():
+    # No static folder: /static/... stays with the Flask app
+    async_app = Quart(__name__, static_folder=None)
+
+    # Same settings (and secret key, so the Flask session cookie is valid here) as app.py
+    async_app.config.update({key: value for key, value in flask_app.config.items() if key not in async_app.config})
+    async_app.secret_key = flask_app.secret_key
+    return async_app
+
+async_app = create_async_app()
+init_async_request_logging(async_app)
+
+
+class AsyncEggCreator(EggCreator):
+    """
+    EggCreator on AsyncOpenAI and httpx. The pipelines are the same as the sync
+    ones step for step (same prompts, stages, metrics and usage attribution);
+    only the API calls and downloads are awaited.
+    """
+
+    def __init__(self):
+        self.client = get_openai_clients().get_async()
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(120.0), follow_redirects=True)
+
+    async def close(self):
+        await self.http.aclose()
+        await self.client.close()
+
+    async def _call_openai(self, operation, create, **kwargs):
+        """Await an OpenAI API call, recording its latency, outcome and token usage (deadline-bounded)"""
+        deadline = current_deadline()
+        attempt = 0
+        while True:
+            if deadline is not None:
+                kwargs['timeout'] = deadline.call_timeout(operation)
+            start = time.perf_counter()
+            try:
+                response = await create(**kwargs)
+            except Exception as e:
+                self._observe_openai(operation, kwargs, start, error=e)
+                delay = self._retry_delay(e, attempt, deadline, operation)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            # The usage ledger is SQLite; keep it off the event loop
+            await asyncio.to_thread(self._observe_openai, operation, kwargs, start, response=response)
+            return response
+
+    async def _download(self, url, kind):
+        """Download a generated asset, recording latency and size"""
+        deadline = current_deadline()
+        timeout = deadline.call_timeout(f"{kind}_download") if deadline is not None else httpx.USE_CLIENT_DEFAULT
+        with get_metrics().time("hatch_download_duration_seconds", kind=kind):
+            response = await self.http.get(url, timeout=timeout)
+            response.raise_for_status()
+        get_metrics().inc("hatch_download_bytes_total", len(response.content), kind=kind)
+        return response.content
+
+    async def create_egg_from_metadata(self, description, descriptors, fresh=False, candidates=None):
+        """Async EggCreator.create_egg_from_metadata"""
+        stages = get_metrics().stages("hatch_stage_duration_seconds", pipeline="egg")
+        egg_id = str(uuid.uuid4())
+        update_usage_scope(kind="egg", record_id=egg_id)
+        generated_url, cache = None, None
+        try:
+            prompt = get_egg_creation_prompt(description, ", ".join(descriptors))
+            chain_start = self._start_image_attempt("egg", prompt)
+
+            image_url, source, cache = await asyncio.to_thread(
+                self._reusable_egg_image, prompt, description, descriptors, fresh
+            )
+            stages.mark("lookup")
+
+            selection = None
+            if not image_url:
+                selection = await self._generate_images(prompt, "egg", candidates, chain_start)
+                image_url = generated_url = selection['image_url']
+                if cache:
+                    await asyncio.to_thread(cache.store, prompt, description, descriptors, image_url)
+            stages.mark("image")
+
+            egg_data = self._new_egg_record(egg_id, description, descriptors, image_url)
+            if selection:
+                self._add_selection(egg_data, selection)
+
+            # Concurrent saves are group-committed by the record store
+            check_deadline("save")
+            await asyncio.to_thread(self._save_egg_data, egg_data)
+            stages.mark("save")
+            await asyncio.to_thread(self._index_record, 'egg', egg_data)
+            stages.mark("index")
+
+            return {
+                "success": True,
+                "egg": egg_data,
+                "cache": source,
+                "usage": await asyncio.to_thread(self._usage_for, 'egg', egg_id),
+                "message": "Egg created successfully!"
+            }
+
+        except (DeadlineExceeded, asyncio.CancelledError):
+            # Cancelled: the client disconnected. A cached image is kept for the retry
+            if generated_url and not cache:
+                self._discard_files(generated_url, *(selection or {}).get('alternate_image_urls', []))
+            raise
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "message": "Failed to create egg"
+            }
+
+    async def _generate_egg_image(self, prompt):
+        return (await self._generate_images(prompt, "egg", candidates=1))['image_url']
+
+    async def _generate_images(self, prompt, kind, candidates=None, chain_start=None):
+        """Async EggCreator._generate_images: the candidates are awaited together"""
+        results = await asyncio.gather(
+            *(self._fetch_image(prompt, kind) for _ in range(_candidate_count(candidates))),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+        contents = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        # Scoring and saving are CPU and disk work
+        return await asyncio.to_thread(self._keep_best_image, contents, errors, kind, chain_start)
+
+    async def _fetch_image(self, prompt, kind):
+        response = await self._call_openai(
+            "images.generate",
+            self.client.images.generate,
+            **self._image_request(prompt)
+        )
+        logger.info(f"Downloading image from: {response.data[0].url}")
+        return await self._download(response.data[0].url, kind=kind)
+
+    async def analyze_image_to_metadata(self, image_data):
+        """Async EggCreator.analyze_image_to_metadata"""
+        update_usage_scope(kind="analysis")
+        try:
+            image_base64, mime_type = await asyncio.to_thread(self._encode_image, image_data)
+
+            response = await self._call_openai(
+                "chat.analyze_image",
+                self.client.chat.completions.create,
+                **self._analysis_request(image_base64, mime_type)
+            )
+
+            return {
+                "success": True,
+                "analysis": self._parse_analysis(response.choices[0].message.content),
+                "message": "Image analyzed successfully!"
+            }
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Image analysis error: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "message": "Failed to analyze image"
+            }
+
+    async def create_creature_from_egg(self, egg, care_responses, prefetched=None, candidates=None):
+        """Async EggCreator.create_creature_from_egg"""
+        prefetched = prefetched or {}
+        stages = get_metrics().stages("hatch_stage_duration_seconds", pipeline="hatch")
+
+        sound, creature_id, selected_sound = self._pick_creature_sound(prefetched)
+        update_usage_scope(kind="creature", record_id=creature_id)
+        creature_image_url = generated_audio_url = None
+        alternate_urls = []
+        chain_start = self._start_image_attempt("creature", egg.get('id'))
+
+        try:
+            care_context = self._care_context(care_responses)
+            descriptors_text = ", ".join(egg.get('descriptors', []))
+
+            draft = prefetched.get('concept')
+            if draft:
+                creature_name = draft['name']
+                image_prompt = f"{draft['image_prompt']} Personality reflects {care_context}."
+                logger.info(f"Using prefetched creature concept: {creature_name}")
+            else:
+                creature_name, image_prompt = await self._generate_creature_concept(descriptors_text, care_context)
+            stages.mark("concept")
+
+            selection = await self._generate_images(image_prompt, "creature", candidates, chain_start)
+            creature_image_url, alternate_urls = selection['image_url'], selection['alternate_image_urls']
+            stages.mark("image")
+
+            if self._optional_stage("voice", pipeline="hatch"):
+                voice_response = await self._call_openai(
+                    "chat.voice",
+                    self.client.chat.completions.create,
+                    **self._voice_request(descriptors_text, care_context)
+                )
+                voice_description = voice_response.choices[0].message.content.strip()
+            else:
+                voice_description = f"A {descriptors_text} voice"
+            stages.mark("voice")
+
+            audio_encoding = None
+            if sound:
+                audio_url, audio_encoding = sound['audio_url'], sound.get('audio_encoding')
+            elif self._optional_stage("sound", pipeline="hatch"):
+                try:
+                    generated = await self._generate_creature_sound(creature_id, selected_sound)
+                    audio_url = generated_audio_url = generated['audio_url']
+                    audio_encoding = generated['audio_encoding']
+                except DeadlineExceeded:
+                    raise
+                except Exception as audio_error:
+                    logger.error(f"Audio generation error: {audio_error}")
+                    audio_url = None
+            else:
+                audio_url = None
+            stages.mark("sound")
+
+            creature_data = self._new_creature_record(
+                creature_id, creature_name, egg, creature_image_url,
+                selected_sound, voice_description, audio_url, care_responses
+            )
+            self._add_selection(creature_data, selection)
+            if audio_encoding:
+                creature_data[ENCODING_FIELD] = audio_encoding
+
+            check_deadline("save")
+            await asyncio.to_thread(self._save_creature_data, creature_data)
+            stages.mark("save")
+            await asyncio.to_thread(self._index_record, 'creature', creature_data)
+            stages.mark("index")
+
+            return {
+                "success": True,
+                "creature": creature_data,
+                "usage": await asyncio.to_thread(self._usage_for, 'creature', creature_id),
+                "message": "Creature hatched successfully!"
+            }
+
+        except (DeadlineExceeded, asyncio.CancelledError):
+            self._discard_files(creature_image_url, generated_audio_url, *alternate_urls)
+            raise
+        except Exception as e:
+            logger.error(f"Error creating creature: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "message": "Failed to create creature"
+            }
+
+    async def _generate_creature_concept(self, descriptors_text, care_context):
+        concept_response = await self._call_openai(
+            "chat.concept",
+            self.client.chat.completions.create,
+            **self._concept_request(descriptors_text, care_context)
+        )
+        return self._parse_creature_concept(
+            concept_response.choices[0].message.content, descriptors_text, care_context
+        )
+
+    async def _generate_creature_sound(self, creature_id, selected_sound):
+        audio_response = await self._call_openai(
+            "audio.speech",
+            self.client.audio.speech.create,
+            **self._speech_request(selected_sound)
+        )
+        # Compacting runs ffmpeg; keep it off the event loop
+        return await asyncio.to_thread(self._save_sound, audio_response.content)
+
+
+# Initialize async egg creator - created on the event loop that serves the requests
+async_egg_creator = None
+
+def get_async_egg_creator():
+    global async_egg_creator
+    if async_egg_creator is None:
+        async_egg_creator = AsyncEggCreator()
+    return async_egg_creator
+
+@async_app.after_serving
+async def close_async_egg_creator():
+    if async_egg_creator is not None:
+        await async_egg_creator.close()
+
+def _usage_session_id():
+    """app._usage_session_id for the Quart session"""
+    if 'authenticated' not in session:
+        return None
+    if 'usage_id' not in session:
+        session['usage_id'] = uuid.uuid4().hex
+    return session['usage_id']
+
+def _generation_slot():
+    """app._generation_slot for the Quart routes: shares the worker's scheduler with the Flask routes"""
+    current = get_scheduler()
+    if current is None:
+        return nullcontext()
+    lane = "batch" if request.headers.get('X-Hatch-Priority', '').lower() == 'batch' else "interactive"
+    deadline = current_deadline()
+    timeout = min(current.max_wait_seconds, max(deadline.remaining(), 0)) if deadline is not None else None
+    return current.async_slot(_usage_session_id(), lane, timeout=timeout)
+
+def _start_deadline():
+    """
+    app._start_deadline for the Quart routes. No socket polling: when the client
+    disconnects Quart cancels the request's task, which stops the pipeline at its next await.
+    """
+    seconds = parse_budget(
+        request.headers.get('X-Hatch-Deadline'),
+        async_app.config.get('REQUEST_DEADLINE_SECONDS', 90),
+        async_app.config.get('REQUEST_DEADLINE_MAX_SECONDS', 300)
+    )
+    set_deadline(Deadline(seconds) if seconds is not None else None)
+
+def _deadline_response(error):
+    """app._deadline_response for the Quart routes"""
+    route = request.url_rule.rule if request.url_rule else request.path
+    get_metrics().inc("hatch_request_aborts_total", route=route, stage=error.stage, reason=error.reason)
+    logger.warning(f"Stopped {route} at {error.stage}: {error}", extra={"stage": error.stage, "reason": error.reason})
+    return jsonify({
+        "success": False,
+        "error": str(error),
+        "message": "Request took longer than its deadline"
+    }), 504
+
+def _count_disconnect():
+    """The request's task was cancelled: the client went away mid-pipeline"""
+    route = request.url_rule.rule if request.url_rule else request.path
+    get_metrics().inc("hatch_request_aborts_total", route=route, stage="cancelled", reason="disconnect")
+    logger.warning(f"Stopped {route}: client disconnected", extra={"reason": "disconnect"})
+
+def _scheduler_busy(error):
+    """app._scheduler_busy for the Quart routes"""
+    full = isinstance(error, QueueFull)
+    get_metrics().inc("hatch_scheduler_rejected_total", reason="queue_full" if full else "timeout")
+    response = jsonify({
+        "success": False,
+        "error": str(error),
+        "message": "Too many requests waiting, try again shortly" if full else "Server busy, try again shortly"
+    })
+    response.headers['Retry-After'] = '5' if full else '30'
+    return response, 429 if full else 503
+
+# Authentication decorator (the login page itself is served by the Flask app)
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'authenticated' not in session:
+            return redirect('/login')
+        return await f(*args, **kwargs)
+    return decorated_function
+
+@async_app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+    set_usage_scope(session_id=_usage_session_id())
+
+@async_app.after_request
+async def record_request_metrics(response):
+    """Same route latency histogram as the Flask routes"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        get_metrics().observe(
+            "hatch_http_request_duration_seconds",
+            time.perf_counter() - start,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+@async_app.after_request
+async def compress_response(response):
+    """Same response compression as the Flask routes (JSON above COMPRESS_MIN_BYTES)"""
+    config = async_app.config
+    if (not config.get('COMPRESS_ENABLED', True) or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'Content-Encoding' in response.headers or response.status_code < 200
+            or response.status_code in (204, 206, 304)):
+        return response
+    response.vary.add('Accept-Encoding')
+    start = time.perf_counter()
+    data = await response.get_data()
+    compressed = compress_body(
+        data, response.mimetype, request.headers.get('Accept-Encoding'),
+        min_bytes=config.get('COMPRESS_MIN_BYTES', 1024),
+        gzip_level=config.get('COMPRESS_GZIP_LEVEL', 6),
+        brotli_quality=config.get('COMPRESS_BROTLI_QUALITY', 4)
+    )
+    if compressed is None:
+        return response
+    encoding, body = compressed
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    metrics = get_metrics()
+    metrics.observe("hatch_response_compression_duration_seconds", time.perf_counter() - start)
+    metrics.inc("hatch_response_compression_total", encoding=encoding)
+    metrics.inc("hatch_response_compression_bytes_saved_total", len(data) - len(body))
+    return response
+
+@async_app.route('/api/create-egg', methods=['POST'])
+@login_required
+async def create_egg():
+    """API endpoint to create an egg from metadata"""
+    try:
+        data = await request.get_json()
+        description = data.get('description', '')
+        descriptors = data.get('descriptors', [])
+        fresh = bool(data.get('fresh', False))
+        candidates = data.get('candidates')
+
+        if not description or not descriptors:
+            return jsonify({
+                "success": False,
+                "message": "Description and descriptors are required"
+            }), 400
+
+        _start_deadline()
+        async with _generation_slot():
+            result = await get_async_egg_creator().create_egg_from_metadata(description, descriptors, fresh=fresh,
+                                                                            candidates=candidates)
+        return jsonify(_signed_result(result))
+
+    except (QueueFull, QueueTimeout) as e:
+        return _scheduler_busy(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
+    except asyncio.CancelledError:
+        _count_disconnect()
+        raise
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to create egg"
+        }), 500
+
+@async_app.route('/api/analyze-image', methods=['POST'])
+@login_required
+async def analyze_image():
+    """API endpoint to analyze an image and generate metadata"""
+    try:
+        _start_deadline()
+        files = await request.files
+        if 'image' in files:
+            image_file = files['image']
+
+            # Validate file
+            if not image_file or image_file.filename == '':
+                return jsonify({
+                    "success": False,
+                    "message": "No image file provided"
+                }), 400
+
+            # Check file type
+            allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+            file_extension = image_file.filename.rsplit('.', 1)[1].lower() if '.' in image_file.filename else ''
+
+            if file_extension not in allowed_extensions:
+                return jsonify({
+                    "success": False,
+                    "message": f"Invalid file type. Allowed types: {', '.join(allowed_extensions)}"
+                }), 400
+
+            logger.info(f"Processing image: {image_file.filename}")
+            async with _generation_slot():
+                result = await get_async_egg_creator().analyze_image_to_metadata(image_file)
+
+        else:
+            # Handle JSON data (for base64 images)
+            data = await request.get_json()
+            if not data:
+                return jsonify({
+                    "success": False,
+                    "message": "No image data provided"
+                }), 400
+
+            image_data = data.get('image_data', '')
+            if not image_data:
+                return jsonify({
+                    "success": False,
+                    "message": "No image_data in request"
+                }), 400
+
+            async with _generation_slot():
+                result = await get_async_egg_creator().analyze_image_to_metadata(image_data)
+
+        return jsonify(result)
+
+    except (QueueFull, QueueTimeout) as e:
+        return _scheduler_busy(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
+    except asyncio.CancelledError:
+        _count_disconnect()
+        raise
+    except Exception as e:
+        logger.error(f"API error in analyze_image: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to analyze image"
+        }), 500
+
+@async_app.route('/api/hatch-creature', methods=['POST'])
+@login_required
+async def hatch_creature():
+    """Generate a creature based on egg data and care responses"""
+    try:
+        data = await request.get_json()
+        egg_id = data.get('egg_id')
+        care_responses = data.get('care_responses', {})
+        candidates = data.get('candidates')
+
+        if not egg_id:
+            return jsonify({
+                "success": False,
+                "message": "Egg ID is required"
+            }), 400
+
+        _start_deadline()
+
+        # The prefetch was started by the Flask care-questions route in this same process
+        prefetcher = get_hatch_prefetcher()
+        prefetched = await asyncio.to_thread(prefetcher.claim, egg_id) if prefetcher else {}
+
+        egg = prefetched.get('egg') or await asyncio.to_thread(_find_egg, egg_id)
+        if not egg:
+            await asyncio.to_thread(_discard_prefetched, prefetched)
+            return jsonify({
+                "success": False,
+                "message": "Egg not found"
+            }), 404
+
+        try:
+            async with _generation_slot():
+                result = await get_async_egg_creator().create_creature_from_egg(egg, care_responses, prefetched=prefetched,
+                                                                                candidates=candidates)
+        except (QueueFull, QueueTimeout) as e:
+            await asyncio.to_thread(_discard_prefetched, prefetched)
+            return _scheduler_busy(e)
+        except DeadlineExceeded as e:
+            await asyncio.to_thread(_discard_prefetched, prefetched)
+            return _deadline_response(e)
+        except asyncio.CancelledError:
+            _discard_prefetched(prefetched)
+            _count_disconnect()
+            raise
+        return jsonify(_signed_result(result))
+
+    except Exception as e:
+        logger.error(f"Error hatching creature: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "message": "Failed to hatch creature"
+        }), 500
+
+# Paths asgi.py hands to this app instead of the Flask one
+ASYNC_ROUTES = frozenset(rule.rule for rule in async_app.url_map.iter_rules())
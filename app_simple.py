@@ -1,16 +1,11 @@
 from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for
 from flask_cors import CORS
-import openai
 import os
-import base64
-import io
-from PIL import Image
 import json
 from dotenv import load_dotenv
 import uuid
 from datetime import datetime
 import logging
-import requests
 from functools import wraps
 from ai_prompts import (
     get_egg_creation_prompt,
@@ -21,19 +16,13 @@ from ai_prompts import (
     PHONETIC_SOUNDS,
     CARE_QUESTIONS
 )
+from structured_logging import configure_logging, init_request_logging
 
 # Load environment variables
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('hatch.log'),
-        logging.StreamHandler()
-    ]
-)
+# Set up logging (JSON records, written off the request path by a queue listener)
+configure_logging(os.environ)
 logger = logging.getLogger(__name__)
 
 # Create Flask app
@@ -47,9 +36,16 @@ app.config['WEBSITE_PASSWORD'] = os.getenv('WEBSITE_PASSWORD', 'hatch123')
 # Enable CORS
 CORS(app)
 
-# Configure OpenAI
+# Request ids and access lines in the log
+init_request_logging(app)
+
+# The templates resolve assets through asset_url(); this app serves the original files
+@app.context_processor
+def static_asset_urls():
+    return {'asset_url': lambda name: url_for('static', filename=name)}
+
+# Check the OpenAI key (the stub makes no API calls, so openai itself is never imported)
 if app.config['OPENAI_API_KEY']:
-    openai.api_key = app.config['OPENAI_API_KEY']
     logger.info("OpenAI API key configured")
 else:
     logger.warning("No OpenAI API key found")
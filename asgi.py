@@ -0,0 +1,150 @@
+"""
+ASGI entry point (async serving mode, see app_async.py)
+
+The generation routes go to the Quart app; everything else goes to the Flask
+app, run in the event loop's thread pool.
+
+AsyncioWSGIMiddleware reads the whole request body into memory before Flask
+runs, and refuses bodies over its cap with an empty 400. The routes in
+STREAMING_ROUTES (collection import, whose archives can be any size) go
+through StreamingWSGI instead: wsgi.input reads the ASGI receive channel as
+Flask consumes it, so an upload streams to the import's spool files in
+constant memory, as it does under the sync workers.
+
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import io
+import sys
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from werkzeug.exceptions import ClientDisconnected
+
+from app import app as flask_app
+from app_async import ASYNC_ROUTES, async_app
+
+# Flask routes whose request bodies are streamed rather than buffered (and capped)
+STREAMING_ROUTES = frozenset({'/api/import'})
+
+_READ_BUFFER = 64 * 1024
+
+
+class _ReceiveStream(io.RawIOBase):
+    """The request body, read from the ASGI receive channel by the WSGI app's thread"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._done:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            self._buffer += message.get("body", b"")
+            self._done = not message.get("more_body", False)
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+
+def _build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # The ASGI server ends the body itself (Content-Length or chunked): read it to EOF
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").lower()
+        value = value.decode("latin-1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        if key in environ:
+            value = environ[key] + ("; " if key == "HTTP_COOKIE" else ",") + value
+        environ[key] = value
+    return environ
+
+
+class StreamingWSGI:
+    """
+    Runs a WSGI app for ASGI HTTP requests without buffering: the body is read as the
+    app consumes it and the response is sent as the app yields it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = io.BufferedReader(_ReceiveStream(receive, loop), _READ_BUFFER)
+        await loop.run_in_executor(None, self._run, _build_environ(scope, body), send, loop)
+
+    def _run(self, environ, send, loop):
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def send_body(data):
+            if "sent" not in response:
+                call({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+                response["sent"] = True
+            if data:
+                call({"type": "http.response.body", "body": data, "more_body": True})
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and "sent" in response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return send_body
+
+        iterable = self.app(environ, start_response)
+        try:
+            for data in iterable:
+                send_body(data)
+            send_body(b"")
+            call({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+flask_asgi = AsyncioWSGIMiddleware(flask_app, max_body_size=16 * 1024 * 1024)
+flask_streaming = StreamingWSGI(flask_app)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan" or scope.get("path") in ASYNC_ROUTES:
+        await async_app(scope, receive, send)
+    elif scope["type"] == "http" and scope.get("path") in STREAMING_ROUTES:
+        await flask_streaming(scope, receive, send)
+    else:
+        await flask_asgi(scope, receive, send)
@@ -0,0 +1,312 @@
+"""
+Creature Sound Processing for the Hatch Application
+
+tts-1 returns 160 kb/s MP3s with leading and trailing silence, at whatever
+loudness the voice came out. Each was stored as-is and fetched on its own
+when a play button was clicked, so the first play always lagged and clips
+played at uneven volumes. Sounds now go through two steps:
+
+- compact(): decode, trim the silence at both ends (frames quieter than
+  silence_db, keeping a short pad), normalize loudness (the RMS of the voiced
+  frames to target_db, never letting the peak pass peak_db) and re-encode as a
+  low-bitrate mono MP3 (32 kb/s by default, about a fifth of the original).
+  MP3 stays playable everywhere, Safari included, and keeps the media store's
+  .mp3 kind
+- build_sprite(): the sounds of a gallery page concatenated, with a gap of
+  silence between them, into one MP3 plus an offset map ({url: {start,
+  duration}} in seconds), so the page preloads every sound in one request and
+  plays any of them instantly. The gaps also absorb the encoder's start delay
+
+Decoding and encoding go through ffmpeg (FFMPEG_PATH); the signal work is
+NumPy on the decoded samples. Without ffmpeg, compact() raises
+AudioProcessingError and callers keep the original clip.
+
+USAGE:
+  processor = AudioProcessor(ffmpeg="ffmpeg", bitrate="32k")
+  small_mp3, info = processor.compact(tts_mp3)          # info: durations, sizes, gain
+  sprite_mp3, clips = processor.build_sprite([(url, mp3_bytes), ...])
+  entry, state = AudioSprites("audio_sprites.json", processor, media_store).get(urls, read)  # built in the background
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Record field saying how a creature's sound was encoded (clips without it are backfilled)
+ENCODING_FIELD = "audio_encoding"
+
+_FRAME_SECONDS = 0.01
+
+
+class AudioProcessingError(Exception):
+    """ffmpeg is missing or failed on a clip"""
+
+
+class AudioProcessor:
+    def __init__(self, ffmpeg="ffmpeg", bitrate="32k", sample_rate=24000, silence_db=-45.0,
+                 target_db=-18.0, peak_db=-1.0, max_gain_db=20.0, pad_seconds=0.04, sprite_gap_seconds=0.3):
+        """
+        silence_db: frames (10 ms) below this RMS are silence; target_db: RMS of the voiced frames
+        after normalization; peak_db: highest sample after it; max_gain_db: most a quiet clip is raised.
+        """
+        self.ffmpeg = ffmpeg
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.silence_db = silence_db
+        self.target_db = target_db
+        self.peak_db = peak_db
+        self.max_gain_db = max_gain_db
+        self.pad_seconds = pad_seconds
+        self.sprite_gap_seconds = sprite_gap_seconds
+
+    @property
+    def encoding(self):
+        """The label stored in ENCODING_FIELD of processed clips"""
+        return f"mp3-{self.bitrate}-mono-{self.sample_rate // 1000}k"
+
+    def available(self):
+        return shutil.which(self.ffmpeg) is not None
+
+    # ------------------------------------------------------------------
+    # ffmpeg
+    # ------------------------------------------------------------------
+
+    def _ffmpeg(self, args, data):
+        try:
+            result = subprocess.run([self.ffmpeg, "-v", "error", "-nostdin", *args], input=data,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise AudioProcessingError(f"ffmpeg failed to run: {e}") from e
+        if result.returncode != 0:
+            raise AudioProcessingError(f"ffmpeg: {result.stderr.decode('utf-8', 'replace').strip()[:300]}")
+        return result.stdout
+
+    def decode(self, content):
+        """Mono float32 samples at sample_rate"""
+        import numpy as np
+
+        raw = self._ffmpeg(["-i", "pipe:0", "-f", "f32le", "-ac", "1", "-ar", str(self.sample_rate), "pipe:1"],
+                           content)
+        return np.frombuffer(raw, dtype=np.float32)
+
+    def encode(self, samples):
+        return self._ffmpeg(["-f", "f32le", "-ac", "1", "-ar", str(self.sample_rate), "-i", "pipe:0",
+                             "-c:a", "libmp3lame", "-b:a", self.bitrate, "-map_metadata", "-1",
+                             "-f", "mp3", "pipe:1"], samples.astype("float32").tobytes())
+
+    # ------------------------------------------------------------------
+    # Signal
+    # ------------------------------------------------------------------
+
+    def _frame_db(self, samples):
+        import numpy as np
+
+        frame = max(int(self.sample_rate * _FRAME_SECONDS), 1)
+        count = len(samples) // frame
+        if count == 0:
+            return np.zeros(0, dtype=np.float32), frame
+        rms = np.sqrt(np.mean(samples[:count * frame].reshape(count, frame) ** 2, axis=1))
+        return 20 * np.log10(np.maximum(rms, 1e-9)), frame
+
+    def trim(self, samples):
+        """samples without the silence at both ends (a short pad is kept); all-silent clips are left alone"""
+        import numpy as np
+
+        levels, frame = self._frame_db(samples)
+        voiced = np.flatnonzero(levels > self.silence_db)
+        if len(voiced) == 0:
+            return samples
+        pad = int(self.pad_seconds * self.sample_rate)
+        start = max(voiced[0] * frame - pad, 0)
+        end = min((voiced[-1] + 1) * frame + pad, len(samples))
+        return samples[start:end]
+
+    def normalize(self, samples):
+        """(samples at the target loudness, gain in dB)"""
+        import numpy as np
+
+        levels, frame = self._frame_db(samples)
+        voiced = levels[levels > self.silence_db]
+        peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+        if len(voiced) == 0 or peak == 0.0:
+            return samples, 0.0
+        # Mean power of the voiced frames, so pauses don't drag the level down
+        loudness = 10 * np.log10(np.mean(10 ** (voiced / 10)))
+        gain_db = min(self.target_db - loudness, self.peak_db - 20 * np.log10(peak), self.max_gain_db)
+        return samples * np.float32(10 ** (gain_db / 20)), round(float(gain_db), 2)
+
+    # ------------------------------------------------------------------
+    # Clips and sprites
+    # ------------------------------------------------------------------
+
+    def compact(self, content):
+        """(processed MP3 bytes, info) for one clip"""
+        samples = self.decode(content)
+        trimmed = self.trim(samples)
+        normalized, gain_db = self.normalize(trimmed)
+        encoded = self.encode(normalized)
+        return encoded, {
+            "encoding": self.encoding,
+            "seconds_before": round(len(samples) / self.sample_rate, 3),
+            "seconds_after": round(len(trimmed) / self.sample_rate, 3),
+            "bytes_before": len(content),
+            "bytes_after": len(encoded),
+            "gain_db": gain_db,
+        }
+
+    def build_sprite(self, clips):
+        """
+        clips: [(key, MP3 bytes)]. Returns (sprite MP3 bytes, {key: {"start", "duration"}}).
+        A clip that can't be decoded is left out of the map.
+        """
+        import numpy as np
+
+        gap = np.zeros(int(self.sprite_gap_seconds * self.sample_rate), dtype=np.float32)
+        parts, offsets, position = [gap], {}, len(gap)
+        for key, content in clips:
+            if key in offsets:
+                continue
+            try:
+                samples = self.decode(content)
+            except AudioProcessingError as e:
+                logger.warning(f"Sound left out of the sprite: {key}: {e}")
+                continue
+            offsets[key] = {"start": round(position / self.sample_rate, 3),
+                            "duration": round(len(samples) / self.sample_rate, 3)}
+            parts.extend([samples, gap])
+            position += len(samples) + len(gap)
+        return self.encode(np.concatenate(parts)), offsets
+
+
+class AudioSprites:
+    """
+    Built sprites by the set of sounds in them, kept in a small JSON file
+    (AUDIO_SPRITE_PATH), which media GC counts as references so cached sprites
+    aren't reclaimed.
+
+    A sprite costs a decode per clip plus an encode, which grows with the
+    collection, and every new hatch changes the set. So a missing sprite is
+    built on a background thread (one build at a time, the latest request
+    winning), and meanwhile requests get the last sprite built: its clip map
+    covers the older sounds, and the gallery fetches the others one by one.
+    """
+
+    def __init__(self, path, processor, media_store, max_entries=50):
+        self.path = path
+        self.processor = processor
+        self.media_store = media_store
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # oldest first; the last one is the newest build
+        self._mtime = None
+        self._queued = None  # (key, audio_urls, read) of the next build
+        self._building = None  # key being built
+        self.counts = {"hits": 0, "stale": 0, "misses": 0, "builds": 0, "build_failures": 0, "build_seconds": 0.0}
+        self._reload()
+
+    @staticmethod
+    def key_for(audio_urls):
+        return hashlib.sha256("\n".join(audio_urls).encode('utf-8')).hexdigest()
+
+    def get(self, audio_urls, read):
+        """
+        ({"url", "clips": {audio URL: {start, duration}}, "bytes"} or None, state) for these sounds.
+        state is "cached" (the sprite of exactly these sounds), "stale" (the last sprite built,
+        while this one is built in the background) or "building" (no sprite yet).
+        read(url) returns a stored sound's bytes; it is called on the builder thread.
+        """
+        key = self.key_for(audio_urls)
+        with self._lock:
+            # Another worker may have built it since
+            self._reload()
+            entry = self._entries.get(key)
+            if entry and self.media_store.exists(entry["url"]):
+                self._entries.move_to_end(key)
+                self.counts["hits"] += 1
+                return entry, "cached"
+
+            self._schedule(key, list(audio_urls), read)
+            for candidate in reversed(self._entries.values()):
+                if self.media_store.exists(candidate["url"]):
+                    self.counts["stale"] += 1
+                    return candidate, "stale"
+            self.counts["misses"] += 1
+            return None, "building"
+
+    def _schedule(self, key, audio_urls, read):
+        """Queue a build (caller holds _lock); starts the builder thread if it isn't running"""
+        if key == self._building:
+            return
+        start = self._queued is None and self._building is None
+        self._queued = (key, audio_urls, read)
+        if start:
+            threading.Thread(target=self._build_queued, name="audio-sprite-builder", daemon=True).start()
+
+    def _build_queued(self):
+        while True:
+            with self._lock:
+                if self._queued is None:
+                    self._building = None
+                    return
+                key, audio_urls, read = self._queued
+                self._queued = None
+                self._building = key
+            try:
+                self.build(audio_urls, read)
+            except Exception as e:
+                with self._lock:
+                    self.counts["build_failures"] += 1
+                logger.warning(f"Audio sprite build failed: {e}")
+
+    def build(self, audio_urls, read):
+        """Build and store the sprite of these sounds now; returns its entry"""
+        started = time.perf_counter()
+        content, clips = self.processor.build_sprite([(url, read(url)) for url in audio_urls])
+        entry = {"url": self.media_store.put(content, "audio"), "clips": clips, "bytes": len(content)}
+        with self._lock:
+            self._entries[self.key_for(audio_urls)] = entry
+            self._entries.move_to_end(self.key_for(audio_urls))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.counts["builds"] += 1
+            self.counts["build_seconds"] += time.perf_counter() - started
+            self._save()
+        return entry
+
+    def _reload(self):
+        """Re-read the file when another worker changed it (caller holds _lock or is __init__)"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable audio sprite cache {self.path}: {e}")
+            return
+        self._entries = OrderedDict(entries)
+        self._mtime = mtime
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            return {"entries": len(self._entries), "building": self._building is not None, **counts,
+                    "build_seconds": round(counts["build_seconds"], 3)}
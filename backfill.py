@@ -0,0 +1,460 @@
+"""
+Backfill of Derived Artifacts for the Hatch Application
+
+Whenever a derivative is added (thumbnails, image scores, compacted audio),
+every existing egg and creature needs it too. That is CPU-bound Pillow/NumPy
+work on thousands of files, far too slow for a request, so it runs here: a
+command on the batch box that walks the record stores and fans the work out to
+a ProcessPoolExecutor, one worker per core by default. It never goes through
+the Flask app; records are updated through the same RecordStore (file lock,
+group commit) and media through the same MediaStore the serving workers use,
+so it can run while they serve.
+
+- Only records missing the derivative's fields are processed (--force
+  recomputes everything), so a re-run picks up where the last one stopped
+- Work is kept flowing: a window of jobs stays in flight, and every --chunk
+  finished jobs the results are committed in one RecordStore write and the
+  checkpoint file is updated. The checkpoint also remembers records that
+  failed (skipped on resume unless --retry-failed) and, with --force, the ones
+  already done
+- Workers are spawned fresh (no state inherited from this process) and run
+  at a lower priority (--nice), so a backfill on a box that also serves
+  requests yields to them
+- Progress goes to stderr per chunk; the final report (records/s, input MB/s,
+  worker CPU time and utilization) is printed as JSON
+
+A derivative is a module-level function run in the workers: it gets the local
+path of the record's source media, the temp paths to write its output files to
+and its params, and returns the values to set. Output files are stored in the
+MediaStore by the parent (deduplicated, referenced from the record).
+
+USAGE:
+  python backfill.py list
+  python backfill.py run thumbnails
+  python backfill.py run image_scores --workers 8 --chunk 500
+  python backfill.py run thumbnails --force --kinds creatures
+  python backfill.py run compact_audio
+  python backfill.py status thumbnails
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from collection_archive import iter_records
+
+logger = logging.getLogger(__name__)
+
+# Longest side of a gallery thumbnail
+THUMBNAIL_SIZE = 256
+
+
+# ----------------------------------------------------------------------
+# Derivatives (run in the worker processes)
+# ----------------------------------------------------------------------
+
+def make_thumbnail(source_path, outputs, size=THUMBNAIL_SIZE):
+    """A PNG no larger than size x size for the gallery"""
+    from PIL import Image
+
+    with Image.open(source_path) as image:
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        image.save(outputs["thumbnail_url"], "PNG", optimize=True)
+    return {}
+
+
+def score_stored_image(source_path, outputs):
+    """The image_selection score of an image generated before candidates were scored"""
+    from image_selection import score_image
+
+    with open(source_path, 'rb') as f:
+        return {"image_score": score_image(f.read())}
+
+
+class Derivative:
+    def __init__(self, name, work, source, fields, outputs=None, params=None, finish=None,
+                 kinds=("eggs", "creatures"), description=""):
+        """
+        work(source_path, outputs, **params) runs in a worker and returns {field: value}.
+        source: the record field with the media URL it reads.
+        fields: the record fields it sets (a record missing any of them needs it).
+        outputs: {field: media kind} of the files it writes; the field gets the file's URL.
+        params: keyword arguments of work, or a function returning them (read when a run starts).
+        finish(values): run in this process on the worker's values before they are saved.
+        """
+        self.name = name
+        self.work = work
+        self.source = source
+        self.fields = tuple(fields)
+        self.outputs = outputs or {}
+        self.params = params or {}
+        self.finish = finish
+        self.kinds = kinds
+        self.description = description
+
+    def needs(self, record, force=False):
+        if not record.get(self.source):
+            return False
+        return force or any(not record.get(field) for field in self.fields)
+
+
+def compact_sound(source_path, outputs, ffmpeg="ffmpeg", bitrate="32k"):
+    """A creature sound trimmed, normalized and re-encoded like new ones (see audio_processing)"""
+    from audio_processing import ENCODING_FIELD, AudioProcessor
+
+    with open(source_path, 'rb') as f:
+        content, info = AudioProcessor(ffmpeg=ffmpeg, bitrate=bitrate).compact(f.read())
+    with open(outputs["audio_url"], 'wb') as f:
+        f.write(content)
+    return {ENCODING_FIELD: info["encoding"]}
+
+
+def _audio_settings():
+    from config import Config
+
+    return {"ffmpeg": Config.FFMPEG_PATH, "bitrate": Config.AUDIO_BITRATE}
+
+
+def _acceptable(values):
+    from config import Config
+    from image_selection import ImageSelector
+
+    selector = ImageSelector(threshold=Config.IMAGE_SCORE_THRESHOLD, max_text=Config.IMAGE_MAX_TEXT)
+    values["image_score"]["acceptable"] = selector.acceptable(values["image_score"])
+    return values
+
+
+DERIVATIVES = {}
+
+
+def register(derivative):
+    DERIVATIVES[derivative.name] = derivative
+    return derivative
+
+
+register(Derivative(
+    "thumbnails", make_thumbnail, source="image_url", fields=["thumbnail_url"],
+    outputs={"thumbnail_url": "image"}, params={"size": THUMBNAIL_SIZE},
+    description=f"{THUMBNAIL_SIZE}px gallery thumbnails of egg and creature images"
+))
+register(Derivative(
+    "compact_audio", compact_sound, source="audio_url", fields=["audio_encoding"],
+    outputs={"audio_url": "audio"}, params=_audio_settings, kinds=("creatures",),
+    description="creature sounds trimmed, loudness-normalized and re-encoded at AUDIO_BITRATE (needs ffmpeg)"
+))
+register(Derivative(
+    "image_scores", score_stored_image, source="image_url", fields=["image_score"], finish=_acceptable,
+    description="image_selection scores of images generated before candidates were scored"
+))
+
+
+def _init_worker(nice):
+    if nice:
+        try:
+            os.nice(nice)
+        except OSError:
+            pass
+
+
+def _run_job(work, source_path, outputs, params):
+    """Worker side of a job: (values, error, cpu seconds). Errors come back as text (they may not pickle)"""
+    start = _cpu_seconds()
+    try:
+        values = work(source_path, outputs, **params)
+        error = None
+    except Exception as e:
+        values, error = None, f"{type(e).__name__}: {e}"
+    return values, error, _cpu_seconds() - start
+
+
+def _cpu_seconds():
+    """CPU time of this worker and the subprocesses it ran (ffmpeg)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# ----------------------------------------------------------------------
+# Checkpoints
+# ----------------------------------------------------------------------
+
+class Checkpoint:
+    """Progress of one derivative's backfill, rewritten atomically after every chunk"""
+
+    def __init__(self, path, derivative, force=False):
+        self.path = path
+        self.state = {"derivative": derivative, "force": force, "started_at": datetime.now().isoformat(),
+                      "updated_at": None, "complete": False, "done": [], "failed": {}, "totals": {}}
+        previous = self.load(path)
+        # Resume an unfinished run of the same kind; a finished one is history
+        if previous and not previous.get("complete") and previous.get("force") == force:
+            self.state = previous
+        self.done = set(self.state["done"])
+        self.resumed = bool(previous) and self.state is previous
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save(self, complete=False):
+        self.state["done"] = sorted(self.done)
+        self.state["updated_at"] = datetime.now().isoformat()
+        self.state["complete"] = complete
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+# ----------------------------------------------------------------------
+# Runner (this process)
+# ----------------------------------------------------------------------
+
+class Backfill:
+    def __init__(self, derivative, media_store, record_stores, checkpoint_path, workers=None,
+                 chunk_size=256, nice=10, force=False, retry_failed=False, kinds=None, progress=None):
+        """
+        record_stores: {"eggs": RecordStore, "creatures": RecordStore}.
+        progress(report) is called after every chunk (default: a line on stderr).
+        """
+        self.derivative = derivative
+        self.media_store = media_store
+        self.record_stores = record_stores
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(chunk_size, 1)
+        self.nice = nice
+        self.force = force
+        self.retry_failed = retry_failed
+        self.kinds = [kind for kind in (kinds or derivative.kinds) if kind in record_stores]
+        self.progress = progress or self._print_progress
+        self.params = derivative.params() if callable(derivative.params) else derivative.params
+        self.checkpoint = Checkpoint(checkpoint_path, derivative.name, force=force)
+
+    def _pending(self):
+        """(kind, record id, source URL) of every record still needing the derivative"""
+        failed = self.checkpoint.state["failed"]
+        skipped = 0
+        pending = []
+        for kind in self.kinds:
+            for record in iter_records(self.record_stores[kind].path):
+                key = f"{kind}:{record.get('id')}"
+                if not self.derivative.needs(record, force=self.force):
+                    continue
+                if key in self.checkpoint.done or (key in failed and not self.retry_failed):
+                    skipped += 1
+                    continue
+                pending.append((kind, record.get('id'), record[self.derivative.source]))
+        return pending, skipped
+
+    def run(self):
+        pending, skipped = self._pending()
+        report = {
+            "derivative": self.derivative.name, "workers": self.workers, "resumed": self.checkpoint.resumed,
+            "records": {"pending": len(pending), "processed": 0, "failed": 0, "skipped": skipped},
+            "chunks": 0, "input_bytes": 0, "cpu_seconds": 0.0, "seconds": 0.0,
+        }
+        start = time.perf_counter()
+        results = []  # (kind, record id, values) awaiting the next commit
+        finished_since_commit = 0
+
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                       initializer=_init_worker, initargs=(self.nice,))
+        try:
+            jobs = iter(pending)
+            in_flight = {}
+            window = self.workers * 4
+
+            def submit():
+                for kind, record_id, url in jobs:
+                    job = self._job(executor, kind, record_id, url, report)
+                    if job:
+                        in_flight[job[0]] = job[1:]
+                        return True
+                return False
+
+            while len(in_flight) < window and submit():
+                pass
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    kind, record_id, outputs = in_flight.pop(future)
+                    values, error, cpu = future.result()
+                    report["cpu_seconds"] += cpu
+                    if error:
+                        self._fail(kind, record_id, error, report, outputs)
+                    else:
+                        results.append((kind, record_id, self._store_outputs(values, outputs)))
+                    finished_since_commit += 1
+                    if finished_since_commit >= self.chunk_size:
+                        self._commit(results, report, start)
+                        results, finished_since_commit = [], 0
+                    submit()
+        except KeyboardInterrupt:
+            # Keep what finished; the rest is picked up by the next run
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._commit(results, report, start)
+            raise
+        executor.shutdown()
+        self._commit(results, report, start, complete=True)
+        return report
+
+    def _job(self, executor, kind, record_id, url, report):
+        """Submit one record's work; None (and a recorded failure) if its source file is missing"""
+        source_path = self.media_store.local_path(url)
+        if not source_path or not os.path.exists(source_path):
+            self._fail(kind, record_id, f"missing media: {url}", report)
+            return None
+        report["input_bytes"] += os.path.getsize(source_path)
+        outputs = {field: self.media_store.temp_path(media_kind)
+                   for field, media_kind in self.derivative.outputs.items()}
+        future = executor.submit(_run_job, self.derivative.work, source_path, outputs, self.params)
+        return future, kind, record_id, outputs
+
+    def _store_outputs(self, values, outputs):
+        values = dict(values or {})
+        for field, tmp_path in outputs.items():
+            values[field] = self.media_store.put_file(tmp_path, self.derivative.outputs[field])
+        if self.derivative.finish:
+            values = self.derivative.finish(values)
+        return values
+
+    def _fail(self, kind, record_id, error, report, outputs=None):
+        logger.warning(f"Backfill {self.derivative.name} failed for {kind} {record_id}: {error}")
+        self.checkpoint.state["failed"][f"{kind}:{record_id}"] = error
+        report["records"]["failed"] += 1
+        for tmp_path in (outputs or {}).values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, results, report, start, complete=False):
+        """Save a chunk of results (one write per store), then the checkpoint"""
+        by_kind = {}
+        for kind, record_id, values in results:
+            by_kind.setdefault(kind, {})[record_id] = values
+
+        for kind, updates in by_kind.items():
+            def apply(records):
+                replaced, saved = [], set()
+                for record in records:
+                    values = updates.get(record.get('id'))
+                    if values is None:
+                        continue
+                    replaced.extend(record.get(field) for field in self.derivative.outputs if record.get(field))
+                    record.update(values)
+                    saved.add(record['id'])
+                return replaced, saved
+
+            replaced, saved = self.record_stores[kind].commit(apply)
+            # Files of records deleted meanwhile stay unreferenced, for the media GC
+            self.media_store.ref(*(updates[record_id].get(field) for record_id in saved
+                                   for field in self.derivative.outputs))
+            self.media_store.unref(*replaced)
+            for record_id in saved:
+                self.checkpoint.done.add(f"{kind}:{record_id}")
+                self.checkpoint.state["failed"].pop(f"{kind}:{record_id}", None)
+            report["records"]["processed"] += len(saved)
+
+        report["chunks"] += 1
+        report["seconds"] = time.perf_counter() - start
+        self.checkpoint.state["totals"] = {key: report["records"][key] for key in ("processed", "failed")}
+        self.checkpoint.save(complete=complete)
+        self.progress(_summary(report, self.workers))
+
+    def _print_progress(self, report):
+        records = report["records"]
+        done = records["processed"] + records["failed"]
+        rate = report["records_per_second"] or 0
+        eta = (records["pending"] - done) / rate if rate else 0
+        print(f"[{report['derivative']}] {done}/{records['pending']} "
+              f"({100 * done / max(records['pending'], 1):.1f}%) {rate:.1f} records/s, "
+              f"{records['failed']} failed, eta {eta:.0f}s", file=sys.stderr)
+
+
+def _summary(report, workers):
+    """The report with its rates filled in"""
+    seconds = report["seconds"]
+    summary = dict(report)
+    summary["records"] = dict(report["records"])
+    summary["seconds"] = round(seconds, 3)
+    summary["cpu_seconds"] = round(report["cpu_seconds"], 3)
+    summary["records_per_second"] = round(report["records"]["processed"] / seconds, 2) if seconds else None
+    summary["input_mb_per_second"] = round(report["input_bytes"] / 1024 / 1024 / seconds, 2) if seconds else None
+    # Share of the pool's core time spent in the derivative (the rest is I/O, pickling, this process)
+    summary["worker_utilization"] = round(report["cpu_seconds"] / (seconds * workers), 3) if seconds else None
+    return summary
+
+
+def main(argv=None):
+    import argparse
+
+    from config import Config
+    from media_backends import backend_from_config
+    from media_store import MediaStore
+    from record_store import RecordStore
+
+    parser = argparse.ArgumentParser(description="Compute derived artifacts for every existing egg and creature")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="show the derivatives")
+    run_parser = subparsers.add_parser("run", help="backfill a derivative (re-run to resume)")
+    run_parser.add_argument("derivative", choices=sorted(DERIVATIVES))
+    run_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    run_parser.add_argument("--chunk", type=int, default=256, help="records per commit and checkpoint")
+    run_parser.add_argument("--nice", type=int, default=10, help="priority increment of the workers")
+    run_parser.add_argument("--force", action="store_true", help="recompute records that already have it")
+    run_parser.add_argument("--retry-failed", action="store_true", help="retry records that failed last time")
+    run_parser.add_argument("--kinds", nargs="+", choices=["eggs", "creatures"])
+    status_parser = subparsers.add_parser("status", help="show a derivative's checkpoint")
+    status_parser.add_argument("derivative", choices=sorted(DERIVATIVES))
+    for sub in (run_parser, status_parser):
+        sub.add_argument("--checkpoint-dir", default=Config.BACKFILL_CHECKPOINT_DIR)
+    run_parser.add_argument("--root", default=Config.STATIC_FOLDER)
+    run_parser.add_argument("--index", default=Config.MEDIA_INDEX_PATH)
+    run_parser.add_argument("--eggs", default="eggs_data.json")
+    run_parser.add_argument("--creatures", default="creatures_data.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name, derivative in DERIVATIVES.items():
+            print(f"{name:16} {', '.join(derivative.fields):24} {derivative.description}")
+        return
+
+    checkpoint_path = os.path.join(args.checkpoint_dir, f"{args.derivative}.json")
+    if args.command == "status":
+        state = Checkpoint.load(checkpoint_path)
+        if state is None:
+            parser.exit(1, f"no checkpoint for {args.derivative}\n")
+        state["done"] = len(state["done"])
+        print(json.dumps(state, indent=2))
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    settings = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    media_store = MediaStore(args.root, args.index, backend=backend_from_config(settings, root=args.root))
+    try:
+        backfill = Backfill(
+            DERIVATIVES[args.derivative], media_store,
+            {"eggs": RecordStore(args.eggs, fsync=Config.RECORDS_FSYNC),
+             "creatures": RecordStore(args.creatures, fsync=Config.RECORDS_FSYNC)},
+            checkpoint_path, workers=args.workers, chunk_size=args.chunk, nice=args.nice,
+            force=args.force, retry_failed=args.retry_failed, kinds=args.kinds
+        )
+        report = backfill.run()
+    except KeyboardInterrupt:
+        parser.exit(130, "interrupted, re-run to resume\n")
+    finally:
+        media_store.close()
+    print(json.dumps(_summary(report, backfill.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
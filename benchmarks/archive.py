@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark for collection export / import.
+
+Seeds a scratch collection with --files random media files of --file-mb each
+and --records eggs and creatures, exports it (to a file, or to nothing with
+--discard), then imports the archive into a second, empty scratch collection.
+Reports MB/s for each step and the peak Python heap (tracemalloc) while it ran,
+which should stay around a few chunks however big the collection is.
+
+    python benchmarks/archive.py
+    python benchmarks/archive.py --files 200 --file-mb 20 --format tar.gz
+    python benchmarks/archive.py --files 1000 --file-mb 10 --discard      # a 10 GB export
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from collection_archive import ARCHIVE_FORMATS, CollectionArchive  # noqa: E402
+from media_store import MediaStore  # noqa: E402
+from record_store import RecordStore  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def open_collection(directory):
+    # Media URLs are /static/..., relative to the app directory
+    os.chdir(directory)
+    media_store = MediaStore("static", "media_index.db")
+    stores = {kind: RecordStore(f"{kind}_data.json", fsync=False) for kind in ("eggs", "creatures")}
+    return media_store, CollectionArchive(media_store, stores)
+
+
+def seed(directory, files, file_mb, records):
+    media_store, archive = open_collection(directory)
+    urls = []
+    for _ in range(files):
+        tmp_path = media_store.temp_path("image")
+        with open(tmp_path, "wb") as f:
+            for _ in range(int(file_mb)):
+                f.write(os.urandom(MB))
+            f.write(os.urandom(int((file_mb % 1) * MB)))
+        urls.append(media_store.put_file(tmp_path, "image"))
+    for kind, store in archive.record_stores.items():
+        store.commit(lambda rows: rows.extend({
+            "id": str(uuid.uuid4()),
+            "description": f"A benchmark {kind} record with a description of typical length " * 4,
+            "descriptors": ["whimsical", "verdant", "organic"],
+            "image_url": urls[i % len(urls)] if urls else None,
+        } for i in range(records)))
+    media_store.close()
+
+
+def timed(step):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = step()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--file-mb", type=float, default=5)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--format", choices=list(ARCHIVE_FORMATS), default="zip")
+    parser.add_argument("--discard", action="store_true", help="don't write the archive (export only)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        source, target = os.path.join(scratch, "source"), os.path.join(scratch, "target")
+        os.makedirs(source)
+        os.makedirs(target)
+        print(f"Seeding {args.files} x {args.file_mb} MB media files and {args.records} records per kind...")
+        seed(source, args.files, args.file_mb, args.records)
+
+        media_store, archive = open_collection(source)
+        path = os.path.join(scratch, f"collection{ARCHIVE_FORMATS[args.format][0]}")
+
+        def export():
+            report = {}
+            with open(os.devnull if args.discard else path, "wb") as out:
+                for chunk in archive.export(args.format, report=report):
+                    out.write(chunk)
+            return report
+
+        report, seconds, peak = timed(export)
+        media_store.close()
+        print(f"export  {report['bytes'] / MB:9.1f} MB in {seconds:6.2f}s  "
+              f"{report['bytes'] / MB / seconds:8.1f} MB/s  peak heap {peak / MB:.1f} MB")
+        if args.discard:
+            return
+
+        media_store, archive = open_collection(target)
+        report, seconds, peak = timed(lambda: archive.import_archive(path))
+        size = os.path.getsize(path)
+        print(f"import  {size / MB:9.1f} MB in {seconds:6.2f}s  {size / MB / seconds:8.1f} MB/s  "
+              f"peak heap {peak / MB:.1f} MB")
+        print(json.dumps(report["records"]))
+
+        report, seconds, _ = timed(lambda: archive.import_archive(path))
+        print(f"re-import (resume: everything already there) in {seconds:.2f}s: {json.dumps(report['media'])}")
+        media_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the descriptor search index.
+
+Builds a synthetic collection of eggs in a temporary SQLite index and times
+typical /api/search queries against it.
+
+    python benchmarks/bench_search.py --records 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from search_index import SearchIndex  # noqa: E402
+
+# Descriptors follow a long-tailed distribution like the real collection: a
+# handful recur everywhere ("whimsical", "mystical") and most are rare.
+COMMON_DESCRIPTORS = [
+    "whimsical", "verdant", "organic", "mystical", "crystalline", "aurora",
+    "ethereal", "ancient", "cozy", "bright", "playful", "natural",
+]
+RARE_DESCRIPTORS = [f"trait{i}" for i in range(5000)]
+WORDS = [f"word{i}" for i in range(20000)] + ["vines", "moon", "river", "glow"]
+
+
+def make_egg(i):
+    descriptors = random.sample(COMMON_DESCRIPTORS, k=1) + random.sample(RARE_DESCRIPTORS, k=random.randint(3, 6))
+    return {
+        "id": str(uuid.uuid4()),
+        "description": " ".join(random.choices(WORDS, k=40)),
+        "descriptors": descriptors,
+        "image_url": f"/static/images/egg_{i}.png",
+        "created_at": f"2025-01-01T00:00:{i:08d}",
+        "status": "created",
+        "incubation_stage": 0,
+    }
+
+
+def time_query(index, runs, **kwargs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        index.search(**kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SearchIndex(os.path.join(tmp, "search_index.db"))
+
+        start = time.perf_counter()
+        index.rebuild([make_egg(i) for i in range(args.records)], [])
+        print(f"Indexed {args.records} eggs in {time.perf_counter() - start:.1f}s")
+
+        queries = {
+            "rare descriptor": dict(descriptors=["trait17"], limit=20),
+            "2 descriptors AND": dict(descriptors=["verdant", "trait17"], limit=20),
+            "3 descriptors OR": dict(descriptors=["trait17", "trait42", "trait99"], mode="or", limit=20),
+            "full text": dict(q="vines", limit=20),
+            "descriptor + text": dict(descriptors=["mystical"], q="moon", limit=20),
+            "common descriptor": dict(descriptors=["whimsical"], limit=20),
+        }
+        print(f"{'query':<22} {'median ms':>10} {'max ms':>10}")
+        for name, kwargs in queries.items():
+            median, worst = time_query(index, args.runs, **kwargs)
+            print(f"{name:<22} {median:>10.3f} {worst:>10.3f}")
+
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the similar-eggs engine.
+
+Builds synthetic memory-mapped indexes at 10k and 100k eggs and times
+single and batched top-k cosine queries.
+
+    python benchmarks/bench_similarity.py --sizes 10000 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from similarity import SimilarityIndex  # noqa: E402
+
+DESCRIPTORS = [f"trait{i}" for i in range(2000)] + ["whimsical", "verdant", "organic", "mystical"]
+WORDS = [f"word{i}" for i in range(20000)]
+
+
+def make_egg():
+    return {
+        "id": str(uuid.uuid4()),
+        "description": " ".join(random.choices(WORDS, k=60)),
+        "descriptors": random.sample(DESCRIPTORS, k=random.randint(4, 8)),
+    }
+
+
+def time_it(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(42)
+    print(f"{'eggs':>8} {'build s':>8} {'reweight ms':>12} {'k=5 ms':>8} {f'batch {args.batch} ms':>12} {'add ms':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = SimilarityIndex(tmp, dimensions=args.dimensions)
+            eggs = [make_egg() for _ in range(size)]
+
+            start = time.perf_counter()
+            index.rebuild(eggs)
+            build = time.perf_counter() - start
+
+            # First query after a change pays for the IDF/norm refresh
+            start = time.perf_counter()
+            index.similar(eggs[0]["id"])
+            reweight = (time.perf_counter() - start) * 1000
+
+            single = time_it(lambda: index.similar(random.choice(eggs)["id"], k=5), args.runs)
+            batch_ids = [egg["id"] for egg in random.sample(eggs, args.batch)]
+            batch = time_it(lambda: index.similar_batch(batch_ids, k=5), args.runs)
+
+            def add_one():
+                egg = make_egg()
+                index.add(egg["id"], egg["description"], egg["descriptors"])
+            add = time_it(add_one, args.runs)
+
+            print(f"{size:>8} {build:>8.1f} {reweight:>12.1f} {single:>8.2f} {batch:>12.2f} {add:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Startup import-time budget for the Hatch app modules.
+
+Imports each entry module in a fresh interpreter under `python -X importtime`
+(in a scratch directory, so hatch.log and the data directories don't land in
+the repo), keeps the best of --runs, and exits non-zero if a module is over its
+budget or pulls in one of the heavy modules that must stay lazy (they are
+imported on first use; importing them eagerly costs ~0.8 s per worker boot).
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 7 --budget app=300 --json startup.json
+
+The budgets have headroom for slower CI machines; the lazy-module check is the
+precise guard.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Cumulative import time of the module itself, in milliseconds
+BUDGETS_MS = {
+    "app": 300,
+    "app_simple": 250,
+}
+
+# Must not be imported at startup: the heavy third-party modules, and the app's modules
+# that only some routes (or maintenance commands) use
+LAZY_MODULES = ("openai", "PIL", "numpy", "requests",
+                "media_store", "collection_archive", "audio_processing", "static_assets", "profiling")
+
+
+def parse_importtime(stderr):
+    """[(name, self_us, cumulative_us, depth)] from -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        self_us, cumulative_us, raw_name = int(parts[0]), int(parts[1]), parts[2]
+        name = raw_name.strip()
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        entries.append((name, self_us, cumulative_us, depth))
+    return entries
+
+
+def measure(module, workdir):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT
+    env.setdefault("OPENAI_API_KEY", "import-time")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    entries = parse_importtime(result.stderr)
+    total_us = next((cumulative for name, _, cumulative, depth in entries if name == module and depth == 0), 0)
+    loaded = {name.split(".")[0] for name, _, _, _ in entries}
+    top = sorted((e for e in entries if e[3] == 1), key=lambda e: e[2], reverse=True)[:8]
+    return {
+        "total_ms": total_us / 1000,
+        "eager_heavy": sorted(m for m in LAZY_MODULES if m in loaded),
+        "top_imports_ms": {name: cumulative / 1000 for name, _, cumulative, _ in top},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=sorted(BUDGETS_MS))
+    parser.add_argument("--runs", type=int, default=5, help="best of N fresh interpreters")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS", help="override a budget")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS_MS)
+    for spec in args.budget:
+        module, _, ms = spec.partition("=")
+        budgets[module] = float(ms)
+
+    results = {}
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="hatch-import-") as workdir:
+        for module in args.modules:
+            runs = [measure(module, workdir) for _ in range(args.runs)]
+            best = min(runs, key=lambda r: r["total_ms"])
+            budget = budgets.get(module)
+            over = budget is not None and best["total_ms"] > budget
+            results[module] = {**best, "budget_ms": budget, "over_budget": over}
+
+            status = "OVER BUDGET" if over else "ok"
+            print(f"{module:<12} {best['total_ms']:>8.1f} ms  (budget {budget} ms)  {status}")
+            for name, ms in best["top_imports_ms"].items():
+                print(f"    {name:<20} {ms:>8.1f} ms")
+            if best["eager_heavy"]:
+                print(f"    imported at startup but should be lazy: {', '.join(best['eager_heavy'])}")
+            failed = failed or over or bool(best["eager_heavy"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
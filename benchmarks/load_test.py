@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Load test for the Hatch app against the offline mock OpenAI server.
+
+Starts mock_openai.py, then for each gunicorn worker model starts the app in a
+scratch directory (seeded with the repo's JSON data), logs in, and drives the
+main endpoints with concurrent clients. Reports p50/p95/p99 latency and
+throughput per endpoint and worker model. No network or API key is needed.
+
+    python benchmarks/load_test.py --worker-models sync gthread --concurrency 8 --requests 40
+
+Use --mock-latency to model the real API (e.g. images=lognormal:12:0.3) and
+--json to write the raw numbers for comparison in CI.
+
+The "asgi" worker model serves asgi:app (the async mode, app_async.py) under
+uvicorn workers; compare it with the sync models at a concurrency well above
+the worker count:
+
+    python benchmarks/load_test.py --worker-models sync gthread asgi \
+        --concurrency 64 --requests 128 --mock-latency images=fixed:2 \
+        --endpoints create-egg hatch-creature
+
+--bulk-sessions runs that many extra sessions bulk-creating eggs in the batch
+lane (X-Hatch-Priority: batch) while each endpoint is measured, to check that
+interactive latency holds up under a bulk job:
+
+    python benchmarks/load_test.py --worker-models gthread --bulk-sessions 4 \
+        --endpoints hatch-creature analyze-image --mock-latency images=fixed:2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SAMPLE_IMAGE = os.path.join(REPO_ROOT, "static", "images", "egg_012cf661-539c-42b1-b84f-37fec9354541.png")
+
+WORKER_MODELS = {
+    "sync": ["--worker-class", "sync"],
+    "gthread": ["--worker-class", "gthread", "--threads", "8"],
+    "gevent": ["--worker-class", "gevent", "--worker-connections", "200"],
+    "asgi": ["--worker-class", "uvicorn.workers.UvicornWorker"],
+}
+
+# Worker models that serve a different entry point than --app
+APP_MODULES = {
+    "asgi": "asgi:app",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class HatchClient:
+    """One logged-in browser session"""
+
+    def __init__(self, base_url, password, cookies=None):
+        self.base_url = base_url
+        self.session = requests.Session()
+        if cookies is not None:
+            self.session.cookies.update(cookies)  # another connection of an existing session
+        else:
+            self.session.post(f"{base_url}/login", data={"password": password}, allow_redirects=False)
+
+    def create_egg(self, priority=None):
+        return self.session.post(f"{self.base_url}/api/create-egg", json={
+            "description": "A speckled egg with soft green swirls and a warm golden glow",
+            "descriptors": ["verdant", "whimsical", "glowing"],
+            "fresh": True,
+        }, headers={"X-Hatch-Priority": priority} if priority else None)
+
+    def analyze_image(self):
+        with open(SAMPLE_IMAGE, "rb") as f:
+            return self.session.post(f"{self.base_url}/api/analyze-image", files={"image": ("sample.png", f, "image/png")})
+
+    def hatch_creature(self, egg_id):
+        return self.session.post(f"{self.base_url}/api/hatch-creature", json={
+            "egg_id": egg_id,
+            "care_responses": {"activities": "sing lullabies"},
+        })
+
+    def list_eggs(self):
+        return self.session.get(f"{self.base_url}/api/eggs")
+
+    def list_creatures(self):
+        return self.session.get(f"{self.base_url}/api/creatures")
+
+
+def run_bulk(base_url, password, sessions, stop, per_session=4):
+    """Bulk-create eggs in the batch lane, `per_session` at a time from each of `sessions`, until `stop` is set"""
+    counts = {"requests": 0, "rejected": 0}
+    lock = threading.Lock()
+
+    def worker(client):
+        while not stop.is_set():
+            try:
+                status = client.create_egg(priority="batch").status_code
+            except requests.RequestException:
+                status = None
+            with lock:
+                counts["requests"] += 1
+                if status in (429, 503):
+                    counts["rejected"] += 1
+            if status in (429, 503):
+                time.sleep(1)
+
+    threads = []
+    for _ in range(sessions):
+        login = HatchClient(base_url, password)
+        for _ in range(per_session):
+            client = HatchClient(base_url, password, cookies=login.session.cookies)
+            threads.append(threading.Thread(target=worker, args=(client,), daemon=True))
+    for thread in threads:
+        thread.start()
+    return threads, counts
+
+
+def run_endpoint(base_url, password, name, concurrency, total, egg_ids, bulk_sessions=0):
+    """Fire `total` requests at one endpoint from `concurrency` clients (optionally under a bulk job)"""
+    clients = [HatchClient(base_url, password) for _ in range(concurrency)]
+    stop = threading.Event()
+    bulk_threads, bulk = run_bulk(base_url, password, bulk_sessions, stop) if bulk_sessions else ([], None)
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(client):
+        nonlocal failures
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                if name == "hatch-creature":
+                    response = client.hatch_creature(egg_ids[i % len(egg_ids)])
+                else:
+                    response = getattr(client, name.replace("-", "_"))()
+                ok = response.status_code == 200 and response.json().get("success", False)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, clients))
+    wall = time.perf_counter() - start
+    stop.set()
+    for thread in bulk_threads:
+        thread.join()
+
+    return {
+        "bulk": bulk,
+        "requests": len(latencies),
+        "failures": failures,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+    }
+
+
+def start_app(worker_model, workers, port, mock_url, workdir, app_module):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": mock_url,
+        "WEBSITE_PASSWORD": "loadtest",
+        "SECRET_KEY": "loadtest",
+        "PYTHONPATH": REPO_ROOT,
+    })
+    command = [
+        sys.executable, "-m", "gunicorn", app_module,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--chdir", workdir,
+        "--timeout", "300",
+        # Idle keep-alive connections can hold a gthread worker's graceful shutdown open
+        "--graceful-timeout", "5",
+        "--log-level", "warning",
+    ] + WORKER_MODELS[worker_model]
+    return subprocess.Popen(command, env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_workdir():
+    """Scratch directory with a copy of the collection so the repo stays untouched"""
+    workdir = tempfile.mkdtemp(prefix="hatch-load-")
+    for name in ("eggs_data.json", "creatures_data.json"):
+        shutil.copy(os.path.join(REPO_ROOT, name), workdir)
+    os.makedirs(os.path.join(workdir, "static", "images"))
+    os.makedirs(os.path.join(workdir, "static", "audio"))
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-models", nargs="+", default=["sync", "gthread"], choices=sorted(WORKER_MODELS))
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=40, help="requests per endpoint")
+    parser.add_argument("--endpoints", nargs="+",
+                        default=["create-egg", "analyze-image", "hatch-creature", "list-eggs", "list-creatures"])
+    parser.add_argument("--app", default="app:app", help="WSGI app to serve (the asgi model always serves asgi:app)")
+    parser.add_argument("--mock-latency", action="append", default=[], metavar="GROUP=SPEC",
+                        help="passed through to mock_openai.py --latency")
+    parser.add_argument("--bulk-sessions", type=int, default=0,
+                        help="sessions bulk-creating eggs in the batch lane while each endpoint is measured")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock_command = [sys.executable, os.path.join(REPO_ROOT, "mock_openai.py"), "--port", str(mock_port),
+                    "--error-rate", str(args.mock_error_rate), "--rate-limit-rate", str(args.mock_rate_limit_rate)]
+    for spec in args.mock_latency:
+        mock_command += ["--latency", spec]
+    mock = subprocess.Popen(mock_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    mock_url = f"http://127.0.0.1:{mock_port}/v1"
+
+    results = {}
+    try:
+        wait_for(f"{mock_url}/models")
+
+        for worker_model in args.worker_models:
+            workdir = make_workdir()
+            port = free_port()
+            app_module = APP_MODULES.get(worker_model, args.app)
+            server = start_app(worker_model, args.workers, port, mock_url, workdir, app_module)
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                wait_for(f"{base_url}/health")
+
+                # Hatching needs eggs to hatch
+                egg_ids = []
+                if "hatch-creature" in args.endpoints:
+                    setup = HatchClient(base_url, "loadtest")
+                    for _ in range(min(args.requests, 20)):
+                        response = setup.create_egg().json()
+                        if response.get("success"):
+                            egg_ids.append(response["egg"]["id"])
+
+                results[worker_model] = {}
+                for endpoint in args.endpoints:
+                    if endpoint == "hatch-creature" and not egg_ids:
+                        continue
+                    results[worker_model][endpoint] = run_endpoint(
+                        base_url, "loadtest", endpoint, args.concurrency, args.requests, egg_ids,
+                        bulk_sessions=args.bulk_sessions
+                    )
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    header = f"{'model':<8} {'endpoint':<15} {'reqs':>5} {'fail':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for worker_model, endpoints in results.items():
+        for endpoint, r in endpoints.items():
+            print(f"{worker_model:<8} {endpoint:<15} {r['requests']:>5} {r['failures']:>5} "
+                  f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['throughput_rps']:>8.1f}")
+            if r["bulk"]:
+                print(f"{'':<8} {'  + bulk':<15} {r['bulk']['requests']:>5} {r['bulk']['rejected']:>5}  (batch creates, rejected)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
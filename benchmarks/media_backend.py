@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the media store backends.
+
+Times, per backend, what the app does with media: storing new images
+(~1.5 MB PNG-sized blobs), storing bytes that are already there (the
+deduplicated path), a streamed upload large enough to go multipart, and
+serving (a redirect URL, or a local file through the read-through cache, cold
+and warm). Also runs a GC pass to check that listing and deletion work.
+
+    python benchmarks/media_backend.py --backends local s3
+    python benchmarks/media_backend.py --backends s3 --endpoint-url http://127.0.0.1:9000 --bucket hatch-media
+
+Without --endpoint-url the s3 backend runs against an in-process moto server
+(pip install moto boto3), a local stand-in for MinIO / S3.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from media_backends import LocalBackend, ReadThroughCache, S3Backend, MB  # noqa: E402
+from media_store import MediaStore  # noqa: E402
+
+
+def start_moto(bucket):
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint = f"http://{host}:{port}"
+    boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1").create_bucket(Bucket=bucket)
+    return server, endpoint
+
+
+def timed(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run(name, backend, workdir, args):
+    store = MediaStore("static", os.path.join(workdir, f"{name}.db"), backend=backend)
+    image_size = int(args.image_mb * MB)
+    results = {"backend": name}
+
+    blobs = [os.urandom(image_size) for _ in range(args.runs)]
+    start = time.perf_counter()
+    urls = [store.put(blob, "image") for blob in blobs]
+    elapsed = time.perf_counter() - start
+    results["put_ms"] = round(elapsed * 1000 / args.runs, 1)
+    results["put_mb_s"] = round(image_size * args.runs / MB / elapsed, 1)
+    results["dedup_put_ms"] = round(timed(lambda: store.put(blobs[0], "image"), args.runs), 2)
+
+    large = os.urandom(int(args.large_mb * MB))
+
+    def upload_large():
+        tmp_path = store.temp_path("audio")
+        with open(tmp_path, 'wb') as f:
+            f.write(large)
+        store.put_file(tmp_path, "audio")
+
+    start = time.perf_counter()
+    upload_large()
+    results["large_upload_mb_s"] = round(args.large_mb / (time.perf_counter() - start), 1)
+
+    redirect = store.redirect_url(urls[0])
+    results["serve"] = "redirect" if redirect else "file"
+    if redirect:
+        results["serve_ms"] = round(timed(lambda: store.redirect_url(urls[0]), args.runs), 2)
+    if isinstance(backend, S3Backend):
+        # Cold: fetched from the bucket into the read-through cache; warm: the cached copy
+        cold = []
+        for url in urls:
+            start = time.perf_counter()
+            store.local_path(url)
+            cold.append((time.perf_counter() - start) * 1000)
+        results["cache_cold_ms"] = round(statistics.median(cold), 1)
+        results["cache_warm_ms"] = round(timed(lambda: store.local_path(urls[0]), args.runs), 2)
+    else:
+        results["local_path_ms"] = round(timed(lambda: store.local_path(urls[0]), args.runs), 3)
+
+    report = store.gc({urls[0]: 1}, grace_seconds=0)
+    results["gc_deleted"] = report["deleted"]
+    results["gc_mb_reclaimed"] = round(report["bytes_reclaimed"] / MB, 1)
+    if isinstance(backend, S3Backend):
+        results["multipart_uploads"] = backend.metrics["multipart_uploads"]
+    store.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["local", "s3"], choices=["local", "s3"])
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint (default: in-process moto server)")
+    parser.add_argument("--bucket", default="hatch-media-bench")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--image-mb", type=float, default=1.5)
+    parser.add_argument("--large-mb", type=float, default=24, help="streamed upload size (multipart above 8 MB)")
+    args = parser.parse_args()
+
+    server = None
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            for name in args.backends:
+                if name == "local":
+                    backend = LocalBackend(os.path.join(workdir, "static"))
+                else:
+                    endpoint = args.endpoint_url
+                    if endpoint is None:
+                        server, endpoint = start_moto(args.bucket)
+                    backend = S3Backend(args.bucket, prefix="bench/", endpoint_url=endpoint, region="us-east-1",
+                                        cache=ReadThroughCache(os.path.join(workdir, "cache"), max_bytes=256 * MB))
+                rows.append(run(name, backend, workdir, args))
+        finally:
+            if server is not None:
+                server.stop()
+
+    for row in rows:
+        print("  ".join(f"{key}={value}" for key, value in row.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark for signed media URLs.
+
+Serves one thumbnail through the app (Flask test client, no network) the old
+way, with the login session cookie, and from a signed URL, and reports the
+per-request time and whether the response is cacheable by a shared cache
+(public, no Vary: Cookie, no Set-Cookie). Also times signing a listing of
+--records egg records, cold and with the per-step sign cache warm, and checks
+that a rebuilt listing hands out the same URLs (so the browser copy is hit).
+
+    python benchmarks/media_urls.py
+    python benchmarks/media_urls.py --requests 5000 --records 2000
+"""
+
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app import app, get_media_url_signer  # noqa: E402
+from media_urls import MediaURLSigner  # noqa: E402
+
+
+def per_request_us(client, url, requests, **kwargs):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url, **kwargs)
+        timings.append((time.perf_counter() - start) * 1e6)
+        response.close()
+    return statistics.median(timings), response
+
+
+def cacheable(response):
+    cache_control = response.headers.get("Cache-Control", "")
+    return ("public" in cache_control and "Cookie" not in response.headers.get("Vary", "")
+            and "Set-Cookie" not in response.headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--records", type=int, default=1000, help="egg records in the signed listing")
+    parser.add_argument("--image-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    content = os.urandom(args.image_kb * 1024)
+    url = f"/static/images/{hashlib.sha256(content).hexdigest()}.png"
+    path = os.path.join(app.config.get('STATIC_FOLDER', 'static'), url[len("/static/"):])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+    try:
+        signer = get_media_url_signer()
+        if signer is None:
+            sys.exit("MEDIA_SIGNED_URLS is off")
+        anonymous = app.test_client()
+        logged_in = app.test_client()
+        logged_in.post("/login", data={"password": app.config['WEBSITE_PASSWORD']})
+
+        session_us, session_response = per_request_us(logged_in, url, args.requests)
+        signed_us, signed_response = per_request_us(anonymous, signer.sign(url), args.requests)
+        print(f"{'serving':>8} {'status':>7} {'median_us':>10} {'cacheable':>10}  cache-control")
+        for name, median, response in (("session", session_us, session_response),
+                                       ("signed", signed_us, signed_response)):
+            print(f"{name:>8} {response.status_code:>7} {median:>10.1f} {str(cacheable(response)):>10}  "
+                  f"{response.headers.get('Cache-Control')}")
+    finally:
+        os.remove(path)
+
+    records = [{"id": str(i), "image_url": f"/static/images/{hashlib.sha256(str(i).encode()).hexdigest()}.png"}
+               for i in range(args.records)]
+    fresh = MediaURLSigner(["bench"], ttl_seconds=86400, step_seconds=3600)
+    start = time.perf_counter()
+    first = [fresh.sign_record(record) for record in records]
+    cold_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    second = [fresh.sign_record(record) for record in records]
+    warm_ms = (time.perf_counter() - start) * 1000
+    stable = sum(a["image_url"] == b["image_url"] for a, b in zip(first, second))
+    verify_us = statistics.median(
+        _timed_us(lambda: fresh.verify_url(first[0]["image_url"])) for _ in range(args.requests))
+    print(f"sign {args.records} records: cold {cold_ms:.2f} ms, warm {warm_ms:.2f} ms; "
+          f"{stable}/{args.records} URLs unchanged on relisting; verify {verify_us:.1f} us")
+
+
+def _timed_us(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1e6
+
+
+if __name__ == "__main__":
+    main()
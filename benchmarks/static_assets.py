@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark for static asset bundles and response compression.
+
+Serves the app from a local threaded server and loads the page the way a first
+visit does (the HTML, its stylesheet and script, then /api/eggs and
+/api/creatures), twice: as before (original assets through the Flask static
+handler, no response compression) and as now (the fingerprinted build from
+`python static_assets.py build`, pre-encoded variants, compressed JSON). Reports
+the bytes on the wire and the median TTFB and total time per resource, plus the
+transfer time of the whole first load at --mbps.
+
+The build is written to static/dist as on deploy. Reads the configured egg and
+creature data; nothing is written to it.
+
+    python benchmarks/static_assets.py
+    python benchmarks/static_assets.py --rounds 50 --accept-encoding gzip --mbps 1.5 --json results.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import static_assets  # noqa: E402
+from app import app  # noqa: E402
+
+API_URLS = ("/api/eggs", "/api/creatures")
+
+
+def fetch(port, path, headers):
+    """(bytes on the wire, TTFB seconds, total seconds, response headers)"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    start = time.perf_counter()
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    ttfb = time.perf_counter() - start
+    body = response.read()
+    total = time.perf_counter() - start
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"GET {path}: {response.status}")
+    return body, ttfb, total, dict(response.getheaders())
+
+
+def first_load(port, headers):
+    """[(resource, bytes, ttfb, total, encoding)] for one first visit"""
+    html, ttfb, total, response_headers = fetch(port, "/", headers)
+    results = [("/", len(html), ttfb, total, response_headers.get("Content-Encoding", "identity"))]
+    if response_headers.get("Content-Encoding") == "gzip":
+        import gzip
+        html = gzip.decompress(html)
+    elif response_headers.get("Content-Encoding") == "br":
+        html = static_assets.brotli.decompress(html)
+    assets = re.findall(r'(?:href|src)="(/static/[^"]+\.(?:css|js))"', html.decode("utf-8"))
+    for path in assets + list(API_URLS):
+        body, ttfb, total, response_headers = fetch(port, path, headers)
+        results.append((path, len(body), ttfb, total, response_headers.get("Content-Encoding", "identity")))
+    return results
+
+
+def run_mode(port, headers, rounds):
+    samples = {}
+    for _ in range(rounds):
+        for path, size, ttfb, total, encoding in first_load(port, headers):
+            # Fingerprinted names differ from the originals; label by the asset kind
+            label = path if path in API_URLS or path == "/" else os.path.splitext(path)[1].lstrip(".")
+            sample = samples.setdefault(label, {"bytes": size, "encoding": encoding, "ttfb": [], "total": []})
+            sample["ttfb"].append(ttfb)
+            sample["total"].append(total)
+    return {
+        label: {
+            "bytes": sample["bytes"],
+            "encoding": sample["encoding"],
+            "ttfb_ms": round(statistics.median(sample["ttfb"]) * 1000, 2),
+            "total_ms": round(statistics.median(sample["total"]) * 1000, 2),
+        }
+        for label, sample in samples.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="first loads per mode")
+    parser.add_argument("--accept-encoding", default="gzip, deflate, br")
+    parser.add_argument("--mbps", type=float, default=5.0, help="link speed for the transfer-time estimate")
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    manifest = static_assets.build()
+    print(f"Built {len(manifest)} assets into {static_assets.DIST_DIR}"
+          f" ({', '.join(static_assets.available_encodings())})")
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    session_cookie = app.session_interface.get_signing_serializer(app).dumps({"authenticated": True})
+    headers = {"Accept-Encoding": args.accept_encoding,
+               "Cookie": f"{app.config.get('SESSION_COOKIE_NAME', 'session')}={session_cookie}"}
+
+    results = {}
+    try:
+        # Before: no manifest (originals from the static handler) and no compression
+        app.config["COMPRESS_ENABLED"] = False
+        static_assets._manifest = static_assets.AssetManifest(dist_dir=os.path.join(static_assets.DIST_DIR, "missing"))
+        results["before"] = run_mode(port, headers, args.rounds)
+
+        app.config["COMPRESS_ENABLED"] = True
+        static_assets._manifest = static_assets.AssetManifest()
+        results["after"] = run_mode(port, headers, args.rounds)
+    finally:
+        server.shutdown()
+
+    print(f"\nFirst load, median of {args.rounds} (Accept-Encoding: {args.accept_encoding})")
+    print(f"{'resource':<16}{'before B':>10}{'after B':>10}{'enc':>7}{'TTFB ms':>16}{'total ms':>16}")
+    for label, before in results["before"].items():
+        after = results["after"][label]
+        print(f"{label:<16}{before['bytes']:>10,}{after['bytes']:>10,}{after['encoding']:>7}"
+              f"{before['ttfb_ms']:>8.2f} → {after['ttfb_ms']:<5.2f}{before['total_ms']:>8.2f} → {after['total_ms']:<5.2f}")
+    summary = {}
+    for mode, resources in results.items():
+        total_bytes = sum(r["bytes"] for r in resources.values())
+        summary[mode] = {"bytes": total_bytes,
+                         "transfer_ms": round(total_bytes * 8 / (args.mbps * 1e6) * 1000, 1),
+                         "ttfb_ms": round(sum(r["ttfb_ms"] for r in resources.values()), 2)}
+        print(f"{mode:<7} {total_bytes:>9,} B on the wire, {summary[mode]['transfer_ms']} ms at {args.mbps:g} Mb/s, "
+              f"summed TTFB {summary[mode]['ttfb_ms']} ms")
+    print(f"first-load bytes: -{1 - summary['after']['bytes'] / summary['before']['bytes']:.0%}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rounds": args.rounds, "accept_encoding": args.accept_encoding, "mbps": args.mbps,
+                       "resources": results, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
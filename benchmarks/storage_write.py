@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Benchmark for egg/creature record writes.
+
+Runs N concurrent "hatches" against a scratch directory, each doing what a
+hatch does to storage: append a creature to creatures_data.json and mark its
+egg hatched in eggs_data.json. Compares the old in-place rewrite (load, append,
+open('w') + json.dump) with RecordStore group commits, and reports sustained
+writes/sec, lost writes (records missing at the end) and commit batch sizes.
+
+    python benchmarks/storage_write.py
+    python benchmarks/storage_write.py --concurrency 8 --seconds 5 --existing 2000 --processes 2
+
+--processes runs each thread group in its own process as well, like gunicorn
+workers sharing the files.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from record_store import RecordStore  # noqa: E402
+
+
+def make_record(kind):
+    return {
+        "id": str(uuid.uuid4()),
+        "description": f"A benchmark {kind} with a description of typical length " * 4,
+        "descriptors": ["whimsical", "verdant", "organic"],
+        "image_url": f"/static/images/{uuid.uuid4()}.png",
+        "status": "unhatched",
+    }
+
+
+def seed(directory, existing):
+    eggs = [make_record("egg") for _ in range(existing)]
+    creatures = [make_record("creature") for _ in range(existing)]
+    for name, records in (("eggs_data.json", eggs), ("creatures_data.json", creatures)):
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump(records, f, indent=2)
+    return [egg["id"] for egg in eggs]
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+class LegacyWriter:
+    """The pre-RecordStore code path: read, modify, rewrite in place"""
+
+    def __init__(self, directory, fsync):
+        self.eggs = os.path.join(directory, "eggs_data.json")
+        self.creatures = os.path.join(directory, "creatures_data.json")
+        self.fsync = fsync
+
+    def _dump(self, path, records):
+        with open(path, "w") as f:
+            json.dump(records, f, indent=2)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def hatch(self, egg_id, creature):
+        creatures = _load(self.creatures)
+        creatures.append(creature)
+        self._dump(self.creatures, creatures)
+        eggs = _load(self.eggs)
+        for egg in eggs:
+            if egg["id"] == egg_id:
+                egg["status"] = "hatched"
+                break
+        self._dump(self.eggs, eggs)
+
+    def stats(self):
+        return {}
+
+
+class LockedLegacyWriter(LegacyWriter):
+    """The in-place rewrite behind one process-wide lock (what app_async.py used to do)"""
+
+    def __init__(self, directory, fsync):
+        super().__init__(directory, fsync)
+        self.lock = threading.Lock()
+
+    def hatch(self, egg_id, creature):
+        with self.lock:
+            super().hatch(egg_id, creature)
+
+
+class StoreWriter:
+    def __init__(self, directory, fsync):
+        self.eggs = RecordStore(os.path.join(directory, "eggs_data.json"), fsync=fsync)
+        self.creatures = RecordStore(os.path.join(directory, "creatures_data.json"), fsync=fsync)
+
+    def hatch(self, egg_id, creature):
+        self.creatures.append(creature)
+        self.eggs.update(egg_id, status="hatched")
+
+    def stats(self):
+        return {"creatures": self.creatures.stats(), "eggs": self.eggs.stats()}
+
+
+WRITERS = {"legacy": LegacyWriter, "locked": LockedLegacyWriter, "store": StoreWriter}
+
+
+def run_group(mode, directory, egg_ids, concurrency, seconds, fsync, results):
+    writer = WRITERS[mode](directory, fsync)
+    written = []
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def worker(worker_ids):
+        # Cycle through the eggs so the run lasts --seconds however fast writes are
+        for egg_id in itertools.cycle(worker_ids):
+            if time.perf_counter() >= deadline:
+                break
+            creature = make_record("creature")
+            try:
+                writer.hatch(egg_id, creature)
+                written.append((egg_id, creature["id"]))
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker, args=(egg_ids[i::concurrency],)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put({"written": written, "errors": errors, "stats": writer.stats()})
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as directory:
+        egg_ids = seed(directory, args.existing)
+        groups = max(1, args.processes)
+        results = multiprocessing.Queue()
+        start = time.perf_counter()
+        if groups == 1:
+            run_group(mode, directory, egg_ids, args.concurrency, args.seconds, args.fsync, results)
+        else:
+            workers = [
+                multiprocessing.Process(target=run_group, args=(
+                    mode, directory, egg_ids[i::groups], args.concurrency, args.seconds, args.fsync, results))
+                for i in range(groups)
+            ]
+            for process in workers:
+                process.start()
+        outcomes = [results.get() for _ in range(groups)]
+        if groups > 1:
+            for process in workers:
+                process.join()
+        elapsed = time.perf_counter() - start
+
+        written = [pair for outcome in outcomes for pair in outcome["written"]]
+        errors = [error for outcome in outcomes for error in outcome["errors"]]
+        creature_ids = {c["id"] for c in _load(os.path.join(directory, "creatures_data.json"))}
+        hatched = {e["id"] for e in _load(os.path.join(directory, "eggs_data.json")) if e.get("status") == "hatched"}
+        lost = sum(1 for egg_id, creature_id in written if creature_id not in creature_ids or egg_id not in hatched)
+
+        batches = [s for outcome in outcomes for s in outcome["stats"].values()]
+        commits = sum(s["commits"] for s in batches)
+        mutations = sum(s["mutations"] for s in batches)
+        return {
+            "mode": mode,
+            "hatches": len(written),
+            "hatches_per_sec": round(len(written) / elapsed, 1),
+            "writes_per_sec": round(2 * len(written) / elapsed, 1),
+            "lost": lost,
+            "errors": len(errors),
+            "commits": commits or None,
+            "mean_batch": round(mutations / commits, 2) if commits else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent hatches per process")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--existing", type=int, default=1000, help="records already in each file")
+    parser.add_argument("--no-fsync", dest="fsync", action="store_false")
+    parser.add_argument("--modes", nargs="+", default=list(WRITERS), choices=list(WRITERS))
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{args.processes} process(es) x {args.concurrency} concurrent hatches, {args.existing} existing records, "
+          f"fsync {'on' if args.fsync else 'off'}")
+    print(f"{'mode':>8} {'hatches':>8} {'hatch/s':>8} {'writes/s':>9} {'lost':>6} {'errors':>7} {'commits':>8} {'batch':>6}")
+    results = []
+    for mode in args.modes:
+        result = run(mode, args)
+        results.append(result)
+        print(f"{mode:>8} {result['hatches']:>8} {result['hatches_per_sec']:>8} {result['writes_per_sec']:>9} "
+              f"{result['lost']:>6} {result['errors']:>7} {str(result['commits'] or '-'):>8} "
+              f"{str(result['mean_batch'] or '-'):>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
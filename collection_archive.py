@@ -0,0 +1,555 @@
+"""
+Collection Export / Import for the Hatch Application
+
+Backing up or moving a deployment used to mean copying eggs_data.json,
+creatures_data.json and the static/ tree by hand. A CollectionArchive streams
+the whole collection into one ZIP or tar (optionally gzipped) archive and reads
+it back:
+
+    media/images/<name>.png, media/audio/<name>.mp3   every stored media file
+    records/eggs.jsonl, records/creatures.jsonl       one record per line
+    manifest.json                                     SHA-256 and size of every entry, record counts
+
+Export is a generator of byte chunks (the /api/export response body, or a file
+for the CLI). Nothing is buffered beyond one chunk: media is copied straight from
+the media store (a remote backend's files come through its read-through cache),
+the tar writer is hand-rolled so each chunk goes out as soon as it is read, and
+the ZIP writer drains its output after every chunk. The record files are read
+line by line (RecordStore writes one record per line) and spooled to a temp
+file, since a tar header needs the entry size up front. Only the manifest and
+the ZIP central directory grow with the collection, by one entry per file.
+
+Import reads the archive in one pass (tar straight from the stream; a ZIP has
+to be seekable, so an uploaded one is spooled to disk first):
+
+- Media goes through MediaStore.put_file, so it lands content-addressed. A file
+  named by its hash is checked against its name as it streams in; one that is
+  already stored is skipped without writing. Older uuid-named files get a hash
+  name, and the imported records are pointed at it
+- Records are spooled to temp files and only inserted once the manifest has
+  been checked against every entry, so a truncated or corrupted archive adds
+  nothing. They are then appended in batches (one group commit per batch), and
+  records whose id already exists are left alone
+
+Importing is idempotent, so an interrupted import is resumed by running it again:
+media already stored and records already present are skipped.
+
+USAGE:
+  archive = CollectionArchive(media_store, {"eggs": eggs_store, "creatures": creatures_store})
+  for chunk in archive.export("tar"): out.write(chunk)
+  report = archive.import_archive(open("hatch.tar", "rb"), on_batch=index_records)
+
+  python collection_archive.py export -o hatch-backup.zip
+  python collection_archive.py import hatch-backup.zip
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+
+from media_store import MEDIA_KINDS
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = "hatch-collection"
+ARCHIVE_VERSION = 1
+
+# format -> (file extension, content type)
+ARCHIVE_FORMATS = {
+    "zip": (".zip", "application/zip"),
+    "tar": (".tar", "application/x-tar"),
+    "tar.gz": (".tar.gz", "application/gzip"),
+}
+
+# Record fields holding media URLs: rewritten when a file gets a new name, referenced once imported
+MEDIA_FIELDS = ("image_url", "audio_url", "alternate_image_urls", "thumbnail_url")
+
+MANIFEST_NAME = "manifest.json"
+
+_CHUNK = 1024 * 1024
+_SPOOL_BYTES = 8 * 1024 * 1024
+_HASH_NAME = re.compile(r"^[0-9a-f]{64}$")
+_encode = json.JSONEncoder().encode
+
+
+class ArchiveError(Exception):
+    """The archive is not a Hatch collection, or an entry doesn't match the manifest"""
+
+
+def _media_urls(record):
+    """The media URLs a record holds (alternate images are a list)"""
+    for field in MEDIA_FIELDS:
+        value = record.get(field)
+        if isinstance(value, list):
+            yield from value
+        elif value:
+            yield value
+
+
+def iter_records(path):
+    """
+    The records of a JSON array file, one at a time. RecordStore writes one record
+    per line, which is parsed line by line; an older indented file is loaded whole.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yielded = 0
+        for line in f:
+            line = line.strip().rstrip(",")
+            if line in ("", "[", "]", "[]"):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                if yielded:
+                    raise ValueError(f"{path}: unexpected line after {yielded} records")
+                break
+            yielded += 1
+            yield record
+        else:
+            return
+    # Not one record per line (json.dump(indent=2) from before RecordStore)
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from json.load(f)
+
+
+def _read_chunks(f, digest=None):
+    for chunk in iter(lambda: f.read(_CHUNK), b""):
+        if digest is not None:
+            digest.update(chunk)
+        yield chunk
+
+
+# ----------------------------------------------------------------------
+# Streaming writers
+# ----------------------------------------------------------------------
+
+class _Sink:
+    """Write-only file object collecting what zipfile writes, until it is drained into the response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class _TarWriter:
+    """
+    A ustar/pax stream written block by block (tarfile's own writer copies a whole
+    member in one call, which would have to be buffered to be streamed)
+    """
+
+    def __init__(self, gzip=False):
+        # Level 1: the media is already compressed, so higher levels cost CPU for nothing
+        self._compressor = zlib.compressobj(1, zlib.DEFLATED, 31) if gzip else None
+
+    def _out(self, data):
+        return self._compressor.compress(data) if self._compressor else data
+
+    def entry(self, name, chunks, size, mtime, compress=False):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        yield self._out(info.tobuf(tarfile.PAX_FORMAT))
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            yield self._out(chunk)
+        if written != size:
+            raise ArchiveError(f"{name} changed size while it was exported")
+        if size % tarfile.BLOCKSIZE:
+            yield self._out(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+
+    def close(self):
+        yield self._out(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        if self._compressor:
+            yield self._compressor.flush()
+
+
+class _ZipWriter:
+    """zipfile on an unseekable sink (sizes and CRCs go in data descriptors), drained after every chunk"""
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', allowZip64=True)
+
+    def entry(self, name, chunks, size, mtime, compress=False):
+        info = zipfile.ZipInfo(name, date_time=time.localtime(max(mtime, 315619200))[:6])
+        # PNG and MP3 are already compressed; only the records and the manifest are deflated
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.file_size = size
+        with self._zip.open(info, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield self._sink.drain()
+        yield self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        yield self._sink.drain()
+
+
+# ----------------------------------------------------------------------
+# Reading archives
+# ----------------------------------------------------------------------
+
+class _Prefixed:
+    """A stream with the bytes already read from its start (to sniff the format) put back"""
+
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._stream.read(), b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+
+def _archive_entries(source):
+    """(name, binary file object) of each file entry, in archive order"""
+    if isinstance(source, (str, os.PathLike)):
+        if zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        with zf.open(info) as f:
+                            yield info.filename, f
+            return
+        with open(source, 'rb') as f:
+            yield from _archive_entries(f)
+        return
+
+    head = source.read(4)
+    if head.startswith(b"PK"):
+        # The central directory is at the end: spool the upload to disk to read it
+        with tempfile.NamedTemporaryFile(suffix=".zip") as spool:
+            spool.write(head)
+            shutil.copyfileobj(source, spool, _CHUNK)
+            spool.flush()
+            yield from _archive_entries(spool.name)
+        return
+
+    try:
+        with tarfile.open(fileobj=_Prefixed(head, source), mode='r|*') as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member)
+    except tarfile.TarError as e:
+        raise ArchiveError(f"Not a ZIP or tar archive: {e}") from e
+
+
+# ----------------------------------------------------------------------
+# Archive
+# ----------------------------------------------------------------------
+
+class CollectionArchive:
+    def __init__(self, media_store, record_stores):
+        """record_stores maps a record kind ("eggs", "creatures") to its RecordStore"""
+        self.media_store = media_store
+        self.record_stores = record_stores
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+
+    def export(self, fmt="zip", report=None):
+        """
+        Yield the archive in chunks. report, if given, is filled in as the export
+        runs (counts and bytes), e.g. for logging once the generator is exhausted.
+        """
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format: {fmt}")
+        writer = _ZipWriter() if fmt == "zip" else _TarWriter(gzip=fmt == "tar.gz")
+        report = report if report is not None else {}
+        report.update({"format": fmt, "media": 0, "media_bytes": 0, "records": {}, "bytes": 0, "seconds": None})
+        start = time.perf_counter()
+        entries = {}
+
+        def emit(chunks):
+            for chunk in chunks:
+                if chunk:
+                    report["bytes"] += len(chunk)
+                    yield chunk
+
+        for url, name, path in self._media_files():
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                # Reclaimed by the media GC since it was listed
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                digest = hashlib.sha256()
+                yield from emit(writer.entry(name, _read_chunks(f, digest), st.st_size, st.st_mtime))
+            entries[name] = {"sha256": digest.hexdigest(), "size": st.st_size}
+            report["media"] += 1
+            report["media_bytes"] += st.st_size
+
+        for kind, store in self.record_stores.items():
+            name = f"records/{kind}.jsonl"
+            with tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES) as spool:
+                count, digest = 0, hashlib.sha256()
+                for record in iter_records(store.path):
+                    line = (_encode(record) + "\n").encode('utf-8')
+                    digest.update(line)
+                    spool.write(line)
+                    count += 1
+                size = spool.tell()
+                spool.seek(0)
+                yield from emit(writer.entry(name, _read_chunks(spool), size, time.time(), compress=True))
+            entries[name] = {"sha256": digest.hexdigest(), "size": size, "records": count}
+            report["records"][kind] = count
+
+        manifest = json.dumps({
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "created_at": time.time(),
+            "media_root": self.media_store.root,
+            "entries": entries,
+        }, indent=1).encode('utf-8')
+        yield from emit(writer.entry(MANIFEST_NAME, [manifest], len(manifest), time.time(), compress=True))
+        yield from emit(writer.close())
+
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        logger.info(f"Exported {report['media']} media files and {sum(report['records'].values())} records "
+                    f"({report['bytes']} bytes) in {report['seconds']}s", extra={"archive": dict(report)})
+
+    def _media_files(self):
+        """(url, archive name, local path) of every stored media file"""
+        for url, key, kind, size in self.media_store.files():
+            path = self.media_store.local_path(url)
+            if path is not None:
+                yield url, f"media/{key}", path
+
+    # ------------------------------------------------------------------
+    # Import
+    # ------------------------------------------------------------------
+
+    def import_archive(self, source, batch_size=1000, on_batch=None):
+        """
+        Import an archive from a path or a binary stream. Records are inserted only
+        after every entry matched the manifest; on_batch(kind, records) is called
+        with each batch of records that was added. Returns a report.
+        """
+        report = {"media": {"stored": 0, "deduplicated": 0, "skipped": 0, "renamed": 0, "bytes": 0},
+                  "records": {}, "seconds": None}
+        start = time.perf_counter()
+        hashes = {}      # entry name -> sha256 of what was read
+        renamed = {}     # media URL in the archive -> URL in this store
+        spools = {}      # record kind -> temp file with its jsonl
+        manifest = None
+
+        try:
+            for name, f in _archive_entries(source):
+                if name == MANIFEST_NAME:
+                    manifest = self._read_manifest(f)
+                elif name.startswith("media/"):
+                    hashes[name] = self._import_media(name, f, renamed, report["media"])
+                elif name.startswith("records/") and name.endswith(".jsonl"):
+                    kind = name[len("records/"):-len(".jsonl")]
+                    if kind not in self.record_stores:
+                        raise ArchiveError(f"Unknown record kind in archive: {kind}")
+                    spool = spools[kind] = tempfile.TemporaryFile()
+                    digest = hashlib.sha256()
+                    for chunk in _read_chunks(f, digest):
+                        spool.write(chunk)
+                    hashes[name] = digest.hexdigest()
+                else:
+                    logger.warning(f"Skipping unknown archive entry: {name}")
+
+            self._verify(manifest, hashes)
+            for kind, spool in spools.items():
+                spool.seek(0)
+                report["records"][kind] = self._import_records(kind, spool, renamed, batch_size, on_batch)
+        finally:
+            for spool in spools.values():
+                spool.close()
+
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        logger.info(f"Imported archive in {report['seconds']}s", extra={"archive": report})
+        return report
+
+    def _read_manifest(self, f):
+        try:
+            manifest = json.load(f)
+        except ValueError as e:
+            raise ArchiveError(f"Unreadable manifest: {e}") from e
+        if not isinstance(manifest, dict) or manifest.get("format") != ARCHIVE_FORMAT:
+            raise ArchiveError("Not a Hatch collection archive")
+        if manifest.get("version", 0) > ARCHIVE_VERSION:
+            raise ArchiveError(f"Archive version {manifest.get('version')} is newer than this Hatch "
+                               f"(reads up to {ARCHIVE_VERSION})")
+        return manifest
+
+    def _import_media(self, name, f, renamed, counts):
+        """Store one media entry; returns the SHA-256 of its content"""
+        store = self.media_store
+        parts = name.split("/")
+        kind = next((k for k, (directory, _) in MEDIA_KINDS.items() if len(parts) == 3 and parts[1] == directory), None)
+        if kind is None or parts[2].startswith(".") or not parts[2]:
+            raise ArchiveError(f"Unexpected media entry: {name}")
+        original_url = f"/{store.root}/{parts[1]}/{parts[2]}"
+        stem = os.path.splitext(parts[2])[0]
+
+        if _HASH_NAME.match(stem) and store.exists(original_url):
+            # Content-addressed and already here (e.g. a resumed import): the name vouches for the bytes
+            counts["skipped"] += 1
+            return stem
+
+        tmp_path = store.temp_path(kind)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in _read_chunks(f, digest):
+                    out.write(chunk)
+                    size += len(chunk)
+            if _HASH_NAME.match(stem) and digest.hexdigest() != stem:
+                raise ArchiveError(f"{name} is corrupt: its content hash is {digest.hexdigest()}")
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        directory, extension = MEDIA_KINDS[kind]
+        deduplicated = store.exists(f"/{store.root}/{directory}/{digest.hexdigest()}{extension}")
+        url = store.put_file(tmp_path, kind)
+        counts["deduplicated" if deduplicated else "stored"] += 1
+        counts["bytes"] += size
+        if url != original_url:
+            renamed[original_url] = url
+            counts["renamed"] += 1
+        return digest.hexdigest()
+
+    def _verify(self, manifest, hashes):
+        if manifest is None:
+            raise ArchiveError("The archive has no manifest (truncated?)")
+        entries = manifest.get("entries", {})
+        missing = [name for name in entries if name not in hashes]
+        if missing:
+            raise ArchiveError(f"{len(missing)} entries listed in the manifest are missing, e.g. {missing[0]}")
+        for name, digest in hashes.items():
+            expected = entries.get(name, {}).get("sha256")
+            if expected != digest:
+                raise ArchiveError(f"{name} does not match the manifest")
+
+    def _import_records(self, kind, spool, renamed, batch_size, on_batch):
+        store = self.record_stores[kind]
+        counts = {"added": 0, "existing": 0}
+
+        def insert(batch):
+            def apply(records):
+                ids = {record.get('id') for record in records}
+                added = [record for record in batch if record.get('id') not in ids]
+                records.extend(added)
+                return added
+            added = store.commit(apply)
+            counts["added"] += len(added)
+            counts["existing"] += len(batch) - len(added)
+            self.media_store.ref(*(url for record in added for url in _media_urls(record)))
+            if on_batch and added:
+                on_batch(kind, added)
+
+        batch = []
+        for line in spool:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for field in MEDIA_FIELDS:
+                value = record.get(field)
+                if isinstance(value, list):
+                    record[field] = [renamed.get(url, url) for url in value]
+                elif value in renamed:
+                    record[field] = renamed[value]
+            batch.append(record)
+            if len(batch) >= batch_size:
+                insert(batch)
+                batch = []
+        if batch:
+            insert(batch)
+        return counts
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    from config import Config
+    from media_backends import backend_from_config
+    from media_store import MediaStore
+    from record_store import RecordStore
+
+    parser = argparse.ArgumentParser(description="Export or import the whole Hatch collection")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write records and media to an archive")
+    export_parser.add_argument("-o", "--output", default="-", help="archive path, or - for stdout")
+    export_parser.add_argument("--format", choices=list(ARCHIVE_FORMATS),
+                               help="default: from the output extension, else zip")
+    import_parser = subparsers.add_parser("import", help="add the records and media of an archive (re-run to resume)")
+    import_parser.add_argument("archive", help="archive path, or - for stdin (tar only)")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="records per group commit")
+    for sub in (export_parser, import_parser):
+        sub.add_argument("--root", default=Config.STATIC_FOLDER)
+        sub.add_argument("--index", default=Config.MEDIA_INDEX_PATH)
+        sub.add_argument("--eggs", default="eggs_data.json")
+        sub.add_argument("--creatures", default="creatures_data.json")
+    args = parser.parse_args(argv)
+
+    settings = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    media_store = MediaStore(args.root, args.index, backend=backend_from_config(settings, root=args.root))
+    archive = CollectionArchive(media_store, {
+        "eggs": RecordStore(args.eggs, fsync=Config.RECORDS_FSYNC),
+        "creatures": RecordStore(args.creatures, fsync=Config.RECORDS_FSYNC),
+    })
+    try:
+        if args.command == "export":
+            fmt = args.format or next((name for name, (extension, _) in sorted(ARCHIVE_FORMATS.items(), reverse=True)
+                                       if args.output.endswith(extension)), "zip")
+            result = {}
+            out = sys.stdout.buffer if args.output == "-" else open(args.output, 'wb')
+            try:
+                for chunk in archive.export(fmt, report=result):
+                    out.write(chunk)
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+        else:
+            source = sys.stdin.buffer if args.archive == "-" else args.archive
+            result = archive.import_archive(source, batch_size=args.batch_size)
+    except ArchiveError as e:
+        parser.exit(1, f"error: {e}\n")
+    finally:
+        media_store.close()
+    print(json.dumps(result, indent=2), file=sys.stderr if args.command == "export" and args.output == "-" else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
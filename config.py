@@ -7,6 +7,7 @@ class Config:
     """Base configuration class"""
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # e.g. the local mock_openai.py server
     WEBSITE_PASSWORD = os.getenv('WEBSITE_PASSWORD', 'hatch123')
     
     # Flask configuration
@@ -18,6 +19,143 @@ class Config:
     IMAGES_FOLDER = os.path.join(STATIC_FOLDER, 'images')
     AUDIO_FOLDER = os.path.join(STATIC_FOLDER, 'audio')
     
+    # Descriptor/full-text search index (SQLite, rebuilt from the JSON files if missing)
+    SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'search_index.db')
+    
+    # Local "similar eggs" index (memory-mapped hashed TF-IDF vectors)
+    SIMILARITY_INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', 'similarity_index')
+    SIMILARITY_DIMENSIONS = int(os.getenv('SIMILARITY_DIMENSIONS', '512'))
+    
+    # Opt-in cache of generated egg images keyed on the rendered prompt
+    # (and optionally a descriptor + description-shingle fingerprint)
+    PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'False').lower() == 'true'
+    PROMPT_CACHE_PATH = os.getenv('PROMPT_CACHE_PATH', 'prompt_cache.json')
+    PROMPT_CACHE_TTL_SECONDS = int(os.getenv('PROMPT_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+    PROMPT_CACHE_FINGERPRINT = os.getenv('PROMPT_CACHE_FINGERPRINT', 'True').lower() == 'true'
+    PROMPT_CACHE_SIMILARITY = float(os.getenv('PROMPT_CACHE_SIMILARITY', '0.8'))
+    
+    # Kiosk mode: keep pre-generated eggs ready per popular descriptor cluster
+    EGG_POOL_ENABLED = os.getenv('EGG_POOL_ENABLED', 'False').lower() == 'true'
+    EGG_POOL_PATH = os.getenv('EGG_POOL_PATH', 'egg_pool.json')
+    EGG_POOL_CLUSTERS = os.getenv('EGG_POOL_CLUSTERS', '')  # e.g. "whimsical,verdant;mystical"
+    EGG_POOL_CLUSTER_COUNT = int(os.getenv('EGG_POOL_CLUSTER_COUNT', '5'))
+    EGG_POOL_DEPTH = int(os.getenv('EGG_POOL_DEPTH', '3'))
+    EGG_POOL_BUDGET_PER_HOUR = int(os.getenv('EGG_POOL_BUDGET_PER_HOUR', '20'))
+    EGG_POOL_MAX_AGE_SECONDS = int(os.getenv('EGG_POOL_MAX_AGE_SECONDS', str(24 * 3600)))
+    EGG_POOL_REFILL_INTERVAL = int(os.getenv('EGG_POOL_REFILL_INTERVAL', '30'))
+    
+    # Prefetch answer-independent hatch stages while the care question is open
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'True').lower() == 'true'
+    PREFETCH_DRAFT_CONCEPT = os.getenv('PREFETCH_DRAFT_CONCEPT', 'False').lower() == 'true'
+    PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+    PREFETCH_TTL_SECONDS = int(os.getenv('PREFETCH_TTL_SECONDS', '600'))
+    
+    # Prometheus-style /metrics (per-worker snapshots are merged from METRICS_DIR)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_DIR = os.getenv('METRICS_DIR', 'metrics_data')
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # optional bearer token for scrapers
+    
+    # Token/cost ledger and spend alarms (USD; unset disables an alarm)
+    USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', 'usage.db')
+    USAGE_PRICES = os.getenv('USAGE_PRICES')  # JSON overrides, same shape as usage.DEFAULT_PRICES
+    USAGE_ALARM_DAILY_USD = float(os.getenv('USAGE_ALARM_DAILY_USD')) if os.getenv('USAGE_ALARM_DAILY_USD') else None
+    USAGE_ALARM_SESSION_USD = float(os.getenv('USAGE_ALARM_SESSION_USD')) if os.getenv('USAGE_ALARM_SESSION_USD') else None
+    USAGE_ALARM_RECORD_USD = float(os.getenv('USAGE_ALARM_RECORD_USD')) if os.getenv('USAGE_ALARM_RECORD_USD') else None
+    
+    # Opt-in request profiling: admin header X-Hatch-Profile: <token>, or a sample rate
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False').lower() == 'true'
+    PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+    PROFILING_MODE = os.getenv('PROFILING_MODE', 'sampling')  # sampling | cprofile
+    PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))
+    PROFILING_DIR = os.getenv('PROFILING_DIR', 'profiles')
+    PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '50'))
+    
+    # Logging (queued JSON records; see structured_logging.py)
+    LOG_FILE = os.getenv('LOG_FILE', 'hatch.log')
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json | text
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '2000'))
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.1'))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    
+    # Token budgets for the per-call part of each prompt template (see prompt_templates.py),
+    # e.g. "egg_image=600,creature_concept=300"; unset keeps the defaults in ai_prompts.py
+    PROMPT_TOKEN_BUDGETS = os.getenv('PROMPT_TOKEN_BUDGETS', '')
+    
+    # Creature sounds: trimmed, loudness-normalized and re-encoded with ffmpeg (see audio_processing.py);
+    # without ffmpeg they are stored as TTS returns them
+    AUDIO_PROCESSING_ENABLED = os.getenv('AUDIO_PROCESSING_ENABLED', 'True').lower() == 'true'
+    FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')
+    AUDIO_BITRATE = os.getenv('AUDIO_BITRATE', '32k')
+    AUDIO_SPRITE_PATH = os.getenv('AUDIO_SPRITE_PATH', 'audio_sprites.json')
+    
+    # Fingerprinted, pre-compressed static assets (`python static_assets.py build`) and compression of
+    # dynamic responses (JSON, HTML) above COMPRESS_MIN_BYTES (see static_assets.py)
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'True').lower() == 'true'
+    COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))  # needs the brotli package
+    STATIC_ASSET_MAX_AGE = int(os.getenv('STATIC_ASSET_MAX_AGE', '31536000'))
+    
+    # Multi-candidate images: generate K concurrently, keep the best by a local score (see image_selection.py)
+    IMAGE_CANDIDATES = int(os.getenv('IMAGE_CANDIDATES', '1'))
+    IMAGE_CANDIDATES_MAX = int(os.getenv('IMAGE_CANDIDATES_MAX', '4'))
+    IMAGE_SCORE_THRESHOLD = float(os.getenv('IMAGE_SCORE_THRESHOLD', '0.55'))
+    IMAGE_MAX_TEXT = float(os.getenv('IMAGE_MAX_TEXT', '0.05'))
+    IMAGE_RERUN_WINDOW_SECONDS = int(os.getenv('IMAGE_RERUN_WINDOW_SECONDS', '900'))
+    
+    # Shared OpenAI client: connection pool per worker process (see api_client.py)
+    OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+    OPENAI_MAX_KEEPALIVE = int(os.getenv('OPENAI_MAX_KEEPALIVE', '10'))
+    OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '60'))
+    OPENAI_HTTP2 = os.getenv('OPENAI_HTTP2', 'False').lower() == 'true'  # needs the h2 package
+    
+    # Fair scheduling of generation work per worker process (see scheduler.py)
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'True').lower() == 'true'
+    SCHEDULER_SLOTS = int(os.getenv('SCHEDULER_SLOTS', '8'))
+    SCHEDULER_BATCH_SLOTS = int(os.getenv('SCHEDULER_BATCH_SLOTS', '4'))
+    SCHEDULER_INTERACTIVE_WEIGHT = int(os.getenv('SCHEDULER_INTERACTIVE_WEIGHT', '4'))
+    SCHEDULER_MAX_QUEUED_PER_SESSION = int(os.getenv('SCHEDULER_MAX_QUEUED_PER_SESSION', '4'))
+    SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv('SCHEDULER_MAX_WAIT_SECONDS', '120'))
+    
+    # Request deadlines for the generation routes (see deadline.py); clients can send X-Hatch-Deadline
+    REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '90'))  # 0 = no default deadline
+    REQUEST_DEADLINE_MAX_SECONDS = float(os.getenv('REQUEST_DEADLINE_MAX_SECONDS', '300'))
+    DEADLINE_OPTIONAL_STAGE_SECONDS = float(os.getenv('DEADLINE_OPTIONAL_STAGE_SECONDS', '8'))
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+    
+    # Egg/creature JSON files: group-committed, atomically replaced writes (see record_store.py)
+    RECORDS_FSYNC = os.getenv('RECORDS_FSYNC', 'True').lower() == 'true'
+    RECORDS_COMMIT_WINDOW_MS = float(os.getenv('RECORDS_COMMIT_WINDOW_MS', '0'))
+    
+    # Content-addressed media (see media_store.py; reclaim orphans with `python media_store.py gc`)
+    MEDIA_INDEX_PATH = os.getenv('MEDIA_INDEX_PATH', 'media_index.db')
+    MEDIA_GC_GRACE_HOURS = float(os.getenv('MEDIA_GC_GRACE_HOURS', '24'))
+    # Progress files of `python backfill.py run <derivative>` (resumable derived-artifact backfills)
+    BACKFILL_CHECKPOINT_DIR = os.getenv('BACKFILL_CHECKPOINT_DIR', 'backfill_checkpoints')
+    # Where media bytes live: local (the static folder) or s3 (any S3-compatible bucket; needs boto3)
+    MEDIA_BACKEND = os.getenv('MEDIA_BACKEND', 'local')
+    MEDIA_S3_BUCKET = os.getenv('MEDIA_S3_BUCKET')
+    MEDIA_S3_PREFIX = os.getenv('MEDIA_S3_PREFIX', '')
+    MEDIA_S3_ENDPOINT_URL = os.getenv('MEDIA_S3_ENDPOINT_URL')  # MinIO / moto, e.g. http://127.0.0.1:9000
+    MEDIA_S3_REGION = os.getenv('MEDIA_S3_REGION')
+    MEDIA_SERVE = os.getenv('MEDIA_SERVE', 'presign')  # presign, public or proxy
+    MEDIA_PUBLIC_BASE_URL = os.getenv('MEDIA_PUBLIC_BASE_URL')
+    MEDIA_PRESIGN_SECONDS = int(os.getenv('MEDIA_PRESIGN_SECONDS', '3600'))
+    MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', 'media_cache')
+    MEDIA_CACHE_MAX_MB = float(os.getenv('MEDIA_CACHE_MAX_MB', '512'))
+    MEDIA_MULTIPART_THRESHOLD_MB = float(os.getenv('MEDIA_MULTIPART_THRESHOLD_MB', '8'))
+    MEDIA_MULTIPART_CHUNK_MB = float(os.getenv('MEDIA_MULTIPART_CHUNK_MB', '8'))
+    
+    # Signed, expiring media URLs instead of session-checked media routes (see media_urls.py)
+    MEDIA_SIGNED_URLS = os.getenv('MEDIA_SIGNED_URLS', 'True').lower() == 'true'
+    MEDIA_URL_SECRET = os.getenv('MEDIA_URL_SECRET')  # comma-separated, first signs; default derived from SECRET_KEY
+    MEDIA_URL_TTL_SECONDS = int(os.getenv('MEDIA_URL_TTL_SECONDS', '86400'))
+    MEDIA_URL_STEP_SECONDS = int(os.getenv('MEDIA_URL_STEP_SECONDS', '3600'))
+    
     # Ensure directories exist
     @staticmethod
     def init_app(app):
@@ -0,0 +1,130 @@
+"""
+Request Deadlines for the Hatch Application
+
+A hatch is four or five OpenAI calls in a row. When the browser gives up
+(closes the tab, times out) the rest of the pipeline used to run anyway, paying
+for images and speech nobody would see. Each generation request now carries a
+deadline that every stage checks:
+
+- The budget comes from the X-Hatch-Deadline header (seconds, as the client's
+  own timeout) or REQUEST_DEADLINE_SECONDS, capped at REQUEST_DEADLINE_MAX_SECONDS
+- OpenAI calls and downloads get what is left of it as their timeout, and are
+  only retried while there is time for another attempt
+- Optional stages (the voice description and TTS) are skipped when less than
+  DEADLINE_OPTIONAL_STAGE_SECONDS is left; the creature is saved without them
+- Between stages the client connection is polled; once it has gone away the
+  pipeline stops with ClientDisconnected and writes nothing more
+
+The deadline lives in a context variable, like the usage scope, so it follows
+the request into EggCreator without changing any signatures (asyncio.to_thread
+copies it too). Threads started elsewhere (prefetch, the pool filler) have none.
+
+USAGE:
+  set_deadline(Deadline(45, is_disconnected=lambda: socket_disconnected(sock)))
+  deadline = current_deadline()
+  deadline.check("image_save")                 # raises DeadlineExceeded / ClientDisconnected
+  client.images.generate(..., timeout=deadline.call_timeout("images.generate"))
+  if deadline.allows(8): ...                   # room for an optional stage
+"""
+
+import contextvars
+import select
+import socket
+import time
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before the pipeline finished"""
+
+    reason = "deadline"
+
+    def __init__(self, stage, message=None):
+        super().__init__(message or f"Request deadline exceeded at {stage}")
+        self.stage = stage
+
+
+class ClientDisconnected(DeadlineExceeded):
+    """The client went away; nobody is waiting for the result"""
+
+    reason = "disconnect"
+
+    def __init__(self, stage):
+        super().__init__(stage, f"Client disconnected at {stage}")
+
+
+class Deadline:
+    def __init__(self, seconds, is_disconnected=None):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.is_disconnected = is_disconnected  # () -> bool, polled at each check
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def check(self, stage):
+        if self.is_disconnected is not None and self.is_disconnected():
+            raise ClientDisconnected(stage)
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(stage)
+
+    def call_timeout(self, stage):
+        """Timeout for a call made now: whatever is left of the budget"""
+        self.check(stage)
+        return self.remaining()
+
+    def allows(self, seconds):
+        """Whether at least `seconds` of the budget are left"""
+        return self.remaining() >= seconds
+
+
+def set_deadline(deadline):
+    _current.set(deadline)
+
+
+def current_deadline():
+    return _current.get()
+
+
+def check_deadline(stage):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def parse_budget(value, default, maximum):
+    """
+    Seconds of budget from an X-Hatch-Deadline header value, falling back to
+    the default when it is missing or malformed, capped at maximum. None means
+    no deadline (no header and a default of 0).
+    """
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        seconds = 0
+    if seconds <= 0:
+        seconds = default
+    if not seconds or seconds <= 0:
+        return None
+    return min(seconds, maximum)
+
+
+def socket_disconnected(sock):
+    """
+    True once the peer has closed the connection. Never blocks: the socket is
+    only read (with MSG_PEEK, so nothing is consumed) when poll says it's readable.
+    """
+    try:
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            ready = poller.poll(0)
+        else:
+            ready, _, _ = select.select([sock], [], [], 0)
+        if not ready:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        # Reset by the peer, or already closed on our side
+        return True
@@ -0,0 +1,255 @@
+"""
+Pre-generated Egg Pool for the Hatch Application
+
+Kiosk/event deployments can't make visitors wait 15-30s for DALL-E. When the
+pool is enabled, a background filler keeps a few egg images ready for each
+popular descriptor cluster, and a create request whose descriptors cover a
+cluster is served instantly from the pool (the visitor's own description and
+descriptors are still saved on the egg record).
+
+CLUSTERS:
+- Set EGG_POOL_CLUSTERS to clusters separated by ';', descriptors by ',':
+  EGG_POOL_CLUSTERS="whimsical,verdant;mystical,crystalline;cozy"
+- Otherwise the most common descriptors in the collection are used, one per cluster
+
+The pool lives in a JSON file guarded by a file lock so every gunicorn worker
+draws from the same eggs, and only one worker at a time runs the filler.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from search_index import normalize_descriptor
+
+logger = logging.getLogger(__name__)
+
+
+def cluster_key(descriptors):
+    return ",".join(sorted({normalize_descriptor(d) for d in descriptors} - {""}))
+
+
+def parse_clusters(value):
+    """Parse "a,b;c" into [["a", "b"], ["c"]]"""
+    clusters = []
+    for group in (value or "").split(";"):
+        descriptors = [d.strip() for d in group.split(",") if d.strip()]
+        if descriptors:
+            clusters.append(descriptors)
+    return clusters
+
+
+def pool_prompt_description(descriptors):
+    """Generic description used to pre-generate an egg for a cluster"""
+    return f"A mystical egg that feels {', '.join(descriptors)}"
+
+
+class EggPool:
+    def __init__(self, path, generate_image, clusters, depth=3, budget_per_hour=20,
+                 max_age_seconds=24 * 3600, refill_interval=30):
+        """
+        generate_image(description, descriptors) must create an egg image and return its web URL.
+        """
+        self.path = path
+        self.generate_image = generate_image
+        self.clusters = {cluster_key(c): sorted({normalize_descriptor(d) for d in c} - {""}) for c in clusters}
+        self.clusters.pop("", None)
+        self.depth = depth
+        self.budget_per_hour = budget_per_hour
+        self.max_age_seconds = max_age_seconds
+        self.refill_interval = refill_interval
+
+        self._lock_path = f"{path}.lock"
+        self._leader_path = f"{path}.filler"
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self.metrics = {"hits": 0, "misses": 0, "generated": 0, "generation_errors": 0, "discarded_stale": 0}
+
+    # ------------------------------------------------------------------
+    # Shared pool file
+    # ------------------------------------------------------------------
+
+    def _locked(self):
+        handle = open(self._lock_path, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _read(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        return {"entries": [], "generations": []}
+
+    def _write(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _drop_stale(self, state, now):
+        fresh = [e for e in state["entries"] if now - e["created_at"] <= self.max_age_seconds]
+        self.metrics["discarded_stale"] += len(state["entries"]) - len(fresh)
+        state["entries"] = fresh
+        state["generations"] = [t for t in state["generations"] if now - t < 3600]
+
+    # ------------------------------------------------------------------
+    # Serving
+    # ------------------------------------------------------------------
+
+    def match_cluster(self, descriptors):
+        """The largest cluster whose descriptors all appear in the request, or None"""
+        requested = {normalize_descriptor(d) for d in descriptors}
+        best = None
+        for key, cluster in self.clusters.items():
+            if set(cluster) <= requested and (best is None or len(cluster) > len(self.clusters[best])):
+                best = key
+        return best
+
+    def take(self, descriptors):
+        """Pop a ready egg image for these descriptors, or None if the pool can't serve them"""
+        key = self.match_cluster(descriptors)
+        if key is None:
+            self.metrics["misses"] += 1
+            return None
+
+        now = time.time()
+        handle = self._locked()
+        try:
+            state = self._read()
+            self._drop_stale(state, now)
+            entry = next((e for e in state["entries"] if e["cluster"] == key), None)
+            if entry:
+                state["entries"].remove(entry)
+            self._write(state)
+        finally:
+            handle.close()
+
+        # Either way this cluster now needs topping up
+        self._wake.set()
+
+        if entry is None:
+            self.metrics["misses"] += 1
+            return None
+        self.metrics["hits"] += 1
+        return entry
+
+    # ------------------------------------------------------------------
+    # Filling
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start the background filler thread (once per process)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="egg-pool-filler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            leader = open(self._leader_path, 'a')
+            try:
+                # Only one worker fills at a time; the others just serve
+                fcntl.flock(leader, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.fill_once()
+            except BlockingIOError:
+                pass
+            except Exception as e:
+                logger.error(f"Egg pool filler error: {e}")
+            finally:
+                leader.close()
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+
+    def _next_cluster_to_fill(self):
+        """Pick the emptiest cluster below target depth, if the hourly budget allows"""
+        now = time.time()
+        handle = self._locked()
+        try:
+            state = self._read()
+            self._drop_stale(state, now)
+            self._write(state)
+        finally:
+            handle.close()
+
+        if len(state["generations"]) >= self.budget_per_hour:
+            return None
+
+        depths = {key: 0 for key in self.clusters}
+        for entry in state["entries"]:
+            if entry["cluster"] in depths:
+                depths[entry["cluster"]] += 1
+        key, depth = min(depths.items(), key=lambda item: item[1], default=(None, self.depth))
+        return key if depth < self.depth else None
+
+    def fill_once(self):
+        """Generate eggs until every cluster is at depth or the budget runs out"""
+        while not self._stopping:
+            key = self._next_cluster_to_fill()
+            if key is None:
+                return
+
+            descriptors = self.clusters[key]
+            try:
+                image_url = self.generate_image(pool_prompt_description(descriptors), descriptors)
+            except Exception as e:
+                self.metrics["generation_errors"] += 1
+                logger.error(f"Egg pool generation failed for [{key}]: {e}")
+                return
+
+            now = time.time()
+            handle = self._locked()
+            try:
+                state = self._read()
+                state["entries"].append({
+                    "id": str(uuid.uuid4()),
+                    "cluster": key,
+                    "image_url": image_url,
+                    "created_at": now,
+                })
+                state["generations"].append(now)
+                self._write(state)
+            finally:
+                handle.close()
+
+            self.metrics["generated"] += 1
+            logger.info(f"Egg pool filled [{key}]: {image_url}")
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        now = time.time()
+        handle = self._locked()
+        try:
+            state = self._read()
+        finally:
+            handle.close()
+
+        clusters = {}
+        for key in self.clusters:
+            ages = [now - e["created_at"] for e in state["entries"] if e["cluster"] == key]
+            clusters[key] = {
+                "depth": len(ages),
+                "target_depth": self.depth,
+                "oldest_age_seconds": round(max(ages), 1) if ages else None,
+            }
+
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        generations = [t for t in state["generations"] if now - t < 3600]
+        return {
+            **self.metrics,
+            "hit_rate": round(self.metrics["hits"] / lookups, 3) if lookups else 0.0,
+            "clusters": clusters,
+            "budget_per_hour": self.budget_per_hour,
+            "budget_remaining": max(self.budget_per_hour - len(generations), 0),
+            "max_age_seconds": self.max_age_seconds,
+        }
@@ -0,0 +1,387 @@
+"""
+Media Storage Backends for the Hatch Application
+
+The MediaStore (media_store.py) names and counts media files; a backend holds
+the bytes. Keys are relative, e.g. "images/<sha256>.png":
+
+- LocalBackend: files under the static folder (the default, one node)
+- S3Backend: any S3-compatible bucket (AWS S3, MinIO, the moto server), so
+  several nodes can write and serve the same media and a dyno restart loses
+  nothing. Uploads stream from a temp file, in multipart chunks above
+  MEDIA_MULTIPART_THRESHOLD_MB. The media routes answer with a redirect (a
+  presigned GET URL, or MEDIA_PUBLIC_BASE_URL for a public bucket / CDN), so
+  media bytes don't go through Flask. With MEDIA_SERVE=proxy they are served
+  from a ReadThroughCache instead. Needs the boto3 package (imported on first
+  use); credentials come from the usual AWS_* environment variables
+- ReadThroughCache: a size-bounded local copy of remote objects. Keys are
+  content hashes, so a cached copy never goes stale. It also feeds server-side
+  reads, and a freshly uploaded file is kept in it
+
+USAGE:
+  backend = backend_from_config(app.config)     # MEDIA_BACKEND=local|s3
+  backend.write_file("audio/<sha256>.mp3", tmp_path)
+  backend.redirect_url("images/<sha256>.png")   # None: serve backend.local_path(key)
+"""
+
+import io
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {".png": "image/png", ".mp3": "audio/mpeg"}
+
+# Keys are content hashes: an object never changes once written
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+MB = 1024 * 1024
+
+
+def content_type(key):
+    return CONTENT_TYPES.get(os.path.splitext(key)[1], "application/octet-stream")
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def temp_path(self, directory):
+        """Temp files live next to the media, so moving one into place is an atomic rename"""
+        full = os.path.join(self.root, directory)
+        os.makedirs(full, exist_ok=True)
+        return os.path.join(full, f".upload-{uuid.uuid4().hex}.tmp")
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def write_bytes(self, key, content):
+        tmp_path = self.temp_path(os.path.dirname(key))
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write_file(self, key, tmp_path):
+        os.replace(tmp_path, self._path(key))
+
+    def local_path(self, key):
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def redirect_url(self, key):
+        return None
+
+    def list(self, directory):
+        """(key, size, modified) of each file in a media directory; upload temp files included"""
+        full = os.path.join(self.root, directory)
+        if not os.path.isdir(full):
+            return
+        for filename in sorted(os.listdir(full)):
+            try:
+                st = os.stat(os.path.join(full, filename))
+            except FileNotFoundError:
+                continue
+            yield f"{directory}/{filename}", st.st_size, st.st_mtime
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self, grace_seconds, dry_run=False):
+        """Abandoned partial uploads (the local ones are temp files, removed by the GC scan)"""
+        return 0
+
+    def stats(self):
+        return {"backend": self.name, "root": self.root}
+
+
+class ReadThroughCache:
+    def __init__(self, directory, max_bytes=512 * MB):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # scanned on first use
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split("/"))
+
+    def temp_path(self):
+        tmp_dir = os.path.join(self.directory, ".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{uuid.uuid4().hex}.tmp")
+
+    def get(self, key):
+        """Path of the cached copy (its mtime is bumped, for LRU eviction), or None"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self.metrics["hits"] += 1
+        return path
+
+    def fetch(self, key, download):
+        """Cached copy of key, calling download(dest_path) on a miss"""
+        path = self.get(key)
+        if path is not None:
+            return path
+        self.metrics["misses"] += 1
+        tmp_path = self.temp_path()
+        try:
+            download(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.adopt(key, tmp_path)
+
+    def adopt(self, key, tmp_path):
+        """Move a complete file into the cache"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan()
+            else:
+                self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+        return path
+
+    def _scan(self):
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def evict(self):
+        """Remove least recently used copies until the cache is at 90% of its limit"""
+        files = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            if os.path.basename(dirpath) == ".tmp":
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.metrics["evictions"] += 1
+        with self._lock:
+            self._bytes = total
+
+    def stats(self):
+        return {"directory": self.directory, "max_bytes": self.max_bytes, "bytes": self._bytes, **self.metrics}
+
+
+class S3Backend:
+    name = "s3"
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, cache=None, serve="presign",
+                 public_base_url=None, presign_seconds=3600, multipart_threshold=8 * MB,
+                 multipart_chunksize=8 * MB, max_concurrency=4):
+        """
+        serve: "presign" (redirect to a presigned GET URL), "public" (redirect to
+        public_base_url + key) or "proxy" (serve through the read-through cache).
+        """
+        if serve not in ("presign", "public", "proxy"):
+            raise ValueError(f"Unknown media serve mode: {serve}")
+        if serve == "public" and not public_base_url:
+            raise ValueError("MEDIA_SERVE=public needs MEDIA_PUBLIC_BASE_URL")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.cache = cache or ReadThroughCache("media_cache")
+        self.serve = serve
+        self.public_base_url = (public_base_url or "").rstrip("/")
+        self.presign_seconds = presign_seconds
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = max_concurrency
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._transfer_config = None
+        self.metrics = {"uploads": 0, "multipart_uploads": 0, "bytes_uploaded": 0, "downloads": 0, "redirects": 0}
+
+    @property
+    def client(self):
+        """boto3 client, built on first use (boto3 is slow to import and only needed for S3)"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from boto3.s3.transfer import TransferConfig
+                    from botocore.config import Config as BotoConfig
+
+                    self._transfer_config = TransferConfig(
+                        multipart_threshold=self.multipart_threshold,
+                        multipart_chunksize=self.multipart_chunksize,
+                        max_concurrency=self.max_concurrency
+                    )
+                    self._client = boto3.client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        config=BotoConfig(retries={"max_attempts": 3, "mode": "standard"},
+                                          max_pool_connections=max(10, self.max_concurrency * 2))
+                    )
+        return self._client
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def temp_path(self, directory):
+        return self.cache.temp_path()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        if self.cache.get(key) is not None:
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def _upload(self, key, fileobj, size):
+        self.client.upload_fileobj(
+            fileobj, self.bucket, self._key(key),
+            ExtraArgs={"ContentType": content_type(key), "CacheControl": IMMUTABLE},
+            Config=self._transfer_config
+        )
+        with self._lock:
+            self.metrics["uploads"] += 1
+            self.metrics["bytes_uploaded"] += size
+            if size >= self.multipart_threshold:
+                self.metrics["multipart_uploads"] += 1
+
+    def write_bytes(self, key, content):
+        self._upload(key, io.BytesIO(content), len(content))
+
+    def write_file(self, key, tmp_path):
+        """Stream the file up (multipart above the threshold), then keep it as the cached copy"""
+        size = os.path.getsize(tmp_path)
+        try:
+            with open(tmp_path, 'rb') as f:
+                self._upload(key, f, size)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.cache.adopt(key, tmp_path)
+
+    def local_path(self, key):
+        from botocore.exceptions import ClientError
+
+        def download(dest):
+            self.client.download_file(self.bucket, self._key(key), dest, Config=self._transfer_config)
+            self.metrics["downloads"] += 1
+
+        try:
+            return self.cache.fetch(key, download)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def redirect_url(self, key):
+        if self.serve == "proxy":
+            return None
+        self.metrics["redirects"] += 1
+        if self.serve == "public":
+            return f"{self.public_base_url}/{self._key(key)}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=self.presign_seconds
+        )
+
+    def list(self, directory):
+        paginator = self.client.get_paginator("list_objects_v2")
+        strip = len(self.prefix)
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(f"{directory}/")):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][strip:], obj["Size"], obj["LastModified"].timestamp()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def cleanup(self, grace_seconds, dry_run=False):
+        """Abort multipart uploads started more than grace_seconds ago (their parts are billed)"""
+        cutoff = datetime.now(timezone.utc).timestamp() - grace_seconds
+        aborted = 0
+        paginator = self.client.get_paginator("list_multipart_uploads")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for upload in page.get("Uploads", []):
+                if upload["Initiated"].timestamp() >= cutoff:
+                    continue
+                aborted += 1
+                if not dry_run:
+                    self.client.abort_multipart_upload(Bucket=self.bucket, Key=upload["Key"],
+                                                       UploadId=upload["UploadId"])
+        return aborted
+
+    def stats(self):
+        return {"backend": self.name, "bucket": self.bucket, "prefix": self.prefix, "serve": self.serve,
+                **self.metrics, "cache": self.cache.stats()}
+
+
+def backend_from_config(config, root="static"):
+    """The backend MEDIA_BACKEND selects; config is app.config or any mapping of Config's settings"""
+    name = config.get('MEDIA_BACKEND', 'local')
+    if name == 'local':
+        return LocalBackend(root)
+    if name != 's3':
+        raise ValueError(f"Unknown MEDIA_BACKEND: {name}")
+    if not config.get('MEDIA_S3_BUCKET'):
+        raise ValueError("MEDIA_BACKEND=s3 needs MEDIA_S3_BUCKET")
+    return S3Backend(
+        config['MEDIA_S3_BUCKET'],
+        prefix=config.get('MEDIA_S3_PREFIX', ''),
+        endpoint_url=config.get('MEDIA_S3_ENDPOINT_URL') or None,
+        region=config.get('MEDIA_S3_REGION') or None,
+        cache=ReadThroughCache(config.get('MEDIA_CACHE_DIR', 'media_cache'),
+                               max_bytes=int(config.get('MEDIA_CACHE_MAX_MB', 512) * MB)),
+        serve=config.get('MEDIA_SERVE', 'presign'),
+        public_base_url=config.get('MEDIA_PUBLIC_BASE_URL') or None,
+        presign_seconds=config.get('MEDIA_PRESIGN_SECONDS', 3600),
+        multipart_threshold=int(config.get('MEDIA_MULTIPART_THRESHOLD_MB', 8) * MB),
+        multipart_chunksize=int(config.get('MEDIA_MULTIPART_CHUNK_MB', 8) * MB)
+    )
@@ -0,0 +1,441 @@
+"""
+Content-addressed Media Storage for the Hatch Application
+
+Egg and creature images and creature sounds used to be written as
+egg_<uuid>.png / creature_<uuid>.png / creature_sound_<uuid>.mp3: identical
+bytes (the same TTS sound, a re-downloaded image) were stored again each time,
+and nothing linked a file back to the records using it, so the files of failed
+or abandoned hatches stayed on disk forever. Media now goes through a
+MediaStore:
+
+- Files are named by the SHA-256 of their content (static/images/<sha256>.png,
+  static/audio/<sha256>.mp3), so writing bytes that are already stored costs
+  nothing and returns the existing URL. URLs keep the /static/... form, so the
+  media routes and the front end are unchanged
+- A small SQLite index (MEDIA_INDEX_PATH) keeps a reference count per file:
+  saving an egg or creature record adds one for each media URL it holds
+- Nothing is deleted while a request runs (another request may have just been
+  handed the same file). Unreferenced files are reclaimed by the GC command,
+  and only once they are older than the grace period (a file written or
+  re-used since then is kept)
+
+GC recounts references from the record files themselves (eggs, creatures,
+the prompt cache, the egg pool and the audio sprites), corrects the index's
+counts, and deletes unreferenced files (including the old uuid-named ones) and
+stale upload temp files past the grace period.
+
+A bucket (MEDIA_BACKEND=s3) is shared by every node, but the record files GC
+reads are one node's. GC against a remote backend therefore refuses to run
+unless told the reference files cover every node (shared_references=True, or
+--shared-references), since it would otherwise delete other nodes' media.
+
+Where the bytes live is up to the backend (media_backends.py): the static
+folder by default, or an S3-compatible bucket (MEDIA_BACKEND=s3). The URLs
+stay the same either way; the media routes turn them into a file or a redirect.
+
+USAGE:
+  store = MediaStore("static", "media_index.db", backend=backend_from_config(app.config))
+  url = store.put(png_bytes, "image")                  # /static/images/<sha256>.png
+  tmp = store.temp_path("audio"); stream_to(tmp); url = store.put_file(tmp, "audio")
+  store.ref(egg["image_url"])                          # when a record is saved
+  store.redirect_url(url) or store.local_path(url)     # how to serve it
+
+  python media_store.py gc --grace-hours 24 --dry-run
+  python media_store.py stats
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from media_backends import LocalBackend
+
+logger = logging.getLogger(__name__)
+
+# kind -> (directory under the media root, file extension)
+MEDIA_KINDS = {
+    "image": ("images", ".png"),
+    "audio": ("audio", ".mp3"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    url TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_put_at REAL NOT NULL
+);
+"""
+
+_CHUNK = 1024 * 1024
+
+
+class MediaStore:
+    def __init__(self, root="static", index_path="media_index.db", on_put=None, backend=None):
+        """
+        root is the URL prefix (and, for the default LocalBackend, the directory).
+        on_put(kind, size, deduplicated) is called after every put / put_file.
+        """
+        self.root = root
+        self.index_path = index_path
+        self.on_put = on_put
+        self.backend = backend or LocalBackend(root)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.metrics = {"puts": 0, "deduplicated": 0, "bytes_written": 0, "bytes_deduplicated": 0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Locations
+    # ------------------------------------------------------------------
+
+    def _locate(self, digest, kind):
+        """(web URL, backend key) of the file with this content hash"""
+        if kind not in MEDIA_KINDS:
+            raise ValueError(f"Unknown media kind: {kind}")
+        directory, extension = MEDIA_KINDS[kind]
+        key = f"{directory}/{digest}{extension}"
+        return f"/{self.root}/{key}", key
+
+    def key_for(self, url):
+        """Backend key of a media URL, or None if it isn't one of ours"""
+        if not url:
+            return None
+        for directory, _ in MEDIA_KINDS.values():
+            prefix = f"/{self.root}/{directory}/"
+            name = url[len(prefix):]
+            if url.startswith(prefix) and name and "/" not in name and not name.startswith("."):
+                return f"{directory}/{name}"
+        return None
+
+    def temp_path(self, kind):
+        """A path to stream an upload to before put_file"""
+        if kind not in MEDIA_KINDS:
+            raise ValueError(f"Unknown media kind: {kind}")
+        return self.backend.temp_path(MEDIA_KINDS[kind][0])
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def exists(self, url):
+        key = self.key_for(url)
+        return key is not None and self.backend.exists(key)
+
+    def local_path(self, url):
+        """A local file with the media's bytes (a cached copy for remote backends), or None"""
+        key = self.key_for(url)
+        return self.backend.local_path(key) if key else None
+
+    def redirect_url(self, url):
+        """Where to send a client for this media (presigned / public URL), or None to serve local_path"""
+        key = self.key_for(url)
+        return self.backend.redirect_url(key) if key else None
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def put(self, content, kind):
+        """Store bytes (unless identical bytes already are); returns the web URL"""
+        url, key = self._locate(hashlib.sha256(content).hexdigest(), kind)
+        deduplicated = self.backend.exists(key)
+        if not deduplicated:
+            self.backend.write_bytes(key, content)
+        self._stored(url, kind, len(content), deduplicated)
+        return url
+
+    def put_file(self, tmp_path, kind):
+        """Move a finished temp file (see temp_path) into the store; returns the web URL"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(tmp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        url, key = self._locate(digest.hexdigest(), kind)
+        deduplicated = self.backend.exists(key)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            self.backend.write_file(key, tmp_path)
+        self._stored(url, kind, size, deduplicated)
+        return url
+
+    def _stored(self, url, kind, size, deduplicated):
+        now = time.time()
+        with self._lock:
+            self.metrics["puts"] += 1
+            if deduplicated:
+                self.metrics["deduplicated"] += 1
+                self.metrics["bytes_deduplicated"] += size
+            else:
+                self.metrics["bytes_written"] += size
+            # last_put_at restarts the GC grace period: the caller is about to reference the file
+            self._conn.execute(
+                "INSERT INTO media (url, kind, size, refs, created_at, last_put_at) VALUES (?, ?, ?, 0, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET last_put_at = excluded.last_put_at",
+                (url, kind, size, now, now)
+            )
+            self._conn.commit()
+        if deduplicated:
+            logger.info(f"Media deduplicated: {url} ({size} bytes)")
+        if self.on_put:
+            self.on_put(kind, size, deduplicated)
+
+    # ------------------------------------------------------------------
+    # References
+    # ------------------------------------------------------------------
+
+    def ref(self, *urls):
+        """Count a reference from a saved record to each media URL (None and foreign URLs are ignored)"""
+        self._adjust(urls, 1)
+
+    def unref(self, *urls):
+        self._adjust(urls, -1)
+
+    def _adjust(self, urls, delta):
+        rows = []
+        now = time.time()
+        for url in urls:
+            key = self.key_for(url)
+            if key is None:
+                continue
+            # A row created here has no size yet; the next GC fills it in
+            rows.append((url, _kind_of(key), 0, max(delta, 0), now, now, delta))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO media (url, kind, size, refs, created_at, last_put_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET refs = MAX(refs + ?, 0)",
+                rows
+            )
+            self._conn.commit()
+
+    def refs(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT refs FROM media WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else 0
+
+    # ------------------------------------------------------------------
+    # Garbage collection
+    # ------------------------------------------------------------------
+
+    def _files(self):
+        """(url, key, kind, size, modified) of every stored file, temp files included"""
+        for kind, (directory, _) in MEDIA_KINDS.items():
+            for key, size, modified in self.backend.list(directory):
+                yield f"/{self.root}/{key}", key, kind, size, modified
+
+    def files(self):
+        """(url, key, kind, size) of every stored media file (upload temp files excluded)"""
+        for url, key, kind, size, _ in self._files():
+            if not os.path.basename(key).startswith("."):
+                yield url, key, kind, size
+
+    def gc(self, referenced, grace_seconds=24 * 3600, dry_run=False, shared_references=False):
+        """
+        Reclaim media nobody references. referenced maps URL -> number of references
+        (see collect_references). Files are only deleted once the grace period has
+        passed since they were written or last re-used. Returns a report.
+
+        With a remote backend, referenced must count every node's records: pass
+        shared_references=True to confirm it does (dry runs are always allowed).
+        """
+        if not (dry_run or shared_references or isinstance(self.backend, LocalBackend)):
+            raise ValueError(f"Media GC on the shared {self.backend.name} backend needs references from "
+                             f"every node; confirm with shared_references=True (--shared-references)")
+        now = time.time()
+        with self._lock:
+            indexed = {url: (refs, last_put_at) for url, refs, last_put_at in
+                       self._conn.execute("SELECT url, refs, last_put_at FROM media")}
+
+        report = {"dry_run": dry_run, "grace_seconds": grace_seconds, "files": 0, "bytes": 0,
+                  "referenced": 0, "deleted": 0, "bytes_reclaimed": 0, "within_grace": 0,
+                  "temp_files_deleted": 0, "uploads_aborted": 0, "missing": 0, "refs_corrected": 0}
+        present = {}
+        deleted = []
+        for url, key, kind, size, modified in self._files():
+            if os.path.basename(key).startswith("."):
+                # An upload that never finished (the process died between temp_path and put_file)
+                if now - modified >= grace_seconds:
+                    report["temp_files_deleted"] += 1
+                    report["bytes_reclaimed"] += size
+                    if not dry_run:
+                        self.backend.delete(key)
+                continue
+
+            report["files"] += 1
+            report["bytes"] += size
+            if referenced.get(url):
+                report["referenced"] += 1
+                present[url] = (kind, size, modified)
+                continue
+
+            last_used = max(modified, indexed.get(url, (0, 0))[1])
+            if now - last_used < grace_seconds:
+                report["within_grace"] += 1
+                present[url] = (kind, size, modified)
+                continue
+
+            report["deleted"] += 1
+            report["bytes_reclaimed"] += size
+            deleted.append(url)
+            if not dry_run:
+                self.backend.delete(key)
+                logger.info(f"Media GC removed {url} ({size} bytes)")
+
+        report["uploads_aborted"] = self.backend.cleanup(grace_seconds, dry_run=dry_run)
+        report["missing"] = sum(1 for url in referenced if url not in present and self.key_for(url))
+        for url in present:
+            if indexed.get(url, (0, 0))[0] != referenced.get(url, 0):
+                report["refs_corrected"] += 1
+
+        if not dry_run:
+            # The index follows the files: recounted references, rows of deleted files dropped
+            with self._lock:
+                self._conn.executemany("DELETE FROM media WHERE url = ?", [(url,) for url in deleted])
+                self._conn.execute("DELETE FROM media WHERE refs = 0 AND last_put_at < ?", (now - grace_seconds,))
+                self._conn.executemany(
+                    "INSERT INTO media (url, kind, size, refs, created_at, last_put_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(url) DO UPDATE SET refs = excluded.refs, size = excluded.size",
+                    [(url, kind, size, referenced.get(url, 0), mtime, indexed.get(url, (0, mtime))[1])
+                     for url, (kind, size, mtime) in present.items()]
+                )
+                self._conn.commit()
+        return report
+
+    def upload_local(self):
+        """
+        Copy media files from the local static folder into the backend (when switching
+        to a remote one); existing keys are skipped. Returns counts.
+        """
+        local = LocalBackend(self.root)
+        report = {"uploaded": 0, "bytes": 0, "skipped": 0}
+        if isinstance(self.backend, LocalBackend):
+            return report
+        for directory, _ in MEDIA_KINDS.values():
+            for key, size, _ in local.list(directory):
+                if os.path.basename(key).startswith(".") or self.backend.exists(key):
+                    report["skipped"] += 1
+                    continue
+                tmp_path = self.backend.temp_path(directory)
+                shutil.copyfile(local.local_path(key), tmp_path)
+                self.backend.write_file(key, tmp_path)
+                report["uploaded"] += 1
+                report["bytes"] += size
+                logger.info(f"Uploaded {key} ({size} bytes)")
+        return report
+
+    # ------------------------------------------------------------------
+    # Statistics
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refs), 0), "
+                "COALESCE(SUM(CASE WHEN refs = 0 THEN 1 ELSE 0 END), 0) FROM media GROUP BY kind"
+            ).fetchall()
+            process = dict(self.metrics)
+        return {
+            "kinds": {kind: {"files": files, "bytes": size, "references": refs, "unreferenced": unreferenced}
+                      for kind, files, size, refs, unreferenced in rows},
+            "process": process,
+            "backend": self.backend.stats(),
+        }
+
+
+def _kind_of(key):
+    directory = key.split("/", 1)[0]
+    return next((kind for kind, (name, _) in MEDIA_KINDS.items() if name == directory), "image")
+
+
+def collect_references(paths, root="static"):
+    """Count the media URLs held by the JSON files at paths (missing files are skipped)"""
+    prefixes = tuple(f"/{root}/{directory}/" for directory, _ in MEDIA_KINDS.values())
+    counts = Counter()
+
+    def walk(value):
+        if isinstance(value, str):
+            if value.startswith(prefixes):
+                counts[value] += 1
+        elif isinstance(value, dict):
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            walk(json.load(f))
+    return counts
+
+
+def main(argv=None):
+    import argparse
+
+    from config import Config
+    from media_backends import backend_from_config
+
+    parser = argparse.ArgumentParser(
+        description="Hatch media store maintenance",
+        epilog="gc deletes every file the --references files don't mention. With MEDIA_BACKEND=s3 the bucket is "
+               "shared by all nodes but the reference files are this node's, so gc refuses to delete anything "
+               "(--dry-run still reports) unless --shared-references confirms the files cover every node.")
+    parser.add_argument("command", choices=["gc", "stats", "upload-local"],
+                        help="upload-local copies media from the static folder into the configured backend")
+    parser.add_argument("--root", default=Config.STATIC_FOLDER)
+    parser.add_argument("--index", default=Config.MEDIA_INDEX_PATH)
+    parser.add_argument("--grace-hours", type=float, default=Config.MEDIA_GC_GRACE_HOURS,
+                        help="only reclaim files unused for this long")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be reclaimed")
+    parser.add_argument("--references", nargs="+",
+                        default=["eggs_data.json", "creatures_data.json", Config.PROMPT_CACHE_PATH, Config.EGG_POOL_PATH,
+                                 Config.AUDIO_SPRITE_PATH],
+                        help="JSON files whose media URLs are kept")
+    parser.add_argument("--shared-references", action="store_true",
+                        help="the --references files hold every node's records (a shared volume, or copies "
+                             "gathered from each node); required to gc a remote backend")
+    args = parser.parse_args(argv)
+
+    settings = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    store = MediaStore(args.root, args.index, backend=backend_from_config(settings, root=args.root))
+    try:
+        if args.command == "stats":
+            result = store.stats()
+        elif args.command == "upload-local":
+            result = store.upload_local()
+        else:
+            try:
+                result = store.gc(collect_references(args.references, args.root),
+                                  grace_seconds=args.grace_hours * 3600, dry_run=args.dry_run,
+                                  shared_references=args.shared_references)
+            except ValueError as e:
+                parser.error(str(e))
+    finally:
+        store.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Signed Media URLs for the Hatch Application
+
+/static/images/... and /static/audio/... used to be behind login_required, so
+every thumbnail decoded the session cookie, and the responses (which vary by
+cookie) could not be cached by the browser across pages or by a shared
+proxy/CDN. Media URLs handed out by the API are now signed instead:
+
+    /static/images/<sha256>.png?exp=1767225600&sig=<hmac>
+
+- sig is an HMAC-SHA256 of the path and the expiry (truncated to 128 bits,
+  base64url), keyed with MEDIA_URL_SECRET (or a key derived from SECRET_KEY).
+  Checking it needs no session, no database and no shared state, so the media
+  route, or a front proxy through the auth endpoint, can do it on its own
+- The expiry is rounded up to a step boundary (MEDIA_URL_STEP_SECONDS), so
+  every listing within the same step hands out the same URL for a file and the
+  browser/CDN copy keeps getting hit. A URL is good for between TTL and
+  TTL + step
+- Media files are content-addressed (media_store.py) and never change, so a
+  valid signed URL can be served "public, immutable" until it expires: the URL
+  itself is the credential
+
+Records keep their unsigned URLs on disk; URLs are signed when records are
+listed. MEDIA_URL_SECRET may hold several comma-separated secrets: the first
+signs, all of them verify, so a secret can be rotated without breaking pages
+that are already open.
+
+USAGE:
+  signer = MediaURLSigner(["secret"], ttl_seconds=86400, step_seconds=3600)
+  url = signer.sign("/static/images/<sha256>.png")
+  remaining = signer.verify(path, request.args.get("exp"), request.args.get("sig"))  # seconds left or None
+  signer.verify_url(url)                                                             # same, for a full URL
+
+  python media_urls.py sign /static/images/<sha256>.png
+  python media_urls.py verify "/static/images/<sha256>.png?exp=...&sig=..."
+"""
+
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+SIGNED_PREFIXES = ("/static/images/", "/static/audio/")
+
+
+def derive_key(secret_key):
+    """A media-only key from the app's SECRET_KEY, so a signed URL never doubles as a session signature"""
+    return hmac.new(secret_key.encode(), b"hatch-media-urls", hashlib.sha256).digest()
+
+
+class MediaURLSigner:
+    def __init__(self, keys, ttl_seconds=86400, step_seconds=3600, prefixes=SIGNED_PREFIXES):
+        if not keys:
+            raise ValueError("MediaURLSigner needs at least one key")
+        self.keys = [key.encode() if isinstance(key, str) else key for key in keys]
+        self.ttl_seconds = ttl_seconds
+        self.step_seconds = max(1, step_seconds)
+        self.prefixes = tuple(prefixes)
+        # url -> signed url for the current expiry; cleared when the step rolls over
+        self._signed = {}
+        self._signed_expires = None
+        self._lock = threading.Lock()
+        self.counts = {"signed": 0, "sign_cache_hits": 0, "valid": 0, "expired": 0, "invalid": 0}
+
+    def expires_at(self, now=None):
+        """The expiry every URL signed now gets: now + TTL, rounded up to the next step"""
+        now = time.time() if now is None else now
+        return -(-int(now + self.ttl_seconds) // self.step_seconds) * self.step_seconds
+
+    def _signature(self, key, path, expires):
+        digest = hmac.new(key, f"{path}\n{expires}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b"=").decode()
+
+    def sign(self, url, now=None):
+        """The signed form of a media URL; anything that isn't one (None, external URLs) is returned as is"""
+        if not url or not url.startswith(self.prefixes) or "?" in url:
+            return url
+        expires = self.expires_at(now)
+        with self._lock:
+            if expires != self._signed_expires:
+                self._signed = {}
+                self._signed_expires = expires
+            signed = self._signed.get(url)
+            if signed is not None:
+                self.counts["sign_cache_hits"] += 1
+                return signed
+        signed = f"{url}?exp={expires}&sig={self._signature(self.keys[0], url, expires)}"
+        with self._lock:
+            if expires == self._signed_expires:
+                self._signed[url] = signed
+            self.counts["signed"] += 1
+        return signed
+
+    def sign_record(self, record, fields=("image_url", "audio_url", "alternate_image_urls", "thumbnail_url")):
+        """A copy of an egg/creature record with its media URLs signed (the record itself is left alone)"""
+        if not isinstance(record, dict):
+            return record
+        signed = dict(record)
+        for field in fields:
+            value = signed.get(field)
+            if isinstance(value, list):
+                signed[field] = [self.sign(url) for url in value if url]
+            elif value:
+                signed[field] = self.sign(value)
+        return signed
+
+    def verify(self, path, expires, signature, now=None):
+        """Seconds until a signed URL expires, or None if it is expired, tampered with or not signed"""
+        result, remaining = "invalid", None
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            expires = None
+        if expires is not None and signature and path.startswith(self.prefixes):
+            if any(hmac.compare_digest(self._signature(key, path, expires), signature) for key in self.keys):
+                now = time.time() if now is None else now
+                if expires > now:
+                    result, remaining = "valid", int(expires - now)
+                else:
+                    result = "expired"
+        with self._lock:
+            self.counts[result] += 1
+        return remaining
+
+    def verify_url(self, url, now=None):
+        """verify() for a full path?query URL, e.g. the X-Original-URI a front proxy passes along"""
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        return self.verify(parts.path, (query.get("exp") or [None])[0], (query.get("sig") or [None])[0], now=now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counts,
+                "ttl_seconds": self.ttl_seconds,
+                "step_seconds": self.step_seconds,
+                "keys": len(self.keys),
+                "current_expiry": self.expires_at(),
+                "sign_cache_size": len(self._signed),
+            }
+
+
+def signer_from_config(config):
+    """The signer the app settings describe, or None when MEDIA_SIGNED_URLS is off"""
+    if not config.get('MEDIA_SIGNED_URLS', True):
+        return None
+    secrets = [s.strip() for s in (config.get('MEDIA_URL_SECRET') or '').split(',') if s.strip()]
+    keys = secrets or [derive_key(config.get('SECRET_KEY') or 'fallback-secret-key')]
+    return MediaURLSigner(
+        keys,
+        ttl_seconds=int(config.get('MEDIA_URL_TTL_SECONDS', 86400)),
+        step_seconds=int(config.get('MEDIA_URL_STEP_SECONDS', 3600))
+    )
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Sign or check media URLs with the app's settings")
+    parser.add_argument("command", choices=["sign", "verify"])
+    parser.add_argument("urls", nargs="+")
+    args = parser.parse_args()
+
+    from config import Config
+    signer = signer_from_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()})
+    if signer is None:
+        sys.exit("MEDIA_SIGNED_URLS is off")
+    failed = False
+    for url in args.urls:
+        if args.command == "sign":
+            print(signer.sign(url))
+        else:
+            remaining = signer.verify_url(url)
+            failed = failed or remaining is None
+            print(f"{url}: " + (f"valid for {remaining}s" if remaining is not None else "INVALID"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
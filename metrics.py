@@ -0,0 +1,345 @@
+"""
+Metrics for the Hatch Application
+
+Counters and latency histograms for the things that decide how long a request
+takes: OpenAI calls, image downloads, file writes, JSON storage and the Flask
+routes themselves, plus per-stage timings of the egg and hatch pipelines.
+Exposed at /metrics in the Prometheus text exposition format.
+
+MULTIPROCESS:
+Every gunicorn worker keeps its own values in memory and a background thread
+snapshots them to <METRICS_DIR>/<pid>.json (atomic rename) about once a second.
+A scrape, whichever worker serves it, merges all snapshots. Snapshots of
+workers that have exited are folded into archive.json so their counts survive
+and pid reuse can't clobber them. Clear the directory when redeploying if you
+want counters to start from zero. Gauges (current values such as queue depth)
+are summed over live workers only. A gauge of state every worker shares (a file
+they all read) would be counted once per worker, so it comes from a collector
+instead: run by whichever worker serves the scrape, and never snapshotted.
+
+USAGE:
+  metrics.histogram("hatch_download_duration_seconds", "Image downloads", buckets=IO_BUCKETS)
+  with metrics.time("hatch_download_duration_seconds", kind="egg"):
+      ...
+  metrics.inc("hatch_openai_tokens_total", 812, operation="chat", model="gpt-4o", type="prompt")
+  metrics.set("hatch_scheduler_queue_depth", 3, lane="batch")
+  metrics.collectors.append(lambda: [("hatch_egg_pool_depth", {"cluster": "cozy"}, 2)])
+
+  stages = metrics.stages("hatch_stage_duration_seconds", pipeline="hatch")
+  ...; stages.mark("concept")   # observes the time since the previous mark
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+IO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+API_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class StageTimer:
+    """Observes the time between successive marks into one histogram, labelled by stage"""
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        start, elapsed = self._last, now - self._last
+        self._last = now
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        self.metrics.observe(self.name, elapsed, stage=stage, **self.labels)
+        for listener in self.metrics.stage_listeners:
+            listener(self.labels, stage, start, now)
+        return elapsed
+
+    def skip(self):
+        """Restart the clock without recording (e.g. after a stage that was prefetched)"""
+        self._last = time.perf_counter()
+
+
+class Metrics:
+    def __init__(self, directory=None, enabled=True, flush_interval=1.0):
+        self.directory = directory
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+
+        self._definitions = {}
+        self.stage_listeners = []  # listener(labels, stage, start, end) for every StageTimer mark
+        self.collectors = []  # collector() -> [(gauge name, labels, value)], read at scrape time
+        self._lock = threading.Lock()
+        self._pid = None
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._dirty = False
+        self._flusher = None
+
+        if self.enabled and self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # Definitions
+    # ------------------------------------------------------------------
+
+    def counter(self, name, help_text):
+        self._definitions[name] = {"type": "counter", "help": help_text}
+
+    def gauge(self, name, help_text):
+        self._definitions[name] = {"type": "gauge", "help": help_text}
+
+    def histogram(self, name, help_text, buckets=IO_BUCKETS):
+        self._definitions[name] = {"type": "histogram", "help": help_text, "buckets": tuple(sorted(buckets))}
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def _check_process(self):
+        """After a fork, drop the parent's values and start our own flusher (called under lock)"""
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        self._pid = pid
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._flusher = None
+        if self.directory:
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_process()
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._dirty = True
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_process()
+            self._gauges[key] = value
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        buckets = self._definitions[name]["buckets"]
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_process()
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+            self._dirty = True
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observe the duration of the block (also when it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stages(self, name, **labels):
+        return StageTimer(self, name, labels)
+
+    # ------------------------------------------------------------------
+    # Cross-process sharing
+    # ------------------------------------------------------------------
+
+    def _snapshot(self):
+        return {
+            "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+            "gauges": [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+            "histograms": [[name, list(labels), {**entry, "buckets": list(entry["buckets"])}]
+                           for (name, labels), entry in self._histograms.items()],
+        }
+
+    def _write_json(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Write this process's values to its snapshot file"""
+        if not self.enabled or not self.directory:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._dirty:
+                return
+            data = self._snapshot()
+            self._dirty = False
+        try:
+            self._write_json(os.path.join(self.directory, f"{os.getpid()}.json"), data)
+        except Exception as e:
+            logger.error(f"Error writing metrics snapshot: {e}")
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _read_snapshot(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _merge(self, totals, snapshot):
+        counters, histograms, gauges = totals
+        for name, labels, value in snapshot.get("counters", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot.get("gauges", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, entry in snapshot.get("histograms", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            if merged is None or len(merged["buckets"]) != len(entry["buckets"]):
+                histograms[key] = {"buckets": list(entry["buckets"]), "sum": entry["sum"], "count": entry["count"]}
+            else:
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], entry["buckets"])]
+                merged["sum"] += entry["sum"]
+                merged["count"] += entry["count"]
+
+    def _fold_dead_processes(self):
+        """Move snapshots of exited workers into archive.json"""
+        handle = open(os.path.join(self.directory, ".lock"), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            dead = []
+            for filename in os.listdir(self.directory):
+                stem, ext = os.path.splitext(filename)
+                if ext != ".json" or not stem.isdigit():
+                    continue
+                try:
+                    os.kill(int(stem), 0)
+                except ProcessLookupError:
+                    dead.append(os.path.join(self.directory, filename))
+                except PermissionError:
+                    pass
+            if not dead:
+                return
+
+            # Gauges of exited workers are dropped: their current values no longer apply
+            archive_path = os.path.join(self.directory, "archive.json")
+            totals = ({}, {}, {})
+            self._merge(totals, self._read_snapshot(archive_path) or {})
+            for path in dead:
+                self._merge(totals, self._read_snapshot(path) or {})
+            self._write_json(archive_path, {
+                "counters": [[name, list(labels), value] for (name, labels), value in totals[0].items()],
+                "histograms": [[name, list(labels), entry] for (name, labels), entry in totals[1].items()],
+            })
+            for path in dead:
+                os.remove(path)
+        finally:
+            handle.close()
+
+    def collect(self):
+        """Merged ({counter key: value}, {histogram key: entry}, {gauge key: value}) across all workers"""
+        totals = ({}, {}, {})
+        if not self.directory:
+            with self._lock:
+                self._merge(totals, self._snapshot())
+            return totals
+
+        self.flush()
+        try:
+            self._fold_dead_processes()
+        except Exception as e:
+            logger.error(f"Error archiving metrics snapshots: {e}")
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                self._merge(totals, self._read_snapshot(os.path.join(self.directory, filename)) or {})
+        return totals
+
+    # ------------------------------------------------------------------
+    # Exposition
+    # ------------------------------------------------------------------
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        counters, histograms, gauges = self.collect()
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges[(name, _label_key(labels))] = value
+            except Exception as e:
+                logger.error(f"Error running metrics collector: {e}")
+        lines = []
+        for name, definition in sorted(self._definitions.items()):
+            lines.append(f"# HELP {name} {definition['help']}")
+            lines.append(f"# TYPE {name} {definition['type']}")
+            if definition["type"] in ("counter", "gauge"):
+                values = counters if definition["type"] == "counter" else gauges
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            bounds = list(definition["buckets"]) + [float("inf")]
+            for (metric, labels), entry in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                counts = entry["buckets"] + [entry["count"] - sum(entry["buckets"])]
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(entry['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {entry['count']}")
+        return "\n".join(lines) + "\n"
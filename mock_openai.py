@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Offline Mock OpenAI Server for the Hatch Application
+
+A local stand-in for the OpenAI endpoints Hatch uses, so throughput and latency
+can be measured (and CI can run) without network access or API spend.
+
+ENDPOINTS:
+- POST /v1/chat/completions     canned concept / analysis / voice replies with usage (cached_tokens
+                                 like OpenAI's prefix cache: repeats of a seen prefix of at least
+                                 --cache-min-tokens, in 128-token steps)
+- POST /v1/images/generations   URL (default) or b64_json responses
+- POST /v1/audio/speech         a small MP3 payload
+- GET  /v1/models               model list (used to warm connections)
+- GET  /mock-images/<name>.png  the "CDN" the image URLs point at
+
+USAGE:
+  python mock_openai.py --port 8089 --latency chat=lognormal:1.2:0.4 \\
+      --latency images=lognormal:12:0.3 --error-rate 0.01 --rate-limit-rate 0.02
+
+  Then run the app against it:
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python app.py
+
+  The development server closes every connection. To measure connection reuse
+  (/api/openai-client/stats), serve the mock with keep-alive instead:
+  gunicorn 'mock_openai:create_mock_app()' -b 127.0.0.1:8089 -k gthread --threads 64 --keep-alive 30
+
+LATENCY SPECS (seconds), per endpoint group (chat, images, speech, download, models):
+- fixed:0.5
+- uniform:0.2:1.5
+- lognormal:<median>:<sigma>
+"""
+
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+ENDPOINT_GROUPS = ("chat", "images", "speech", "download", "models")
+
+# A few hundred bytes that start like an MP3 frame; clients only store it
+MOCK_MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\xff\xfb\x90\x64" + bytes(412)
+
+
+def parse_latency(spec):
+    """Turn a latency spec string into a zero-argument sampler returning seconds"""
+    kind, _, rest = spec.partition(":")
+    args = [float(a) for a in rest.split(":") if a]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        median, sigma = args
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def make_png(size):
+    """A soft gradient PNG of roughly realistic weight for the download path"""
+    from PIL import Image
+
+    image = Image.new("RGB", (size, size))
+    pixels = image.load()
+    for y in range(size):
+        for x in range(size):
+            pixels[x, y] = ((x * 255) // size, (y * 255) // size, ((x ^ y) * 7) & 255)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def create_mock_app(latency=None, error_rate=0.0, rate_limit_rate=0.0, image_size=256, cache_min_tokens=1024):
+    """
+    Build the mock server.
+    latency maps endpoint group -> sampler; error_rate/rate_limit_rate are the
+    fractions of requests answered with a 500 / 429.
+    """
+    app = Flask(__name__)
+    latency = latency or {}
+    png = make_png(image_size)
+    stats = {group: 0 for group in ENDPOINT_GROUPS}
+    stats.update(errors=0, rate_limited=0)
+    stats_lock = threading.Lock()
+    seen_prefixes = set()
+
+    def simulate(group):
+        """Sleep for the configured latency, then maybe fail. Returns an error response or None."""
+        with stats_lock:
+            stats[group] += 1
+        if group in latency:
+            time.sleep(max(latency[group](), 0))
+        roll = random.random()
+        if roll < rate_limit_rate:
+            with stats_lock:
+                stats["rate_limited"] += 1
+            response = jsonify({"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}})
+            response.status_code = 429
+            response.headers["Retry-After"] = "1"
+            return response
+        if roll < rate_limit_rate + error_rate:
+            with stats_lock:
+                stats["errors"] += 1
+            response = jsonify({"error": {"message": "The server had an error (mock)", "type": "server_error"}})
+            response.status_code = 500
+            return response
+        return None
+
+    def cached_prefix_tokens(prompt_text, prompt_tokens):
+        """Tokens of the longest cacheable prefix seen before (4 characters a token, as in usage)"""
+        lengths = range(max(cache_min_tokens, 128), prompt_tokens + 1, 128)
+        hashes = [hash(prompt_text[:tokens * 4]) for tokens in lengths]
+        with stats_lock:
+            cached = max((tokens for tokens, h in zip(lengths, hashes) if h in seen_prefixes), default=0)
+            seen_prefixes.update(hashes)
+        return cached
+
+    def usage(prompt_text, completion_text):
+        prompt_tokens = max(len(prompt_text) // 4, 1)
+        completion_tokens = max(len(completion_text) // 4, 1)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_prefix_tokens(prompt_text, prompt_tokens)},
+        }
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        error = simulate("chat")
+        if error:
+            return error
+
+        body = request.get_json(force=True)
+        prompt_text = json.dumps(body.get("messages", []))
+
+        if "image_prompt" in prompt_text:
+            content = json.dumps({
+                "name": random.choice(["Mossling", "Blorpy", "Quillet", "Pip", "Zorby"]),
+                "image_prompt": "40x40 pixel art sprite of a round mossy baby creature with tiny leaf ears",
+            })
+        elif "descriptors" in prompt_text and "image_url" in prompt_text:
+            content = json.dumps({
+                "description": "A speckled egg with soft green swirls and a warm golden glow.",
+                "descriptors": ["verdant", "whimsical", "glowing", "organic", "cozy"],
+            })
+        else:
+            content = "A high, soft, curious chirp that rises at the end like a question."
+
+        return jsonify({
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage(prompt_text, content),
+        })
+
+    @app.route("/v1/images/generations", methods=["POST"])
+    def images_generations():
+        error = simulate("images")
+        if error:
+            return error
+
+        body = request.get_json(force=True)
+        n = int(body.get("n", 1))
+        data = []
+        for _ in range(n):
+            if body.get("response_format") == "b64_json":
+                data.append({"b64_json": base64.b64encode(png).decode("ascii")})
+            else:
+                data.append({"url": f"{request.host_url}mock-images/{uuid.uuid4().hex}.png"})
+            data[-1]["revised_prompt"] = body.get("prompt", "")
+
+        return jsonify({"created": int(time.time()), "data": data})
+
+    @app.route("/v1/audio/speech", methods=["POST"])
+    def audio_speech():
+        error = simulate("speech")
+        if error:
+            return error
+        return Response(MOCK_MP3, mimetype="audio/mpeg")
+
+    @app.route("/v1/models", methods=["GET"])
+    def models():
+        error = simulate("models")
+        if error:
+            return error
+        return jsonify({
+            "object": "list",
+            "data": [{"id": model, "object": "model", "owned_by": "mock"} for model in ("gpt-4o", "dall-e-3", "tts-1")],
+        })
+
+    @app.route("/mock-images/<name>", methods=["GET"])
+    def mock_image(name):
+        error = simulate("download")
+        if error:
+            return error
+        return Response(png, mimetype="image/png")
+
+    @app.route("/mock/stats", methods=["GET"])
+    def mock_stats():
+        with stats_lock:
+            return jsonify(dict(stats))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline mock of the OpenAI endpoints Hatch uses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", action="append", default=[], metavar="GROUP=SPEC",
+                        help=f"latency per endpoint group ({', '.join(ENDPOINT_GROUPS)}), e.g. images=lognormal:12:0.3")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--image-size", type=int, default=256, help="edge length of the served PNG")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="shortest prompt prefix reported as cached when repeated (OpenAI: 1024)")
+    args = parser.parse_args()
+
+    latency = {}
+    for item in args.latency:
+        group, _, spec = item.partition("=")
+        if group not in ENDPOINT_GROUPS:
+            parser.error(f"unknown endpoint group: {group}")
+        latency[group] = parse_latency(spec)
+
+    app = create_mock_app(latency, args.error_rate, args.rate_limit_rate, args.image_size, args.cache_min_tokens)
+    print(f"Mock OpenAI listening on http://{args.host}:{args.port}/v1")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
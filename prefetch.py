@@ -0,0 +1,121 @@
+"""
+Speculative Hatch Prefetch for the Hatch Application
+
+While the user is typing their answer to the care question, everything in the
+hatch pipeline that doesn't depend on that answer can already run: looking up
+and validating the egg, generating the TTS clip for the pre-selected phonetic
+sound, warming the API connection and (optionally) drafting a creature concept
+from the egg's descriptors.
+
+USAGE:
+- When the care question is issued:
+  prefetcher.start(egg_id, {"egg": lookup, "sound": make_sound}, cleanup=on_abandon)
+
+- When the answer arrives at /api/hatch-creature:
+  prefetched = prefetcher.claim(egg_id)   # {"egg": ..., "sound": ...}; failed tasks are left out
+
+- If the user abandons the questionnaire (or never comes back before the TTL):
+  prefetcher.cancel(egg_id)   # cancels queued work and runs cleanup on finished results
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class HatchPrefetcher:
+    def __init__(self, max_workers=4, ttl_seconds=600, claim_timeout=30):
+        self.ttl_seconds = ttl_seconds
+        self.claim_timeout = claim_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hatch-prefetch")
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.metrics = {"started": 0, "claimed": 0, "cancelled": 0, "expired": 0, "task_errors": 0}
+
+    def start(self, egg_id, tasks, cleanup=None):
+        """
+        Begin prefetching for an egg, replacing (and cancelling) any earlier prefetch for it.
+        tasks maps a stage name to a zero-argument callable; cleanup(results) is called
+        with the finished results if the prefetch is cancelled or expires unclaimed.
+        """
+        self._expire()
+        self.cancel(egg_id)
+
+        # Run each stage in a copy of the caller's context so the request id follows it into the logs
+        futures = {name: self._executor.submit(contextvars.copy_context().run, task) for name, task in tasks.items()}
+        with self._lock:
+            self._pending[egg_id] = {
+                "created_at": time.time(),
+                "futures": futures,
+                "cleanup": cleanup,
+            }
+            self.metrics["started"] += 1
+
+    def claim(self, egg_id):
+        """
+        Take the prefetched results for an egg, waiting for stages still in flight.
+        Returns {stage: result} for the stages that succeeded (empty if nothing was prefetched).
+        """
+        with self._lock:
+            entry = self._pending.pop(egg_id, None)
+        if entry is None:
+            return {}
+
+        results = {}
+        deadline = time.time() + self.claim_timeout
+        for name, future in entry["futures"].items():
+            try:
+                results[name] = future.result(timeout=max(deadline - time.time(), 0))
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning(f"Prefetch stage '{name}' for egg {egg_id} timed out")
+            except Exception as e:
+                self.metrics["task_errors"] += 1
+                logger.warning(f"Prefetch stage '{name}' for egg {egg_id} failed: {e}")
+
+        self.metrics["claimed"] += 1
+        return results
+
+    def cancel(self, egg_id):
+        """Abandon a prefetch: cancel queued stages and clean up finished ones"""
+        with self._lock:
+            entry = self._pending.pop(egg_id, None)
+        if entry is None:
+            return False
+        self._discard(egg_id, entry)
+        self.metrics["cancelled"] += 1
+        return True
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [(egg_id, entry) for egg_id, entry in self._pending.items()
+                       if now - entry["created_at"] > self.ttl_seconds]
+            for egg_id, _ in expired:
+                del self._pending[egg_id]
+        for egg_id, entry in expired:
+            self._discard(egg_id, entry)
+            self.metrics["expired"] += 1
+
+    def _discard(self, egg_id, entry):
+        for name, future in entry["futures"].items():
+            if future.cancel():
+                continue
+            # Already running: clean up whenever it finishes
+            future.add_done_callback(lambda f, name=name: self._cleanup_one(egg_id, entry, name, f))
+
+    def _cleanup_one(self, egg_id, entry, name, future):
+        if entry["cleanup"] is None or future.cancelled() or future.exception() is not None:
+            return
+        try:
+            entry["cleanup"]({name: future.result()})
+        except Exception as e:
+            logger.error(f"Prefetch cleanup for egg {egg_id} failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {**self.metrics, "pending": len(self._pending)}
@@ -0,0 +1,262 @@
+"""
+On-demand Request Profiling for the Hatch Application
+
+Profiles individual requests to show whether a slow hatch is spending its time
+in Python (JSON rewriting, base64, logging) or waiting on the network.
+
+A request is profiled when it carries the admin header
+    X-Hatch-Profile: <PROFILING_TOKEN>
+or is picked by PROFILING_SAMPLE_RATE. When PROFILING_ENABLED is off the hooks
+are never registered, so unprofiled deployments pay nothing.
+
+MODES:
+- sampling (default): a background thread samples the request thread's stack
+  every few ms. Wall-clock, so time blocked on sockets shows up as frames in
+  the HTTP client. Writes <id>.collapsed (flamegraph.pl / speedscope input)
+  and a self-contained <id>.svg flamegraph.
+- cprofile: deterministic cProfile of the request thread. Writes <id>.prof
+  (pstats / snakeviz) and a <id>.txt summary of the top functions.
+
+Every profile also writes <id>.json with the route, status, duration and a
+wall-clock timeline of the EggCreator stages that ran during the request.
+Only the newest PROFILING_MAX_PROFILES profiles are kept.
+"""
+
+import cProfile
+import html
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+_active = threading.local()
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.join(*code.co_filename.split(os.sep)[-2:])
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items()))
+
+
+def render_flamegraph(counts, title="", width=1200, row_height=16):
+    """Minimal SVG flamegraph (root at the bottom) from {collapsed stack: count}"""
+    root = {"name": "all", "value": 0, "children": {}}
+    for stack, count in counts.items():
+        node = root
+        node["value"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"name": name, "value": 0, "children": {}})
+            node["value"] += count
+
+    total = root["value"] or 1
+    rects = []
+    depth_max = 0
+
+    def layout(node, x, depth):
+        nonlocal depth_max
+        depth_max = max(depth_max, depth)
+        w = node["value"] / total * width
+        if w >= 0.5:
+            rects.append((x, depth, w, node))
+        child_x = x
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            layout(child, child_x, depth + 1)
+            child_x += child["value"] / total * width
+
+    layout(root, 0.0, 0)
+    height = (depth_max + 1) * row_height + 30
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="14">{html.escape(title)}</text>',
+    ]
+    for x, depth, w, node in rects:
+        y = height - (depth + 1) * row_height
+        hue = 10 + (zlib.crc32(node["name"].encode()) % 40)
+        pct = node["value"] / total * 100
+        label = html.escape(node["name"])
+        parts.append(
+            f'<g><title>{label} ({node["value"]} samples, {pct:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},85%,60%)"/>'
+        )
+        max_chars = int(w / 7)
+        if max_chars >= 4:
+            text = label if len(node["name"]) <= max_chars else html.escape(node["name"][:max_chars - 2]) + ".."
+            parts.append(f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{text}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+
+class ProfileSession:
+    """One profiled request"""
+
+    def __init__(self, profile_id, mode, interval):
+        self.id = profile_id
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.timeline = []
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = StackSampler(threading.get_ident(), interval)
+            self._profiler.start()
+
+    def add_stage(self, labels, stage, start, end):
+        self.timeline.append({
+            **labels,
+            "stage": stage,
+            "start_ms": round((start - self.started) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+        })
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        return (time.perf_counter() - self.started) * 1000
+
+
+class RequestProfiler:
+    def __init__(self, directory, token=None, sample_rate=0.0, mode="sampling",
+                 interval_ms=5, max_profiles=50, header="X-Hatch-Profile"):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.interval = interval_ms / 1000
+        self.max_profiles = max_profiles
+        self.header = header
+        os.makedirs(directory, exist_ok=True)
+
+    def should_profile(self, headers):
+        if self.token and headers.get(self.header) == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """Begin profiling the current thread's request"""
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        session = ProfileSession(profile_id, self.mode, self.interval)
+        _active.session = session
+        return session
+
+    def finish(self, session, meta):
+        """Stop profiling and write the profile files; returns the profile id"""
+        _active.session = None
+        duration_ms = session.stop()
+        base = os.path.join(self.directory, session.id)
+        title = f"{meta.get('method', '')} {meta.get('route', '')} {duration_ms:.0f} ms"
+
+        try:
+            if session.mode == "cprofile":
+                session._profiler.dump_stats(f"{base}.prof")
+                summary = io.StringIO()
+                pstats.Stats(session._profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+                with open(f"{base}.txt", 'w') as f:
+                    f.write(summary.getvalue())
+                samples = None
+            else:
+                sampler = session._profiler
+                with open(f"{base}.collapsed", 'w') as f:
+                    f.write(sampler.collapsed())
+                with open(f"{base}.svg", 'w') as f:
+                    f.write(render_flamegraph(sampler.counts, title=title))
+                samples = sampler.samples
+
+            with open(f"{base}.json", 'w') as f:
+                json.dump({
+                    "id": session.id,
+                    "mode": session.mode,
+                    "started_at": session.started_at,
+                    "duration_ms": round(duration_ms, 2),
+                    "samples": samples,
+                    "stages": session.timeline,
+                    **meta,
+                }, f, indent=2)
+        except Exception as e:
+            logger.error(f"Error writing profile {session.id}: {e}")
+
+        self._trim()
+        return session.id
+
+    def _trim(self):
+        """Ring buffer: delete the oldest profiles beyond max_profiles"""
+        try:
+            ids = sorted({name.split(".")[0] for name in os.listdir(self.directory) if not name.startswith(".")})
+        except OSError:
+            return
+        for old_id in ids[:max(len(ids) - self.max_profiles, 0)]:
+            for name in os.listdir(self.directory):
+                if name.split(".")[0] == old_id:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def list_profiles(self):
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        names = os.listdir(self.directory)
+        for name in sorted(names, reverse=True):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta.pop("stages", None)
+            meta["files"] = sorted(n for n in names if n.split(".")[0] == meta["id"])
+            profiles.append(meta)
+        return profiles
+
+
+def record_stage(labels, stage, start, end):
+    """Stage listener: add a stage to the current thread's profile, if it is being profiled"""
+    session = getattr(_active, "session", None)
+    if session is not None:
+        session.add_stage(labels, stage, start, end)
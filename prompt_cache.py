@@ -0,0 +1,214 @@
+"""
+Prompt Cache for the Hatch Application
+
+An opt-in cache in front of egg image generation. Near-identical egg requests
+reuse a previously generated image instead of paying for another DALL-E call.
+
+Two keys are checked, in order:
+1. Exact: a hash of the fully rendered egg creation prompt
+2. Fingerprint (optional): the sorted, lowercased descriptors must match exactly
+   and the description's word shingles must overlap by at least the configured
+   Jaccard similarity
+
+Entries older than the freshness window are ignored and pruned. The cache is
+persisted to a small JSON file so it survives restarts and is shared (by
+mtime-based reloads) between gunicorn workers. Writers hold a file lock and
+re-read the file under it, so one worker's write never drops another's entries.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from search_index import normalize_descriptor
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_key(prompt):
+    """Hash of the exact rendered prompt text"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def descriptor_key(descriptors):
+    """Sorted, lowercased, de-duplicated descriptors joined into one key"""
+    normalized = {normalize_descriptor(d) for d in descriptors}
+    normalized.discard("")
+    return "|".join(sorted(normalized))
+
+
+def description_shingles(description, size=3):
+    """Set of overlapping `size`-word shingles from a lowercased description"""
+    words = re.findall(r"[a-z0-9]+", (description or "").lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class PromptCache:
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, use_fingerprint=True,
+                 similarity_threshold=0.8, shingle_size=3):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.use_fingerprint = use_fingerprint
+        self.similarity_threshold = similarity_threshold
+        self.shingle_size = shingle_size
+
+        self._lock = threading.Lock()
+        self._lock_path = f"{path}.lock"
+        self._entries = {}
+        self._mtime = None
+        self.metrics = {
+            "exact_hits": 0,
+            "fingerprint_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "expired": 0,
+        }
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self._entries = json.load(f)
+            self._mtime = os.path.getmtime(self.path)
+        except Exception as e:
+            logger.error(f"Error loading prompt cache: {e}")
+            self._entries = {}
+
+    def _refresh(self):
+        """Reload if another worker has written the cache file since we read it"""
+        if os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+            self._load()
+
+    def _locked(self):
+        """Exclusive lock on the cache file, across workers"""
+        handle = open(self._lock_path, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _update(self, mutate):
+        """Apply mutate(entries) to the latest file contents and write them back"""
+        handle = self._locked()
+        try:
+            self._load()
+            if mutate(self._entries):
+                self._persist()
+        finally:
+            handle.close()
+
+    def _persist(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    def _is_fresh(self, entry, now):
+        return now - entry['created_at'] <= self.ttl_seconds
+
+    # ------------------------------------------------------------------
+    # Cache operations
+    # ------------------------------------------------------------------
+
+    def lookup(self, prompt, description, descriptors):
+        """
+        Return the cached entry for this egg request, or None.
+        The entry is a dict with `image_url` and `match` ("exact" or "fingerprint").
+        """
+        now = time.time()
+        with self._lock:
+            self._refresh()
+
+            entry = self._entries.get(prompt_key(prompt))
+            if entry and self._is_fresh(entry, now):
+                self.metrics["exact_hits"] += 1
+                return {**entry, "match": "exact"}
+
+            if self.use_fingerprint:
+                key = descriptor_key(descriptors)
+                shingles = description_shingles(description, self.shingle_size)
+                best, best_score = None, 0.0
+                for candidate in self._entries.values():
+                    if candidate['descriptor_key'] != key or not self._is_fresh(candidate, now):
+                        continue
+                    score = jaccard(shingles, set(candidate['shingles']))
+                    if score > best_score:
+                        best, best_score = candidate, score
+                if best and best_score >= self.similarity_threshold:
+                    self.metrics["fingerprint_hits"] += 1
+                    return {**best, "match": "fingerprint", "similarity": round(best_score, 3)}
+
+            self.metrics["misses"] += 1
+            return None
+
+    def record_bypass(self):
+        """Count a request that asked for a fresh image"""
+        with self._lock:
+            self.metrics["bypassed"] += 1
+
+    def store(self, prompt, description, descriptors, image_url):
+        """Remember the image generated for this prompt"""
+        now = time.time()
+        entry = {
+            "image_url": image_url,
+            "descriptor_key": descriptor_key(descriptors),
+            "shingles": sorted(description_shingles(description, self.shingle_size)),
+            "created_at": now,
+        }
+
+        def add(entries):
+            entries[prompt_key(prompt)] = entry
+            self._prune(now)
+            return True
+
+        with self._lock:
+            self._update(add)
+            self.metrics["stores"] += 1
+
+    def invalidate(self, image_url):
+        """Forget every entry that points at an image (e.g. the file is gone)"""
+        def drop(entries):
+            stale = [key for key, entry in entries.items() if entry['image_url'] == image_url]
+            for key in stale:
+                del entries[key]
+            return bool(stale)
+
+        with self._lock:
+            self._update(drop)
+
+    def _prune(self, now):
+        expired = [key for key, entry in self._entries.items() if not self._is_fresh(entry, now)]
+        for key in expired:
+            del self._entries[key]
+        self.metrics["expired"] += len(expired)
+
+    def stats(self):
+        with self._lock:
+            hits = self.metrics["exact_hits"] + self.metrics["fingerprint_hits"]
+            lookups = hits + self.metrics["misses"]
+            return {
+                **self.metrics,
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "ttl_seconds": self.ttl_seconds,
+                "fingerprint_enabled": self.use_fingerprint,
+            }
@@ -0,0 +1,268 @@
+"""
+Prompt Templates for the Hatch Application
+
+The prompts in ai_prompts.py used to be f-strings that put the variable content
+(description, descriptors, care context) ahead of the long instruction and
+style blocks. Providers cache prompts by exact prefix, so every call started
+differing from the previous one in its first lines and paid for the whole
+prompt again. A PromptTemplate keeps the two apart:
+
+- static: the instructions, identical on every call. It always comes first: the
+  system message of a chat call, or the start of an image prompt
+- dynamic: a format string with the per-call values. It is parsed once when the
+  template is defined, so rendering is a join
+- budget: the most tokens the dynamic part may take. Values are counted locally
+  (tiktoken when it is installed, otherwise an estimate) and the longest one is
+  cut until the rendered part fits, so a pasted essay can't blow up a call
+
+Each template also keeps the usage the API reported for its calls (prompt and
+cached tokens, latency of calls with and without a cache hit), so the cached
+token ratio and the latency difference can be read per template. OpenAI only
+caches prompts whose shared prefix is at least 1024 tokens: stats() reports
+the static prefix size and whether it qualifies.
+
+USAGE:
+  TEMPLATE = PromptTemplate("voice_description", static=INSTRUCTIONS,
+                            dynamic="EGG TRAITS: {descriptors_text}", budget=300, operation="chat.voice")
+  TEMPLATE.render(descriptors_text="mossy, calm")          # one string, static part first
+  TEMPLATE.messages(descriptors_text="mossy, calm")        # [system: static, user: dynamic]
+  observe_usage("chat.voice", prompt_tokens, cached_tokens, seconds)
+"""
+
+import logging
+import math
+import re
+import string
+import textwrap
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The shortest prefix OpenAI's prompt caching applies to
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+# name -> PromptTemplate, in definition order
+TEMPLATES = {}
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def _estimate_tokens(text):
+    """Roughly what a BPE tokenizer makes of English: a token per short word or symbol, one per ~4 letters beyond"""
+    return sum(1 if len(word) <= 4 else math.ceil(len(word) / 4) for word in _WORD.findall(text))
+
+
+def _load_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    import tiktoken
+
+                    _tokenizer = tiktoken.get_encoding("o200k_base")  # gpt-4o's encoding
+                except Exception as e:
+                    # Not installed, or its encoding file can't be fetched (offline)
+                    logger.info(f"tiktoken unavailable ({e}), estimating prompt tokens")
+                    _tokenizer = False
+    return _tokenizer
+
+
+def count_tokens(text):
+    """Tokens in text (exact with tiktoken, estimated without)"""
+    if not text:
+        return 0
+    tokenizer = _load_tokenizer()
+    return len(tokenizer.encode(text)) if tokenizer else _estimate_tokens(text)
+
+
+def truncate_tokens(text, max_tokens):
+    """text cut to at most max_tokens (an ellipsis marks the cut)"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    tokenizer = _load_tokenizer()
+    if tokenizer:
+        return tokenizer.decode(tokenizer.encode(text)[:max_tokens - 1]).rstrip() + "…"
+    words = _WORD.finditer(text)
+    end, used = 0, 0
+    for match in words:
+        word = match.group()
+        used += 1 if len(word) <= 4 else math.ceil(len(word) / 4)
+        if used > max_tokens - 1:
+            break
+        end = match.end()
+    return text[:end].rstrip() + "…"
+
+
+def _clean(text):
+    return textwrap.dedent(text).strip()
+
+
+class PromptTemplate:
+    def __init__(self, name, static, dynamic="", budget=None, operation=None):
+        """
+        budget: most tokens for the rendered dynamic part (None: no limit).
+        operation: the _call_openai operation using this template, to attribute API usage to it.
+        """
+        self.name = name
+        self.static = _clean(static)
+        self.dynamic = _clean(dynamic)
+        self.budget = budget
+        self.operation = operation
+
+        # Precompiled: literal text and field names alternate, so render is a join
+        self._parts = []
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(self.dynamic):
+            if spec or conversion:
+                raise ValueError(f"Template {name}: only plain {{field}} placeholders are supported")
+            self._parts.append(literal)
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError(f"Template {name}: bad placeholder {{{field}}}")
+                self._parts.append(field)
+                self.fields.append(field)
+        self._literal_tokens = None
+        self._static_tokens = None
+
+        self._lock = threading.Lock()
+        self.metrics = {"renders": 0, "truncated": 0, "dynamic_tokens": 0, "max_dynamic_tokens": 0,
+                        "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_hits": 0,
+                        "seconds_cached": 0.0, "seconds_uncached": 0.0}
+        TEMPLATES[name] = self
+
+    @property
+    def static_tokens(self):
+        if self._static_tokens is None:
+            self._static_tokens = count_tokens(self.static)
+        return self._static_tokens
+
+    # ------------------------------------------------------------------
+    # Rendering
+    # ------------------------------------------------------------------
+
+    def _join(self, values):
+        # Fields sit at the odd positions of _parts
+        return "".join(part if i % 2 == 0 else values[part] for i, part in enumerate(self._parts))
+
+    def render_dynamic(self, **values):
+        """The per-call part, with values cut to fit the budget"""
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise KeyError(f"Template {self.name} needs: {', '.join(missing)}")
+        values = {field: str(values[field]) for field in self.fields}
+
+        truncated = False
+        if self.budget is not None and values:
+            if self._literal_tokens is None:
+                self._literal_tokens = count_tokens("".join(self._parts[0::2]))
+            sizes = {field: count_tokens(value) for field, value in values.items()}
+            excess = self._literal_tokens + sum(sizes.values()) - self.budget
+            while excess > 0:
+                # Cut the longest value first: short ones (the descriptors) carry the most per token
+                field = max(sizes, key=sizes.get)
+                if sizes[field] == 0:
+                    break
+                keep = max(sizes[field] - excess, 0)
+                values[field] = truncate_tokens(values[field], keep)
+                excess -= sizes[field] - count_tokens(values[field])
+                sizes[field] = count_tokens(values[field])
+                truncated = True
+
+        text = self._join(values)
+        tokens = count_tokens(text)
+        with self._lock:
+            self.metrics["renders"] += 1
+            self.metrics["dynamic_tokens"] += tokens
+            self.metrics["max_dynamic_tokens"] = max(self.metrics["max_dynamic_tokens"], tokens)
+            if truncated:
+                self.metrics["truncated"] += 1
+        if truncated:
+            logger.warning(f"Prompt {self.name} over its {self.budget}-token budget, values truncated",
+                           extra={"template": self.name, "budget": self.budget, "tokens": tokens})
+        return text
+
+    def render(self, **values):
+        """One prompt string (image generation): the static part, then the per-call part"""
+        if not self.fields:
+            return self.static
+        return f"{self.static}\n\n{self.render_dynamic(**values)}"
+
+    def messages(self, **values):
+        """Chat messages: the static part as the system message, the per-call part as the user message"""
+        return [
+            {"role": "system", "content": self.static},
+            {"role": "user", "content": self.render_dynamic(**values)}
+        ]
+
+    # ------------------------------------------------------------------
+    # API usage
+    # ------------------------------------------------------------------
+
+    def observe(self, prompt_tokens, cached_tokens, seconds):
+        with self._lock:
+            self.metrics["calls"] += 1
+            self.metrics["prompt_tokens"] += prompt_tokens
+            self.metrics["cached_tokens"] += cached_tokens
+            if cached_tokens:
+                self.metrics["cache_hits"] += 1
+                self.metrics["seconds_cached"] += seconds
+            else:
+                self.metrics["seconds_uncached"] += seconds
+
+    def stats(self):
+        with self._lock:
+            m = dict(self.metrics)
+        misses = m["calls"] - m["cache_hits"]
+        return {
+            "operation": self.operation,
+            "static_tokens": self.static_tokens,
+            "cacheable": self.static_tokens >= MIN_CACHEABLE_PREFIX_TOKENS,
+            "budget": self.budget,
+            "renders": m["renders"],
+            "truncated": m["truncated"],
+            "mean_dynamic_tokens": round(m["dynamic_tokens"] / m["renders"], 1) if m["renders"] else None,
+            "max_dynamic_tokens": m["max_dynamic_tokens"],
+            "calls": m["calls"],
+            "prompt_tokens": m["prompt_tokens"],
+            "cached_tokens": m["cached_tokens"],
+            "cached_ratio": round(m["cached_tokens"] / m["prompt_tokens"], 4) if m["prompt_tokens"] else None,
+            "cache_hit_calls": m["cache_hits"],
+            "mean_seconds_cached": round(m["seconds_cached"] / m["cache_hits"], 3) if m["cache_hits"] else None,
+            "mean_seconds_uncached": round(m["seconds_uncached"] / misses, 3) if misses else None,
+        }
+
+
+def observe_usage(operation, prompt_tokens, cached_tokens, seconds):
+    """Attribute one API call's reported usage to the template(s) behind the operation"""
+    for template in TEMPLATES.values():
+        if template.operation == operation:
+            template.observe(prompt_tokens, cached_tokens, seconds)
+
+
+def parse_budgets(spec):
+    """'egg_image=600,voice_description=200' -> {name: tokens}"""
+    budgets = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, tokens = item.partition("=")
+        budgets[name.strip()] = int(tokens)
+    return budgets
+
+
+def configure_budgets(budgets):
+    """Override template budgets by name (0 removes a budget)"""
+    for name, tokens in budgets.items():
+        if name not in TEMPLATES:
+            logger.warning(f"PROMPT_TOKEN_BUDGETS names an unknown template: {name}")
+            continue
+        TEMPLATES[name].budget = tokens or None
+
+
+def stats():
+    return {name: template.stats() for name, template in TEMPLATES.items()}
@@ -0,0 +1,210 @@
+"""
+Crash-safe Record Storage for the Hatch Application
+
+eggs_data.json and creatures_data.json used to be rewritten in place with
+open(..., 'w'): a crash mid-dump left a truncated collection, and two requests
+(or two gunicorn workers) saving at once lost one of the writes. Writes now go
+through a RecordStore per file:
+
+- Group commit: mutations from concurrent requests queue up; one thread (the
+  first to arrive) commits everything queued in one go while the others wait,
+  so a burst of N saves costs one rewrite and one fsync, not N
+- Each commit re-reads the file under an exclusive file lock, so writes from
+  other gunicorn workers are never overwritten
+- The new collection is written to a temp file, fsynced and renamed over the
+  old one (then the directory is fsynced): readers and crashes only ever see
+  the previous or the new file, never a partial one
+- The last committed collection is kept in memory and only re-read when the
+  file changed underneath (another worker committed), so a commit in a single
+  process costs one serialisation and one write
+- The file holds one compact record per line instead of json.dump(indent=2):
+  indenting forces the pure-Python encoder, which made serialising a
+  thousand-record file cost ~20 ms per write; it is still a plain JSON array
+- Readers (_load_records) need no lock
+
+USAGE:
+  store = RecordStore("eggs_data.json", on_commit=...)
+  store.append(egg_data)                              # returns once it is on disk
+  egg = store.update(egg_id, status="hatched")        # the updated record, or None
+  store.commit(lambda records: records.sort(...))     # any in-place mutation
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+_encode = json.JSONEncoder().encode
+
+
+class _Pending:
+    __slots__ = ("mutation", "done", "result", "error")
+
+    def __init__(self, mutation):
+        self.mutation = mutation
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class RecordStore:
+    def __init__(self, path, fsync=True, commit_window=0.0, on_commit=None):
+        """
+        commit_window: seconds the committing thread waits for more writes before
+        it starts a batch (0 batches whatever queued up during the previous commit).
+        on_commit(batch_size, seconds, size_bytes) is called after every commit.
+        """
+        self.path = path
+        self.fsync = fsync
+        self.commit_window = commit_window
+        self.on_commit = on_commit
+
+        self._lock_path = f"{path}.lock"
+        self._cond = threading.Condition()
+        self._pending = []
+        self._committing = False
+        self._records = None
+        self._signature = None  # (inode, mtime, size) of the file _records was read from / written to
+        self.metrics = {"mutations": 0, "commits": 0, "errors": 0, "max_batch": 0}
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+
+    def append(self, record):
+        self.commit(lambda records: records.append(record))
+
+    def update(self, record_id, **fields):
+        """Set fields on the record with this id; returns the updated record (None if there is none)"""
+        def apply(records):
+            for record in records:
+                if record.get('id') == record_id:
+                    record.update(fields)
+                    return dict(record)
+            return None
+        return self.commit(apply)
+
+    def commit(self, mutation):
+        """
+        Apply mutation(records) as part of the next group commit and wait until it
+        is on disk. Returns the mutation's return value; raises if the commit failed.
+        """
+        pending = _Pending(mutation)
+        with self._cond:
+            self._pending.append(pending)
+            while self._committing and not pending.done:
+                self._cond.wait()
+            if pending.done:
+                return self._outcome(pending)
+            # Nobody is committing: this thread commits batches until the queue is empty
+            self._committing = True
+
+        try:
+            if self.commit_window:
+                time.sleep(self.commit_window)
+            while True:
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                if not batch:
+                    break
+                self._commit_batch(batch)
+                with self._cond:
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._committing = False
+                # Anything queued after the last batch was taken is picked up by its own thread
+                self._cond.notify_all()
+        return self._outcome(pending)
+
+    def _outcome(self, pending):
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    # ------------------------------------------------------------------
+    # Commit
+    # ------------------------------------------------------------------
+
+    def _commit_batch(self, batch):
+        start = time.perf_counter()
+        size = 0
+        try:
+            with open(self._lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                records = self._read()
+                for pending in batch:
+                    try:
+                        pending.result = pending.mutation(records)
+                    except Exception as e:
+                        pending.error = e
+                size = self._write(records)
+                self._records = records
+        except Exception as e:
+            # The cached collection may hold mutations that never reached the disk
+            self._records = self._signature = None
+            self.metrics["errors"] += 1
+            for pending in batch:
+                if pending.error is None:
+                    pending.error = e
+        finally:
+            with self._cond:
+                for pending in batch:
+                    pending.done = True
+
+        self.metrics["mutations"] += len(batch)
+        self.metrics["commits"] += 1
+        self.metrics["max_batch"] = max(self.metrics["max_batch"], len(batch))
+        if self.on_commit:
+            self.on_commit(len(batch), time.perf_counter() - start, size)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read(self):
+        signature = self._stat()
+        if signature is None:
+            return []
+        if self._records is not None and signature == self._signature:
+            return self._records
+        with open(self.path, 'r') as f:
+            records = json.load(f)
+        self._records, self._signature = records, signature
+        return records
+
+    def _write(self, records):
+        """Write to a temp file, fsync it and rename it over the collection"""
+        data = ("[\n" + ",\n".join(map(_encode, records)) + "\n]\n").encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = os.path.join(directory, f".{os.path.basename(self.path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._signature = self._stat()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if self.fsync:
+            # Make the rename itself durable
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return len(data)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats["mean_batch"] = round(stats["mutations"] / stats["commits"], 2) if stats["commits"] else None
+        return stats
@@ -0,0 +1,284 @@
+"""
+Fair Scheduling for Generation Work in the Hatch Application
+
+Egg creation, image analysis and hatching each hold a worker thread (or task)
+for many seconds of OpenAI calls. Without a scheduler, one user bulk-creating
+eggs takes every thread and everyone else's hatches queue behind them. Before
+an EggCreator call, the route takes a slot from the process's FairScheduler:
+
+- A fixed number of slots (SCHEDULER_SLOTS) runs at once; the rest wait
+- Two priority lanes: "interactive" (single create, analyze, hatch) and
+  "batch" (bulk creation, the kiosk pool filler, backfills). Batch work never
+  holds more than SCHEDULER_BATCH_SLOTS slots, and when both lanes are waiting
+  interactive work gets SCHEDULER_INTERACTIVE_WEIGHT grants for each batch one
+- Inside a lane, waiting work is served round-robin by session (the Flask
+  session's usage id), so a session with fifty queued eggs gets one turn like
+  a session with one hatch
+- A session can have at most SCHEDULER_MAX_QUEUED_PER_SESSION items waiting
+  in a lane (QueueFull, answered with 429), and nothing waits longer than
+  SCHEDULER_MAX_WAIT_SECONDS (QueueTimeout, answered with 503)
+
+Each gunicorn worker schedules its own slots. Waiting threads block on an
+event; waiting asyncio tasks (app_async.py) await a future, so one scheduler
+serves both halves of the ASGI mode.
+
+USAGE:
+  scheduler = FairScheduler(slots=8, batch_slots=4, on_wait=..., on_depth=...)
+  with scheduler.slot(session_id, lane="interactive"):
+      creator.create_creature_from_egg(...)
+
+  async with scheduler.async_slot(session_id, lane="batch"):
+      await creator.create_egg_from_metadata(...)
+
+  scheduler.stats()   # per lane: waiting, running, sessions, granted, wait p50/p95
+"""
+
+import collections
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+LANES = ("interactive", "batch")
+
+
+class QueueFull(Exception):
+    """The session already has too much work waiting in this lane"""
+
+
+class QueueTimeout(Exception):
+    """No slot became free within the maximum wait"""
+
+
+class _Ticket:
+    __slots__ = ("session", "lane", "enqueued", "granted", "_event", "_loop", "_future")
+
+    def __init__(self, session, lane):
+        self.session = session
+        self.lane = lane
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self._event = None
+        self._loop = None
+        self._future = None
+
+    def grant(self):
+        """Called under the scheduler lock, from whichever thread released a slot"""
+        self.granted = True
+        if self._event is not None:
+            self._event.set()
+        elif self._future is not None:
+            self._loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class _Lane:
+    def __init__(self):
+        self.queues = collections.OrderedDict()  # session -> deque of tickets, in round-robin order
+        self.waiting = 0
+        self.running = 0
+        self.granted = 0
+        self.waits = collections.deque(maxlen=1000)
+
+    def push(self, ticket):
+        self.queues.setdefault(ticket.session, collections.deque()).append(ticket)
+        self.waiting += 1
+
+    def pop(self):
+        """Head of the next session's queue; the session goes to the back of the round"""
+        session, tickets = next(iter(self.queues.items()))
+        ticket = tickets.popleft()
+        del self.queues[session]
+        if tickets:
+            self.queues[session] = tickets
+        self.waiting -= 1
+        return ticket
+
+    def remove(self, ticket):
+        tickets = self.queues.get(ticket.session)
+        if tickets is None or ticket not in tickets:
+            return False
+        tickets.remove(ticket)
+        if not tickets:
+            del self.queues[ticket.session]
+        self.waiting -= 1
+        return True
+
+    def queued_for(self, session):
+        return len(self.queues.get(session, ()))
+
+
+class FairScheduler:
+    def __init__(self, slots=8, batch_slots=4, interactive_weight=4, max_queued_per_session=4,
+                 max_wait_seconds=120.0, on_wait=None, on_depth=None):
+        """
+        on_wait(lane, seconds) is called for every grant (including immediate ones) and
+        on_depth(lane, waiting, running) whenever a lane's counts change, both under the
+        scheduler lock so gauges never go stale; they must not call back into the scheduler.
+        """
+        self.slots = max(1, slots)
+        self.batch_slots = max(1, min(batch_slots, self.slots))
+        self.interactive_weight = max(1, interactive_weight)
+        self.max_queued_per_session = max_queued_per_session
+        self.max_wait_seconds = max_wait_seconds
+        self.on_wait = on_wait
+        self.on_depth = on_depth
+
+        self._lock = threading.Lock()
+        self._lanes = {lane: _Lane() for lane in LANES}
+        self._running = 0
+        self._interactive_streak = 0
+
+    # ------------------------------------------------------------------
+    # Granting (called under the lock)
+    # ------------------------------------------------------------------
+
+    def _can_run(self, lane):
+        if self._running >= self.slots:
+            return False
+        return lane != "batch" or self._lanes["batch"].running < self.batch_slots
+
+    def _next_lane(self):
+        interactive = self._lanes["interactive"].waiting and self._can_run("interactive")
+        batch = self._lanes["batch"].waiting and self._can_run("batch")
+        if interactive and batch:
+            return "batch" if self._interactive_streak >= self.interactive_weight else "interactive"
+        if interactive:
+            return "interactive"
+        return "batch" if batch else None
+
+    def _start(self, ticket):
+        lane = self._lanes[ticket.lane]
+        lane.running += 1
+        lane.granted += 1
+        self._running += 1
+        self._interactive_streak = self._interactive_streak + 1 if ticket.lane == "interactive" else 0
+        waited = time.perf_counter() - ticket.enqueued
+        lane.waits.append(waited)
+        ticket.grant()
+        if self.on_wait:
+            self.on_wait(ticket.lane, waited)
+
+    def _dispatch(self):
+        """Grant slots to waiting work while any are free"""
+        lane = self._next_lane()
+        while lane is not None:
+            self._start(self._lanes[lane].pop())
+            lane = self._next_lane()
+        self._report()
+
+    def _report(self, *lanes):
+        if self.on_depth:
+            for name in lanes or LANES:
+                self.on_depth(name, self._lanes[name].waiting, self._lanes[name].running)
+
+    # ------------------------------------------------------------------
+    # Acquire / release
+    # ------------------------------------------------------------------
+
+    def _enqueue(self, session, lane, ticket_setup):
+        """Queue a ticket (granted at once if a slot is free)"""
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        ticket = _Ticket(session or "anonymous", lane)
+        ticket_setup(ticket)
+        with self._lock:
+            queue = self._lanes[lane]
+            if self.max_queued_per_session and queue.queued_for(ticket.session) >= self.max_queued_per_session:
+                raise QueueFull(f"Too many {lane} requests waiting for this session")
+            queue.push(ticket)
+            self._dispatch()
+        return ticket
+
+    def _abandon(self, ticket):
+        """The waiter gave up (timeout, cancellation); returns True if it had been granted meanwhile"""
+        with self._lock:
+            if ticket.granted:
+                return True
+            self._lanes[ticket.lane].remove(ticket)
+            self._report(ticket.lane)
+        return False
+
+    def release(self, ticket):
+        with self._lock:
+            self._lanes[ticket.lane].running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    def acquire(self, session, lane="interactive", timeout=None):
+        """Block until a slot is granted; returns the ticket to release"""
+        def setup(ticket):
+            ticket._event = threading.Event()
+
+        ticket = self._enqueue(session, lane, setup)
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        if not ticket._event.wait(timeout):
+            if not self._abandon(ticket):
+                raise QueueTimeout(f"No {lane} slot free within {timeout:.0f}s")
+        return ticket
+
+    async def acquire_async(self, session, lane="interactive", timeout=None):
+        """acquire() for asyncio tasks: waits on a future instead of blocking the event loop"""
+        import asyncio  # only the ASGI mode needs it; keeps it out of the sync workers' startup
+
+        loop = asyncio.get_running_loop()
+
+        def setup(ticket):
+            ticket._loop = loop
+            ticket._future = loop.create_future()
+
+        ticket = self._enqueue(session, lane, setup)
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._future), timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(ticket):
+                raise QueueTimeout(f"No {lane} slot free within {timeout:.0f}s")
+        except asyncio.CancelledError:
+            # Client went away while waiting; hand the slot on if it was granted meanwhile
+            if self._abandon(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    @contextmanager
+    def slot(self, session, lane="interactive", timeout=None):
+        ticket = self.acquire(session, lane, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def async_slot(self, session, lane="interactive", timeout=None):
+        ticket = await self.acquire_async(session, lane, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # ------------------------------------------------------------------
+    # Statistics
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            lanes = {}
+            for name, lane in self._lanes.items():
+                waits = sorted(lane.waits)
+                lanes[name] = {
+                    "waiting": lane.waiting,
+                    "running": lane.running,
+                    "sessions_waiting": len(lane.queues),
+                    "granted": lane.granted,
+                    "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    "wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else None,
+                }
+            return {
+                "slots": self.slots,
+                "batch_slots": self.batch_slots,
+                "running": self._running,
+                "lanes": lanes,
+            }
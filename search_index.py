@@ -0,0 +1,301 @@
+"""
+Descriptor Search Index for the Hatch Application
+
+Keeps an inverted index from normalized descriptor to egg and creature ids,
+plus an FTS5 full-text index over descriptions, in a small SQLite database.
+
+USAGE:
+- The index is updated incrementally by EggCreator every time a record is saved:
+  index.add_egg(egg_data) / index.add_creature(creature_data)
+
+- Query it with descriptors (AND/OR) and/or free text:
+  index.search(descriptors=["whimsical", "verdant"], q="vines", mode="and")
+
+- If the database is missing or out of sync with the JSON files it is rebuilt:
+  index.rebuild(eggs, creatures)
+"""
+
+import json
+import logging
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Every indexed record gets an integer rowid; the descriptor postings and the
+# FTS5 table are keyed on it so AND/OR queries are integer set operations.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    rid INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    status TEXT,
+    created_at TEXT,
+    UNIQUE (kind, id)
+);
+
+CREATE TABLE IF NOT EXISTS record_data (
+    rid INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS descriptor_counts (
+    descriptor TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS descriptors (
+    descriptor TEXT NOT NULL,
+    rid INTEGER NOT NULL,
+    PRIMARY KEY (descriptor, rid)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS descriptors_by_record ON descriptors (rid);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS descriptions USING fts5(body);
+"""
+
+RECORD_KINDS = ('egg', 'creature')
+
+
+def normalize_descriptor(descriptor):
+    """Lowercase a descriptor and collapse punctuation/whitespace ("Verdant!" -> "verdant")"""
+    words = re.findall(r"[a-z0-9]+", str(descriptor).lower())
+    return " ".join(words)
+
+
+def _fts_query(q):
+    """Turn free text into a safe FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r"\w+", q.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class SearchIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Scratch table for the current query's match set. It lives for the
+        # connection's lifetime so the query statements stay prepared.
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS matches (rid INTEGER PRIMARY KEY)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def add_egg(self, egg):
+        """Insert or replace an egg in the index"""
+        with self._lock, self._conn:
+            self._write('egg', egg)
+
+    def add_creature(self, creature):
+        """Insert or replace a creature in the index (searchable by its egg traits)"""
+        with self._lock, self._conn:
+            self._write('creature', creature)
+
+    def _write(self, kind, record):
+        record_id = record.get('id')
+        if not record_id:
+            return
+
+        if kind == 'egg':
+            descriptors = record.get('descriptors', [])
+            body = record.get('description', '')
+            created_at = record.get('created_at')
+        else:
+            descriptors = record.get('egg_traits', [])
+            body = " ".join(filter(None, [
+                record.get('name', ''),
+                record.get('egg_description', ''),
+                record.get('voice_description', ''),
+            ]))
+            created_at = record.get('hatched_at')
+
+        normalized = {normalize_descriptor(d) for d in descriptors}
+        normalized.discard("")
+
+        self._delete(kind, record_id)
+        rid = self._conn.execute(
+            "INSERT INTO records (kind, id, status, created_at) VALUES (?, ?, ?, ?)",
+            (kind, record_id, record.get('status'), created_at)
+        ).lastrowid
+        self._conn.execute("INSERT INTO record_data (rid, data) VALUES (?, ?)", (rid, json.dumps(record)))
+        self._conn.executemany(
+            "INSERT INTO descriptors (descriptor, rid) VALUES (?, ?)",
+            [(d, rid) for d in normalized]
+        )
+        self._conn.executemany(
+            "INSERT INTO descriptor_counts (descriptor, n) VALUES (?, 1) "
+            "ON CONFLICT (descriptor) DO UPDATE SET n = n + 1",
+            [(d,) for d in normalized]
+        )
+        self._conn.execute("INSERT INTO descriptions (rowid, body) VALUES (?, ?)", (rid, body))
+
+    def _delete(self, kind, record_id):
+        row = self._conn.execute(
+            "SELECT rid FROM records WHERE kind = ? AND id = ?", (kind, record_id)
+        ).fetchone()
+        if row is None:
+            return
+        rid = row[0]
+        self._conn.execute(
+            "UPDATE descriptor_counts SET n = n - 1 WHERE descriptor IN "
+            "(SELECT descriptor FROM descriptors WHERE rid = ?)",
+            (rid,)
+        )
+        self._conn.execute("DELETE FROM records WHERE rid = ?", (rid,))
+        self._conn.execute("DELETE FROM record_data WHERE rid = ?", (rid,))
+        self._conn.execute("DELETE FROM descriptors WHERE rid = ?", (rid,))
+        self._conn.execute("DELETE FROM descriptions WHERE rowid = ?", (rid,))
+
+    def remove(self, kind, record_id):
+        """Drop a record from the index"""
+        with self._lock, self._conn:
+            self._delete(kind, record_id)
+
+    def count(self):
+        """Number of indexed records"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def rebuild(self, eggs, creatures):
+        """Drop everything and re-index the given eggs and creatures in one transaction"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM record_data")
+            self._conn.execute("DELETE FROM descriptors")
+            self._conn.execute("DELETE FROM descriptor_counts")
+            self._conn.execute("DELETE FROM descriptions")
+            for egg in eggs:
+                self._write('egg', egg)
+            for creature in creatures:
+                self._write('creature', creature)
+        logger.info(f"Search index rebuilt with {len(eggs)} eggs and {len(creatures)} creatures")
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _rarest_first(self, descriptors):
+        """Order descriptors by posting-list length so AND queries start from the smallest"""
+        placeholders = ", ".join("?" for _ in descriptors)
+        counts = dict(self._conn.execute(
+            f"SELECT descriptor, n FROM descriptor_counts WHERE descriptor IN ({placeholders})",
+            descriptors
+        ).fetchall())
+        return sorted(descriptors, key=lambda d: counts.get(d, 0))
+
+    def _match_query(self, descriptors, fts, mode, kind):
+        """Build the SQL (and parameters) selecting the rids of every matching record"""
+        clauses = []
+        params = []
+
+        if descriptors and mode == "or":
+            placeholders = ", ".join("?" for _ in descriptors)
+            clauses.append(f"SELECT rid FROM descriptors WHERE descriptor IN ({placeholders})")
+            params.extend(descriptors)
+        elif descriptors:
+            # AND is a chain of primary-key probes: walk the rarest posting
+            # list and look each rid up in the others.
+            ordered = self._rarest_first(descriptors)
+            sql = "SELECT d0.rid FROM descriptors d0"
+            for i in range(1, len(ordered)):
+                sql += f" CROSS JOIN descriptors d{i} ON d{i}.descriptor = ? AND d{i}.rid = d0.rid"
+            clauses.append(sql + " WHERE d0.descriptor = ?")
+            params.extend(ordered[1:] + ordered[:1])
+
+        if fts:
+            clauses.append("SELECT rowid FROM descriptions WHERE descriptions MATCH ?")
+            params.append(fts)
+
+        if kind in RECORD_KINDS:
+            clauses.append("SELECT rid FROM records WHERE kind = ?")
+            params.append(kind)
+
+        if not clauses:
+            return "SELECT rid FROM records", params
+        return " INTERSECT ".join(clauses), params
+
+    def search(self, descriptors=None, q=None, mode="and", kind=None, limit=50, offset=0, facet_limit=20):
+        """
+        Find eggs and creatures by descriptor and/or full text.
+        mode="and" requires every descriptor, mode="or" requires any of them.
+        Returns matching records (newest first), a total count and descriptor facet counts.
+        """
+        descriptors = {normalize_descriptor(d) for d in (descriptors or [])}
+        descriptors.discard("")
+        descriptors = sorted(descriptors)
+        fts = _fts_query(q) if q else ""
+
+        # The match set is materialized once and then drives every other
+        # query (CROSS JOIN pins it as the outer loop), so the cost scales
+        # with the number of hits rather than the size of the collection.
+        # The scratch-table writes open a transaction; `with self._conn` ends
+        # it, so the connection doesn't keep an old WAL snapshot (hiding other
+        # workers' adds and blocking checkpoints) until its next write.
+        with self._lock, self._conn:
+            matches, params = self._match_query(descriptors, fts, mode, kind)
+            self._conn.execute("DELETE FROM temp.matches")
+            self._conn.execute(f"INSERT OR IGNORE INTO temp.matches {matches}", params)
+
+            total = self._conn.execute("SELECT COUNT(*) FROM temp.matches").fetchone()[0]
+
+            rows = self._conn.execute(
+                """
+                SELECT page.kind, d.data FROM (
+                    SELECT r.rid, r.kind, r.created_at FROM temp.matches m
+                    CROSS JOIN records r ON r.rid = m.rid
+                    ORDER BY r.created_at DESC
+                    LIMIT ? OFFSET ?
+                ) page
+                CROSS JOIN record_data d ON d.rid = page.rid
+                ORDER BY page.created_at DESC
+                """,
+                (limit, offset)
+            ).fetchall()
+
+            if descriptors or fts or kind in RECORD_KINDS:
+                facets = self._conn.execute(
+                    """
+                    SELECT d.descriptor, COUNT(*) AS n FROM temp.matches m
+                    CROSS JOIN descriptors d ON d.rid = m.rid
+                    GROUP BY d.descriptor
+                    ORDER BY n DESC, d.descriptor
+                    LIMIT ?
+                    """,
+                    (facet_limit,)
+                ).fetchall()
+            else:
+                # Unfiltered: the running totals are already the facets
+                facets = self._conn.execute(
+                    "SELECT descriptor, n FROM descriptor_counts WHERE n > 0 ORDER BY n DESC, descriptor LIMIT ?",
+                    (facet_limit,)
+                ).fetchall()
+
+            kinds = self._conn.execute(
+                "SELECT r.kind, COUNT(*) FROM temp.matches m CROSS JOIN records r ON r.rid = m.rid GROUP BY r.kind"
+            ).fetchall()
+
+            self._conn.execute("DELETE FROM temp.matches")
+
+        results = {"eggs": [], "creatures": []}
+        for record_kind, data in rows:
+            results["eggs" if record_kind == 'egg' else "creatures"].append(json.loads(data))
+
+        return {
+            "eggs": results["eggs"],
+            "creatures": results["creatures"],
+            "total": total,
+            "facets": {
+                "descriptors": [{"descriptor": d, "count": n} for d, n in facets],
+                "kinds": {record_kind: n for record_kind, n in kinds},
+            },
+        }
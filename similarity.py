@@ -0,0 +1,267 @@
+"""
+Similar Eggs Engine for the Hatch Application
+
+Finds "eggs like this one" locally, without an embedding call per egg.
+Each egg's description and descriptors are hashed into a fixed-width
+term-frequency vector (the hashing trick), rows are kept in a memory-mapped
+float32 matrix on disk, and queries are TF-IDF weighted cosine similarity
+computed with NumPy over the whole matrix at once.
+
+USAGE:
+- Add eggs as they are saved (EggCreator does this automatically):
+  index.add(egg_id, description, descriptors)
+
+- Query one egg or a batch of eggs:
+  index.similar(egg_id, k=5)            -> [(other_id, score), ...]
+  index.similar_batch([id1, id2], k=5)  -> {id1: [...], id2: [...]}
+
+FILES (inside the index directory):
+- vectors.f32: capacity x dimensions memory-mapped term frequencies
+- df.npy:      document frequency per hashed feature
+- ids.txt:     one egg id per line, in row order (appending a line commits a row)
+"""
+
+import fcntl
+import logging
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from search_index import normalize_descriptor
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "the", "and", "with", "its", "that", "this", "from", "into", "are", "was",
+    "for", "has", "have", "like", "egg", "eggs", "which", "while", "their",
+}
+
+# Descriptors are short and deliberate, so they count more than description words
+DESCRIPTOR_WEIGHT = 2.0
+
+# Rows are scored in blocks so a 100k-row matrix never needs a full-size temporary
+BLOCK_ROWS = 16384
+
+
+def _feature(token, dimensions):
+    """Stable hash of a token into a column (crc32, so every process agrees)"""
+    return zlib.crc32(token.encode('utf-8')) % dimensions
+
+
+def egg_features(description, descriptors, dimensions):
+    """Hash an egg's description words and descriptors into a sublinear term-frequency vector"""
+    counts = Counter()
+    for word in re.findall(r"[a-z]+", (description or "").lower()):
+        if len(word) > 2 and word not in STOPWORDS:
+            counts[_feature(word, dimensions)] += 1.0
+    for descriptor in descriptors or []:
+        descriptor = normalize_descriptor(descriptor)
+        if descriptor:
+            counts[_feature(f"d:{descriptor}", dimensions)] += DESCRIPTOR_WEIGHT
+
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for column, count in counts.items():
+        vector[column] = 1.0 + math.log(count)
+    return vector
+
+
+class SimilarityIndex:
+    def __init__(self, directory, dimensions=512):
+        self.directory = directory
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._df_path = os.path.join(directory, "df.npy")
+        self._ids_path = os.path.join(directory, "ids.txt")
+        self._lock_path = os.path.join(directory, ".lock")
+
+        self._ids = []
+        self._positions = {}
+        self._df = np.zeros(dimensions, dtype=np.float32)
+        self._vectors = None
+        self._capacity = 0
+        self._ids_mtime = None
+        self._norms = None
+        self._idf = None
+
+        self._load()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _file_lock(self):
+        """Exclusive lock shared by every process writing this index"""
+        handle = open(self._lock_path, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _open_vectors(self, capacity):
+        """(Re)map the vectors file, growing it to at least `capacity` rows"""
+        capacity = max(capacity, 1024)
+        needed = capacity * self.dimensions * 4
+        if not os.path.exists(self._vectors_path) or os.path.getsize(self._vectors_path) < needed:
+            with open(self._vectors_path, 'ab') as f:
+                f.truncate(needed)
+        rows = os.path.getsize(self._vectors_path) // (self.dimensions * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(rows, self.dimensions))
+        self._capacity = rows
+
+    def _load(self):
+        """Read ids and document frequencies written by this or another process"""
+        ids = []
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, 'r') as f:
+                ids = [line.strip() for line in f if line.strip()]
+            self._ids_mtime = os.path.getmtime(self._ids_path)
+
+        if os.path.exists(self._df_path):
+            df = np.load(self._df_path)
+            if df.shape == (self.dimensions,):
+                self._df = df.astype(np.float32)
+            else:
+                logger.warning("Similarity index dimensions changed, starting empty")
+                ids = []
+
+        self._ids = ids
+        self._positions = {egg_id: row for row, egg_id in enumerate(ids)}
+        self._open_vectors(len(ids))
+        self._norms = None
+
+    def _refresh(self):
+        """Pick up rows appended by other workers since we last looked"""
+        if os.path.exists(self._ids_path) and os.path.getmtime(self._ids_path) != self._ids_mtime:
+            self._load()
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def add(self, egg_id, description, descriptors):
+        """Append an egg's vector (a no-op if the egg is already indexed)"""
+        vector = egg_features(description, descriptors, self.dimensions)
+        with self._lock:
+            handle = self._file_lock()
+            try:
+                self._refresh()
+                if egg_id in self._positions:
+                    return
+
+                row = len(self._ids)
+                if row >= self._capacity:
+                    self._open_vectors(self._capacity * 2)
+
+                self._vectors[row] = vector
+                self._vectors.flush()
+
+                self._df += (vector > 0)
+                np.save(self._df_path, self._df)
+
+                # Appending the id is the commit point for the row
+                with open(self._ids_path, 'a') as f:
+                    f.write(egg_id + "\n")
+                self._ids_mtime = os.path.getmtime(self._ids_path)
+
+                self._ids.append(egg_id)
+                self._positions[egg_id] = row
+                self._norms = None
+            finally:
+                handle.close()
+
+    def rebuild(self, eggs):
+        """Re-create the index from a list of egg records"""
+        with self._lock:
+            handle = self._file_lock()
+            try:
+                ids = []
+                seen = set()
+                if os.path.exists(self._vectors_path):
+                    os.remove(self._vectors_path)
+                self._open_vectors(len(eggs))
+
+                df = np.zeros(self.dimensions, dtype=np.float32)
+                for egg in eggs:
+                    if not egg.get('id') or egg['id'] in seen:
+                        continue
+                    seen.add(egg['id'])
+                    vector = egg_features(egg.get('description', ''), egg.get('descriptors', []), self.dimensions)
+                    self._vectors[len(ids)] = vector
+                    df += (vector > 0)
+                    ids.append(egg['id'])
+                self._vectors.flush()
+
+                np.save(self._df_path, df)
+                with open(self._ids_path, 'w') as f:
+                    f.writelines(egg_id + "\n" for egg_id in ids)
+
+                self._load()
+            finally:
+                handle.close()
+        logger.info(f"Similarity index rebuilt with {len(ids)} eggs")
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _weights(self):
+        """IDF weights and TF-IDF row norms, recomputed only after the index changes"""
+        if self._norms is None:
+            count = len(self._ids)
+            self._idf = (np.log((1.0 + count) / (1.0 + self._df)) + 1.0).astype(np.float32)
+            idf_squared = self._idf * self._idf
+            norms = np.empty(count, dtype=np.float32)
+            for start in range(0, count, BLOCK_ROWS):
+                block = self._vectors[start:min(start + BLOCK_ROWS, count)]
+                norms[start:start + len(block)] = np.sqrt((block * block) @ idf_squared)
+            norms[norms == 0] = 1.0
+            self._norms = norms
+        return self._idf, self._norms
+
+    def similar(self, egg_id, k=5):
+        """Top-k most similar eggs to `egg_id` as (id, cosine score) pairs"""
+        return self.similar_batch([egg_id], k).get(egg_id, [])
+
+    def similar_batch(self, egg_ids, k=5):
+        """Top-k neighbours for several eggs with one matrix product per block"""
+        with self._lock:
+            self._refresh()
+            known = [egg_id for egg_id in egg_ids if egg_id in self._positions]
+            count = len(self._ids)
+            if not known or count < 2:
+                return {egg_id: [] for egg_id in known}
+
+            idf, norms = self._weights()
+            rows = np.array([self._positions[egg_id] for egg_id in known])
+
+            # cos(a, b) = (a*idf) . (b*idf) / (|a*idf| |b*idf|), so weight the
+            # queries by idf^2 and leave the stored rows untouched
+            queries = np.asarray(self._vectors[rows]) * (idf * idf)
+            queries /= norms[rows][:, None]
+
+            scores = np.empty((len(known), count), dtype=np.float32)
+            for start in range(0, count, BLOCK_ROWS):
+                end = min(start + BLOCK_ROWS, count)
+                scores[:, start:end] = (queries @ self._vectors[start:end].T) / norms[start:end]
+
+            # An egg is never similar to itself
+            scores[np.arange(len(known)), rows] = -1.0
+
+            k = min(k, count - 1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = {}
+            for i, egg_id in enumerate(known):
+                order = top[i][np.argsort(-scores[i, top[i]])]
+                results[egg_id] = [(self._ids[j], float(scores[i, j])) for j in order]
+            return results
@@ -173,6 +173,7 @@ async function loadCollection() {
         
         if (eggsResult.success && creaturesResult.success) {
             displayCollection(eggsResult.eggs, creaturesResult.creatures);
+            loadAudioSprite();
         } else {
             collectionContainer.innerHTML = '<div class="error">Failed to load collection</div>';
         }
@@ -246,7 +247,7 @@ function createEggCard(egg) {
     
     return `
         <div class="collection-card egg-card">
-            <img src="${egg.image_url}" alt="Egg" class="collection-image" onclick="openImageViewer('${egg.image_url}')">
+            <img src="${egg.thumbnail_url || egg.image_url}" alt="Egg" class="collection-image" onclick="openImageViewer('${egg.image_url}')">
             <div class="collection-info">
                 <div class="collection-title">
                     <i class="fas fa-egg"></i>
@@ -281,20 +282,24 @@ function createCreatureCard(creature, egg) {
             <div class="creature-egg-comparison">
                 <div class="egg-side">
                     <div class="egg-label">Original Egg</div>
-                    <img src="${egg ? egg.image_url : ''}" alt="Original Egg" class="egg-thumbnail" onclick="event.stopPropagation(); openImageViewer('${egg ? egg.image_url : ''}')">
+                    <img src="${egg ? (egg.thumbnail_url || egg.image_url) : ''}" alt="Original Egg" class="egg-thumbnail" onclick="event.stopPropagation(); openImageViewer('${egg ? egg.image_url : ''}')">
                 </div>
                 <div class="evolution-arrow">
                     <i class="fas fa-arrow-right"></i>
                 </div>
                 <div class="creature-side">
                     <div class="creature-label">Hatched Creature</div>
-                    <img src="${creature.image_url}" alt="Creature" class="creature-thumbnail" onclick="event.stopPropagation(); openImageViewer('${creature.image_url}')">
+                    <img src="${creature.thumbnail_url || creature.image_url}" alt="Creature" class="creature-thumbnail" onclick="event.stopPropagation(); openImageViewer('${creature.image_url}')">
                 </div>
             </div>
             <div class="collection-info">
                 <div class="collection-title">
                     <i class="fas fa-dragon"></i>
                     <span>${creature.name || 'Magical Creature'}</span>
+                    ${creature.audio_url ? `
+                    <button class="btn btn-secondary btn-sm" title="Play sound" onclick="event.stopPropagation(); playCreatureSound('${creature.audio_url}', '${creature.id}')">
+                        <i class="fas fa-volume-up"></i>
+                    </button>` : ''}
                 </div>
                 <div class="collection-description ${descriptionClass}">
                     ${isDetailedView ? (creature.egg_description || 'A unique creature hatched from a magical egg') : shortDescription}
@@ -481,8 +486,9 @@ async function startCareQuestionnaire() {
     try {
         console.log('Starting care questionnaire, currentEgg:', currentEgg);
         
-        // Get care questions
-        const response = await fetch('/api/care-questions');
+        // Get care questions (the server starts prefetching this egg's hatch)
+        const eggQuery = currentEgg ? `?egg_id=${encodeURIComponent(currentEgg.id)}` : '';
+        const response = await fetch(`/api/care-questions${eggQuery}`);
         const result = await response.json();
         
         if (result.success) {
@@ -706,7 +712,7 @@ function showCreatureResult(creature) {
             <div style="background: rgba(78, 205, 196, 0.1); padding: 15px; border-radius: 10px; border-left: 3px solid #4ecdc4;">
                 <p style="font-style: italic; color: #4ecdc4; margin-bottom: 10px;">"${creature.sound_text}"</p>
                 <p style="font-size: 0.9rem; color: #888; margin-bottom: 10px;">Voice: ${creature.voice_description}</p>
-                <button class="btn btn-secondary" onclick="playCreatureSound('${creature.audio_url}')" style="margin-right: 10px;">
+                <button class="btn btn-secondary" onclick="playCreatureSound('${creature.audio_url}', '${creature.id}')" style="margin-right: 10px;">
                     <i class="fas fa-play"></i> Play Sound
                 </button>
                 <span style="font-size: 0.8rem; color: #888;">Sound: ${creature.sound_name}</span>
@@ -756,7 +762,46 @@ function showCreatureResult(creature) {
     }
 }
 
-function playCreatureSound(audioUrl) {
+// Gallery audio sprite: every creature sound in one file, decoded once so clips play instantly
+let audioContext = null;
+let audioSprite = null;
+
+async function loadAudioSprite() {
+    try {
+        const response = await fetch('/api/creatures/audio-sprite');
+        const result = await response.json();
+        if (!result.success || !result.url) {
+            return;  // No ffmpeg on the server or no sounds yet: clips are fetched one by one
+        }
+        audioContext = audioContext || new (window.AudioContext || window.webkitAudioContext)();
+        const data = await (await fetch(result.url)).arrayBuffer();
+        const buffer = await audioContext.decodeAudioData(data);
+        audioSprite = { buffer: buffer, clips: result.clips };
+    } catch (error) {
+        console.log('Audio sprite unavailable:', error);
+        audioSprite = null;
+    }
+}
+
+function playSpriteClip(creatureId) {
+    const clip = audioSprite && creatureId ? audioSprite.clips[creatureId] : null;
+    if (!clip) {
+        return false;
+    }
+    if (audioContext.state === 'suspended') {
+        audioContext.resume();
+    }
+    const source = audioContext.createBufferSource();
+    source.buffer = audioSprite.buffer;
+    source.connect(audioContext.destination);
+    source.start(0, clip.start, clip.duration);
+    return true;
+}
+
+function playCreatureSound(audioUrl, creatureId) {
+    if (playSpriteClip(creatureId)) {
+        return;
+    }
     try {
         const audio = new Audio(audioUrl);
         audio.play().catch(error => {
@@ -784,13 +829,30 @@ resultModal.addEventListener('click', (e) => {
 });
 
 // Care modal close events
+function closeCareModal() {
+    careModal.classList.add('hidden');
+    
+    // Let the server drop the hatch work it prefetched for this egg
+    if (currentEgg) {
+        fetch('/api/care-questions/cancel', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ egg_id: currentEgg.id })
+        }).catch(error => console.log('Prefetch cancel failed:', error));
+    }
+}
+
 careModal.addEventListener('click', (e) => {
     if (e.target === careModal) {
         console.log('Care modal closed by clicking outside, currentEgg:', currentEgg);
-        careModal.classList.add('hidden');
+        closeCareModal();
     }
 });
 
+careModal.querySelector('.close').addEventListener('click', closeCareModal);
+
 // Creature modal close events
 creatureModal.addEventListener('click', (e) => {
     if (e.target === creatureModal) {
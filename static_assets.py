@@ -0,0 +1,512 @@
+"""
+Static Asset Bundles and Response Compression for the Hatch Application
+
+The page used to load static/js/app.js and static/css/style.css as written
+(comments, indentation and all) through Flask's static handler, which sends
+them uncompressed and revalidates them on every visit, and the JSON API went
+out uncompressed too. Now:
+
+- `python static_assets.py build` minifies each asset, names it by its content
+  hash (static/dist/js/app.<hash>.js) and writes .gz and .br (with the brotli
+  package) variants next to it at the highest levels, plus a manifest.json.
+  The templates call asset_url(), which resolves the fingerprinted URL from the
+  manifest, so the files can be cached as immutable for a year. A new build
+  gets new names, and the files of the previous build are kept for pages still
+  open during a deploy
+- /static/dist/ serves the pre-encoded variant the client accepts (br, then
+  gzip), so nothing is compressed on the request path
+- compress_body() compresses dynamic responses (JSON, HTML) above a size
+  threshold, at fast levels, for the after_request hooks of both apps
+
+Without a build, or for an asset edited since the last one (the manifest keeps
+the digest of each source), asset_url() falls back to the original file.
+
+The minifiers are conservative: comments and indentation go, while string,
+template and regex literals are copied as they are and line breaks are kept
+wherever automatic semicolon insertion could need them. If rjsmin / rcssmin are
+installed they are used instead.
+
+USAGE:
+  python static_assets.py build               # on deploy, after pip install
+  python static_assets.py status              # manifest entries and sizes
+  asset_url('js/app.js')                      # in templates: fingerprinted URL
+  encoding, body = compress_body(data, 'application/json', 'gzip, br', min_bytes=1024)
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+# Assets bundled by `build`, relative to static/
+ASSETS = ('css/style.css', 'js/app.js')
+
+# Pre-encoded variant suffixes, in order of preference
+VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+
+# Response types worth compressing (images and MP3s are compressed already)
+COMPRESSIBLE_TYPES = frozenset({
+    'application/json', 'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'image/svg+xml',
+})
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+# ----------------------------------------------------------------------
+# Minification
+# ----------------------------------------------------------------------
+
+_IDENT = re.compile(r'[\w$\\]')
+# After these a "/" starts a regex literal, not a division
+_REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'yield', 'await')
+# A line break after or before these can't end a statement, so it can go
+_NO_BREAK_AFTER = set('{;,([=:&|?*%<>!~^')
+_NO_BREAK_BEFORE = set('}),;]=:&|?*%<>.')
+
+
+def _is_ident(ch):
+    return bool(ch) and (_IDENT.match(ch) is not None or ord(ch) > 127)
+
+
+def _skip_string(text, i, quote):
+    """Index just past the string literal starting at text[i]"""
+    i += 1
+    while i < len(text):
+        ch = text[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if ch == quote:
+            return i + 1
+        i += 1
+    return i
+
+
+def _skip_template(text, i):
+    """Index just past the template literal starting at text[i], ${...} (and templates in it) included"""
+    i += 1
+    while i < len(text):
+        ch = text[i]
+        if ch == '\\':
+            i += 2
+        elif ch == '`':
+            return i + 1
+        elif ch == '$' and text.startswith('${', i):
+            i = _skip_braces(text, i + 2)
+        else:
+            i += 1
+    return i
+
+
+def _skip_braces(text, i):
+    """Index just past the } closing a ${ ... } substitution"""
+    depth = 1
+    while i < len(text) and depth:
+        ch = text[i]
+        if ch in '\'"':
+            i = _skip_string(text, i, ch)
+            continue
+        if ch == '`':
+            i = _skip_template(text, i)
+            continue
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+        i += 1
+    return i
+
+
+def _skip_regex(text, i):
+    """Index just past the regex literal (and flags) starting at text[i]"""
+    i += 1
+    in_class = False
+    while i < len(text):
+        ch = text[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if ch == '[':
+            in_class = True
+        elif ch == ']':
+            in_class = False
+        elif ch == '/' and not in_class:
+            i += 1
+            break
+        elif ch == '\n':
+            break
+        i += 1
+    while i < len(text) and _is_ident(text[i]):
+        i += 1
+    return i
+
+
+def _regex_allowed(out):
+    stripped = ''.join(out[-12:]).rstrip()
+    if not stripped:
+        return True
+    if stripped[-1] in _REGEX_PREFIX:
+        return True
+    return any(stripped.endswith(word) and not _is_ident(stripped[-len(word) - 1:-len(word)])
+               for word in _REGEX_KEYWORDS)
+
+
+def minify_js(source):
+    """JavaScript without comments and needless whitespace (line breaks kept where ASI may need them)"""
+    try:
+        import rjsmin
+        return rjsmin.jsmin(source)
+    except ImportError:
+        pass
+
+    out = []
+    pending = None  # whitespace seen since the last token: ' ' or '\n'
+    i, n = 0, len(source)
+
+    def flush(next_ch):
+        prev = out[-1][-1] if out else ''
+        if pending is None or not prev:
+            return
+        if pending == '\n':
+            if prev not in _NO_BREAK_AFTER and next_ch not in _NO_BREAK_BEFORE:
+                out.append('\n')
+            elif _is_ident(prev) and _is_ident(next_ch):
+                out.append(' ')
+        elif (_is_ident(prev) and _is_ident(next_ch)) or (prev in '+-' and next_ch == prev):
+            out.append(' ')
+
+    while i < n:
+        ch = source[i]
+        if ch in ' \t\r\n\f\v':
+            if ch == '\n' or pending is None:
+                pending = '\n' if ch == '\n' or pending == '\n' else ' '
+            i += 1
+            continue
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            if source.startswith('/*!', i):  # license comments stay
+                flush('/')
+                pending = None
+                out.append(source[i:end])
+            elif pending is None:
+                pending = ' '
+            if '\n' in source[i:end]:
+                pending = '\n'
+            i = end
+            continue
+
+        flush(ch)
+        pending = None
+        if ch in '\'"':
+            end = _skip_string(source, i, ch)
+        elif ch == '`':
+            end = _skip_template(source, i)
+        elif ch == '/' and _regex_allowed(out):
+            end = _skip_regex(source, i)
+        else:
+            end = i + 1
+        out.append(source[i:end])
+        i = end
+    return ''.join(out).strip() + '\n'
+
+
+_CSS_PUNCTUATION = set('{};,>')
+
+
+def minify_css(source):
+    """CSS without comments and needless whitespace. Spaces before ":" stay (" :hover" is a descendant)"""
+    try:
+        import rcssmin
+        return rcssmin.cssmin(source)
+    except ImportError:
+        pass
+
+    out = []
+    space = False
+    i, n = 0, len(source)
+    while i < n:
+        ch = source[i]
+        if ch in ' \t\r\n\f':
+            space = True
+            i += 1
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            space = True
+            continue
+        prev = out[-1][-1] if out else ''
+        if space and prev and prev not in _CSS_PUNCTUATION and prev != ':' and ch not in _CSS_PUNCTUATION:
+            out.append(' ')
+        space = False
+        if ch in '\'"':
+            end = _skip_string(source, i, ch)
+            out.append(source[i:end])
+            i = end
+            continue
+        if ch == '}' and prev == ';':
+            out.pop()
+        out.append(ch)
+        i += 1
+    return ''.join(out) + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+# ----------------------------------------------------------------------
+# Encoding
+# ----------------------------------------------------------------------
+
+def compress(data, encoding, level=None):
+    """data compressed as gzip or br; level is the gzip level / brotli quality (default: the highest)"""
+    if encoding == 'gzip':
+        # mtime=0: the same input gives the same bytes, so builds are reproducible
+        return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11 if level is None else level)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding, offered=None):
+    """The first of the offered encodings (br, then gzip) that the Accept-Encoding header allows, or None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    for encoding in offered or available_encodings():
+        if weights.get(encoding, weights.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(data, mimetype, accept_encoding, min_bytes=1024, gzip_level=6, brotli_quality=4):
+    """
+    (encoding, compressed bytes) for a dynamic response body, or None when it should go as it is:
+    a type that doesn't compress, smaller than min_bytes, no accepted encoding, or no smaller.
+    """
+    if mimetype not in COMPRESSIBLE_TYPES or len(data) < min_bytes:
+        return None
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return None
+    compressed = compress(data, encoding, gzip_level if encoding == 'gzip' else brotli_quality)
+    if len(compressed) >= len(data):
+        return None
+    return encoding, compressed
+
+
+# ----------------------------------------------------------------------
+# Build
+# ----------------------------------------------------------------------
+
+def _digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(dist_dir=DIST_DIR):
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR, assets=ASSETS, keep_previous=True):
+    """
+    Minify, fingerprint and pre-compress the assets into dist_dir. Returns the manifest:
+    {asset: {"path", "source_sha256", "bytes", "minified_bytes", "encodings": {encoding: bytes}}}
+    """
+    previous = read_manifest(dist_dir)
+    manifest = {}
+    for name in assets:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            source = f.read()
+        base, ext = os.path.splitext(name)
+        minify = MINIFIERS.get(ext)
+        minified = minify(source.decode('utf-8')).encode('utf-8') if minify else source
+        path = f"{base}.{_digest(minified)[:12]}{ext}"
+
+        _write(os.path.join(dist_dir, path), minified)
+        encodings = {}
+        for encoding, suffix in VARIANTS:
+            if encoding not in available_encodings():
+                continue
+            encoded = compress(minified, encoding)
+            _write(os.path.join(dist_dir, path + suffix), encoded)
+            encodings[encoding] = len(encoded)
+        manifest[name] = {
+            "path": path,
+            "source_sha256": _digest(source),
+            "bytes": len(source),
+            "minified_bytes": len(minified),
+            "encodings": encodings,
+        }
+
+    # Keep this build's and (for pages loaded before the deploy) the previous build's files
+    keep = {entry["path"] for entry in manifest.values()}
+    if keep_previous:
+        keep |= {entry["path"] for entry in previous.values() if isinstance(entry, dict) and "path" in entry}
+    _prune(dist_dir, keep)
+
+    _write(os.path.join(dist_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def _prune(dist_dir, keep):
+    suffixes = ('',) + tuple(suffix for _, suffix in VARIANTS)
+    keep_files = {os.path.normpath(path + suffix) for path in keep for suffix in suffixes}
+    keep_files.add(MANIFEST_NAME)
+    for root, _, files in os.walk(dist_dir):
+        for filename in files:
+            relative = os.path.normpath(os.path.relpath(os.path.join(root, filename), dist_dir))
+            if relative not in keep_files:
+                os.remove(os.path.join(root, filename))
+
+
+# ----------------------------------------------------------------------
+# Serving
+# ----------------------------------------------------------------------
+
+class AssetManifest:
+    """
+    The built manifest, for resolving asset URLs and serving /static/dist/. Entries whose source
+    changed since the build are dropped, so an edited asset is served from its original file.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+        self.static_dir = static_dir
+        self.dist_dir = dist_dir
+        self.entries = {}
+        self.files = {}  # fingerprinted path -> {encoding: bytes}, this build's and the previous one's
+        for name, entry in read_manifest(dist_dir).items():
+            try:
+                with open(os.path.join(static_dir, name), 'rb') as f:
+                    current = _digest(f.read())
+            except OSError:
+                continue
+            if current != entry.get("source_sha256"):
+                logger.warning(f"{name} changed since the last asset build; serving the original "
+                               f"(run python static_assets.py build)")
+                continue
+            self.entries[name] = entry
+        for root, _, files in os.walk(dist_dir) if os.path.isdir(dist_dir) else ():
+            for filename in files:
+                relative = os.path.relpath(os.path.join(root, filename), dist_dir).replace(os.sep, '/')
+                for encoding, suffix in VARIANTS:
+                    if relative.endswith(suffix):
+                        self.files.setdefault(relative[:-len(suffix)], set()).add(encoding)
+                        break
+                else:
+                    if relative != MANIFEST_NAME:
+                        self.files.setdefault(relative, set())
+
+    def path_for(self, name):
+        """Fingerprinted path under dist/ for an asset, or None if it isn't built (or is stale)"""
+        entry = self.entries.get(name)
+        return entry["path"] if entry else None
+
+    def variant(self, path, accept_encoding):
+        """(file name under dist/, encoding or None) to serve for a fingerprinted path, or None if unknown"""
+        if path not in self.files:
+            return None
+        encoding = negotiate(accept_encoding, [e for e, _ in VARIANTS if e in self.files[path]])
+        suffix = dict(VARIANTS).get(encoding, '')
+        return path + suffix, encoding
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    """The manifest, loaded once per process"""
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = AssetManifest()
+    return _manifest
+
+
+# ----------------------------------------------------------------------
+# CLI
+# ----------------------------------------------------------------------
+
+def _print_manifest(manifest):
+    for name, entry in sorted(manifest.items()):
+        sizes = ", ".join(f"{encoding} {size:,}" for encoding, size in sorted(entry["encodings"].items()))
+        print(f"{name} -> dist/{entry['path']}: {entry['bytes']:,} B, minified {entry['minified_bytes']:,}"
+              + (f", {sizes}" if sizes else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build fingerprinted, pre-compressed static assets")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='minify, fingerprint and pre-compress the assets')
+    build_parser.add_argument('--no-keep-previous', action='store_true',
+                              help="delete the previous build's files too")
+    subparsers.add_parser('status', help='show the current manifest')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if brotli is None:
+            print("brotli is not installed: building gzip variants only", file=sys.stderr)
+        _print_manifest(build(keep_previous=not args.no_keep_previous))
+    else:
+        manifest = read_manifest()
+        if not manifest:
+            print("No asset build (run python static_assets.py build)")
+            return 1
+        stale = [name for name in manifest if AssetManifest().path_for(name) is None]
+        _print_manifest(manifest)
+        if stale:
+            print(f"Stale (source changed since the build): {', '.join(stale)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
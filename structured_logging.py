@@ -0,0 +1,318 @@
+"""
+Structured, Non-blocking Logging for the Hatch Application
+
+Request threads only put log records on an in-memory queue; a QueueListener
+thread formats them and does the file/console I/O, so a slow disk never adds
+to request latency. Shared by app.py and app_simple.py.
+
+- JSON records (or plain text with LOG_FORMAT=text) with timestamp, level,
+  logger, pid, request id and any `extra={...}` fields
+- Messages and string fields longer than LOG_MAX_MESSAGE_CHARS are truncated
+  (full model responses used to end up in the log verbatim)
+- hatch.log is rotated at LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT files
+  (under a file lock, so all gunicorn workers can share it)
+- DEBUG records are sampled at LOG_DEBUG_SAMPLE_RATE before they are queued
+- If the queue is full records are dropped (and counted) rather than blocking
+
+USAGE:
+  configure_logging(app.config)     # or os.environ; reads the LOG_* settings
+  init_request_logging(app)         # X-Request-ID in/out + one access line per request
+  init_async_request_logging(app)   # the same for the Quart app (app_async.py)
+
+  logger.info("Creature hatched", extra={"creature_id": creature_id, "duration_ms": 1234})
+"""
+
+import atexit
+import contextvars
+import fcntl
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+_handler = None
+
+
+def truncate(value, limit):
+    if limit and isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}...[truncated {len(value) - limit} chars]"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def __init__(self, max_chars=2000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_chars),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = truncate(value, self.max_chars)
+        if record.exc_info:
+            entry["exception"] = truncate(self.formatException(record.exc_info), self.max_chars * 4)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic hatch.log line, with the request id and truncation"""
+
+    def __init__(self, max_chars=2000):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+        self.max_chars = max_chars
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            line = f"{line} [request_id={request_id}]"
+        return truncate(line, self.max_chars)
+
+
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler several gunicorn workers can share: rollover happens
+    under a file lock, and a worker reopens the file after another one rotated it.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._lock_file = open(f"{self.baseFilename}.lock", 'a')
+
+    def _reopen_if_rotated(self):
+        try:
+            rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self.stream.close()
+            self.stream = self._open()
+
+    def emit(self, record):
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                self._reopen_if_rotated()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        self._lock_file.close()
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp the current request id on the record (runs in the caller's thread, before queueing)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG (and lower) records"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: records are dropped (and counted) when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # The queue is in-process, so the record doesn't need to be pickled; message
+        # formatting is left to the listener thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+
+        if self.dropped:
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                notice = logging.LogRecord("structured_logging", logging.WARNING, __file__, 0,
+                                           f"Log queue full, dropped {dropped} records", (), None)
+                try:
+                    self.queue.put_nowait(notice)
+                except queue.Full:
+                    with self._lock:
+                        self.dropped += dropped
+
+
+def _setting(config, key, default, cast=str):
+    value = config.get(key)
+    return default if value in (None, "") else cast(value)
+
+
+def configure_logging(config):
+    """
+    Route the root logger through a queue to a rotating file and the console.
+    config is any mapping with the LOG_* settings (app.config or os.environ).
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return _listener
+
+    max_chars = _setting(config, 'LOG_MAX_MESSAGE_CHARS', 2000, int)
+    if _setting(config, 'LOG_FORMAT', 'json').lower() == 'text':
+        formatter = TextFormatter(max_chars)
+    else:
+        formatter = JsonFormatter(max_chars)
+
+    file_handler = SharedRotatingFileHandler(
+        _setting(config, 'LOG_FILE', 'hatch.log'),
+        maxBytes=_setting(config, 'LOG_MAX_BYTES', 10 * 1024 * 1024, int),
+        backupCount=_setting(config, 'LOG_BACKUP_COUNT', 5, int)
+    )
+    console_handler = logging.StreamHandler(sys.stdout)
+    for target in (file_handler, console_handler):
+        target.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=_setting(config, 'LOG_QUEUE_SIZE', 10000, int))
+    _handler = DroppingQueueHandler(log_queue)
+    _handler.addFilter(DebugSamplingFilter(_setting(config, 'LOG_DEBUG_SAMPLE_RATE', 0.1, float)))
+    _handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(_setting(config, 'LOG_LEVEL', 'INFO').upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+    # A forked worker doesn't inherit the listener thread; start a fresh one
+    os.register_at_fork(after_in_child=_restart_listener)
+    return _listener
+
+
+def _stop_listener():
+    """Flush whatever is still queued (at exit)"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart_listener():
+    if _listener is not None:
+        # The parent's queue may have been mid-operation at fork time; start clean
+        fresh = queue.Queue(maxsize=_listener.queue.maxsize)
+        _listener.queue = _handler.queue = fresh
+        _listener._thread = None
+        _listener.start()
+
+
+def _log_access(access_logger, request, status, start):
+    duration_ms = round((time.perf_counter() - start) * 1000, 2)
+    access_logger.info(
+        f"{request.method} {request.path} {status} {duration_ms}ms",
+        extra={
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": status,
+            "duration_ms": duration_ms,
+        }
+    )
+
+
+def init_request_logging(app, header="X-Request-ID"):
+    """Assign each request an id (or take the caller's), echo it back and log one access line"""
+    access_logger = logging.getLogger("hatch.access")
+
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get(header) or uuid.uuid4().hex[:16]
+        g.request_id = request_id
+        g.request_log_start = time.perf_counter()
+        request_id_var.set(request_id)
+
+    @app.after_request
+    def log_request(response):
+        start = g.pop('request_log_start', None)
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[header] = request_id
+        if start is not None:
+            _log_access(access_logger, request, response.status_code, start)
+        return response
+
+    @app.teardown_request
+    def clear_request_id(error=None):
+        request_id_var.set(None)
+
+
+def init_async_request_logging(app, header="X-Request-ID"):
+    """
+    init_request_logging for the Quart app in app_async.py. The hooks must be
+    coroutines: Quart runs plain functions in a thread, where setting the
+    request id context variable would not reach the request's task.
+    """
+    from quart import g as quart_g, request as quart_request
+
+    access_logger = logging.getLogger("hatch.access")
+
+    @app.before_request
+    async def assign_request_id():
+        request_id = quart_request.headers.get(header) or uuid.uuid4().hex[:16]
+        quart_g.request_id = request_id
+        quart_g.request_log_start = time.perf_counter()
+        request_id_var.set(request_id)
+
+    @app.after_request
+    async def log_request(response):
+        start = quart_g.pop('request_log_start', None)
+        request_id = quart_g.get('request_id')
+        if request_id:
+            response.headers[header] = request_id
+        if start is not None:
+            _log_access(access_logger, quart_request, response.status_code, start)
+        return response
@@ -0,0 +1,156 @@
+"""Tests for media_store.MediaStore: deduplication, reference counts and GC"""
+
+import os
+import time
+
+import pytest
+
+import media_store
+from media_store import MediaStore, collect_references
+
+HOUR = 3600
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MediaStore(str(tmp_path / "static"), str(tmp_path / "media_index.db"))
+    yield store
+    store.close()
+
+
+def file_of(store, url):
+    return store.local_path(url)
+
+
+def later(monkeypatch, seconds):
+    """Move media_store's clock forward"""
+    now = time.time() + seconds
+    monkeypatch.setattr(media_store.time, "time", lambda: now)
+
+
+def test_put_deduplicates_identical_bytes(store):
+    first = store.put(b"png bytes", "image")
+    second = store.put(b"png bytes", "image")
+    other = store.put(b"other bytes", "image")
+
+    assert first == second != other
+    assert first.startswith(f"/{store.root}/images/") and first.endswith(".png")
+    assert store.metrics["deduplicated"] == 1
+
+
+def test_ref_and_unref_count_and_never_go_negative(store):
+    url = store.put(b"sound", "audio")
+    store.ref(url, url, None, "https://example.com/elsewhere.png")
+    assert store.refs(url) == 2
+
+    store.unref(url, url, url)
+    assert store.refs(url) == 0
+
+
+def test_gc_keeps_unreferenced_files_within_the_grace_period(store):
+    url = store.put(b"fresh", "image")
+
+    report = store.gc({}, grace_seconds=HOUR)
+
+    assert report["within_grace"] == 1 and report["deleted"] == 0
+    assert os.path.exists(file_of(store, url))
+
+
+def test_gc_deletes_unreferenced_files_past_the_grace_period(store, monkeypatch):
+    kept = store.put(b"referenced", "image")
+    orphan = store.put(b"orphan", "image")
+    orphan_path = file_of(store, orphan)
+
+    later(monkeypatch, 2 * HOUR)
+    report = store.gc({kept: 1}, grace_seconds=HOUR)
+
+    assert report["deleted"] == 1 and report["referenced"] == 1
+    assert report["bytes_reclaimed"] == len(b"orphan")
+    assert not os.path.exists(orphan_path)
+    assert os.path.exists(file_of(store, kept))
+
+
+def test_gc_dry_run_deletes_nothing(store, monkeypatch):
+    orphan = store.put(b"orphan", "audio")
+
+    later(monkeypatch, 2 * HOUR)
+    report = store.gc({}, grace_seconds=HOUR, dry_run=True)
+
+    assert report["deleted"] == 1
+    assert os.path.exists(file_of(store, orphan))
+
+
+def test_reuse_restarts_the_grace_period(store, monkeypatch):
+    url = store.put(b"reused", "image")
+    path = file_of(store, url)
+    old = time.time() - 2 * HOUR
+    os.utime(path, (old, old))
+    with store._lock:
+        store._conn.execute("UPDATE media SET last_put_at = ? WHERE url = ?", (old, url))
+        store._conn.commit()
+
+    # A request was just handed the existing file again
+    assert store.put(b"reused", "image") == url
+    report = store.gc({}, grace_seconds=HOUR)
+
+    assert report["within_grace"] == 1 and report["deleted"] == 0
+    assert os.path.exists(path)
+
+
+def test_gc_corrects_reference_counts_from_the_records(store):
+    url = store.put(b"image", "image")
+    store.ref(url)  # the index thinks one record holds it; the record files say three
+
+    report = store.gc({url: 3}, grace_seconds=HOUR)
+
+    assert report["refs_corrected"] == 1
+    assert store.refs(url) == 3
+
+
+def test_gc_removes_stale_upload_temp_files(store, monkeypatch):
+    tmp_path = store.temp_path("audio")
+    with open(tmp_path, "wb") as f:
+        f.write(b"half an upload")
+
+    assert store.gc({}, grace_seconds=HOUR)["temp_files_deleted"] == 0
+    later(monkeypatch, 2 * HOUR)
+    assert store.gc({}, grace_seconds=HOUR)["temp_files_deleted"] == 1
+    assert not os.path.exists(tmp_path)
+
+
+def test_collect_references_counts_nested_media_urls(tmp_path):
+    path = tmp_path / "creatures_data.json"
+    path.write_text('[{"image_url": "/static/images/a.png", "alternate_image_urls": ["/static/images/a.png"],'
+                    ' "audio_url": "/static/audio/b.mp3", "name": "/static/other"}]')
+
+    counts = collect_references([str(path), str(tmp_path / "missing.json")])
+
+    assert counts == {"/static/images/a.png": 2, "/static/audio/b.mp3": 1}
+
+
+class SharedBucket:
+    """A remote backend, played by the local one"""
+    name = "s3"
+
+    def __init__(self, local):
+        self._local = local
+
+    def __getattr__(self, attr):
+        return getattr(self._local, attr)
+
+
+def test_gc_on_a_remote_backend_needs_shared_references(tmp_path, monkeypatch):
+    store = MediaStore(str(tmp_path / "static"), str(tmp_path / "media_index.db"))
+    orphan = store.put(b"orphan", "image")
+    # A bucket every node writes to; this node's record files don't hold the others' references
+    monkeypatch.setattr(store, "backend", SharedBucket(store.backend))
+    later(monkeypatch, 2 * HOUR)
+    try:
+        with pytest.raises(ValueError, match="every node"):
+            store.gc({}, grace_seconds=HOUR)
+        assert store.gc({}, grace_seconds=HOUR, dry_run=True)["deleted"] == 1
+        assert os.path.exists(file_of(store, orphan))
+
+        assert store.gc({}, grace_seconds=HOUR, shared_references=True)["deleted"] == 1
+    finally:
+        store.close()
@@ -0,0 +1,99 @@
+"""Tests for media_urls.MediaURLSigner: what a signed media URL authorizes"""
+
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from media_urls import MediaURLSigner, derive_key, signer_from_config
+
+PATH = "/static/images/" + "ab" * 32 + ".png"
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def signer():
+    return MediaURLSigner(["secret"], ttl_seconds=86400, step_seconds=3600)
+
+
+def parts(url):
+    query = parse_qs(urlsplit(url).query)
+    return urlsplit(url).path, query["exp"][0], query["sig"][0]
+
+
+def test_signed_url_verifies_until_it_expires(signer):
+    url = signer.sign(PATH, now=NOW)
+    path, expires, _ = parts(url)
+
+    assert path == PATH
+    assert int(expires) % 3600 == 0 and int(expires) >= NOW + 86400
+    assert signer.verify_url(url, now=NOW) == int(expires) - NOW
+    assert signer.verify_url(url, now=int(expires)) is None
+    assert signer.counts["expired"] == 1
+
+
+def test_urls_signed_within_a_step_are_identical(signer):
+    assert signer.sign(PATH, now=NOW) == signer.sign(PATH, now=NOW + 1)
+
+
+@pytest.mark.parametrize("tamper", ["path", "expiry", "signature", "missing signature"])
+def test_tampered_urls_are_rejected(signer, tamper):
+    path, expires, signature = parts(signer.sign(PATH, now=NOW))
+    if tamper == "path":
+        path = "/static/images/" + "cd" * 32 + ".png"
+    elif tamper == "expiry":
+        expires = str(int(expires) + 3600)  # stretching the lifetime must break the signature
+    elif tamper == "signature":
+        signature = signature[:-1] + ("A" if signature[-1] != "A" else "B")
+    else:
+        signature = None
+
+    assert signer.verify(path, expires, signature, now=NOW) is None
+    assert signer.counts["invalid"] == 1
+
+
+def test_unsigned_and_foreign_paths_are_rejected(signer):
+    _, expires, signature = parts(signer.sign(PATH, now=NOW))
+
+    assert signer.verify("/api/eggs", expires, signature, now=NOW) is None
+    assert signer.verify(PATH, "not-a-number", signature, now=NOW) is None
+    assert signer.verify_url(PATH, now=NOW) is None
+
+
+def test_non_media_urls_are_not_signed(signer):
+    assert signer.sign(None) is None
+    assert signer.sign("https://cdn.example.com/x.png") == "https://cdn.example.com/x.png"
+    assert signer.sign("/api/eggs") == "/api/eggs"
+
+
+def test_a_rotated_key_still_verifies_old_urls(signer):
+    old_url = signer.sign(PATH, now=NOW)
+    rotated = MediaURLSigner(["new-secret", "secret"])
+    new_only = MediaURLSigner(["new-secret"])
+
+    assert rotated.verify_url(old_url, now=NOW) is not None
+    assert new_only.verify_url(old_url, now=NOW) is None
+    # The first key signs
+    new_url = rotated.sign(PATH, now=NOW)
+    assert new_only.verify_url(new_url, now=NOW) is not None
+    assert signer.verify_url(new_url, now=NOW) is None
+
+
+def test_config_secrets_rotate_and_default_to_a_derived_key():
+    old = signer_from_config({"MEDIA_URL_SECRET": "old"})
+    rotated = signer_from_config({"MEDIA_URL_SECRET": "new, old"})
+    assert rotated.verify_url(old.sign(PATH, now=NOW), now=NOW) is not None
+
+    derived = signer_from_config({"SECRET_KEY": "app-secret"})
+    assert derived.keys == [derive_key("app-secret")]
+    assert signer_from_config({"MEDIA_SIGNED_URLS": False}) is None
+
+
+def test_sign_record_signs_media_fields_only(signer):
+    record = {"id": "x", "image_url": PATH, "alternate_image_urls": [PATH, None], "name": "Blob"}
+
+    signed = signer.sign_record(record)
+
+    assert signed["image_url"].startswith(PATH + "?exp=")
+    assert len(signed["alternate_image_urls"]) == 1
+    assert signed["name"] == "Blob"
+    assert record["image_url"] == PATH
@@ -0,0 +1,51 @@
+"""Tests for metrics.Metrics: scrape-time collectors for state the workers share"""
+
+import json
+import os
+
+import pytest
+
+from metrics import Metrics
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = Metrics(str(tmp_path / "metrics"))
+    registry.counter("hatch_requests_total", "Requests")
+    registry.gauge("hatch_pool_depth", "Ready eggs in the shared pool")
+    return registry
+
+
+def samples(registry, name):
+    return [line for line in registry.render().splitlines() if line.startswith(name)]
+
+
+def test_collector_gauges_are_read_at_each_scrape(registry):
+    depth = {"value": 3}
+    registry.collectors.append(lambda: [("hatch_pool_depth", {"cluster": "cozy"}, depth["value"])])
+
+    assert samples(registry, "hatch_pool_depth") == ['hatch_pool_depth{cluster="cozy"} 3']
+    depth["value"] = 1
+    assert samples(registry, "hatch_pool_depth") == ['hatch_pool_depth{cluster="cozy"} 1']
+
+
+def test_collector_gauges_stay_out_of_the_worker_snapshots(registry):
+    registry.collectors.append(lambda: [("hatch_pool_depth", {"cluster": "cozy"}, 3)])
+    registry.inc("hatch_requests_total")
+    registry.render()
+
+    # Another worker merging this snapshot must not add the shared value a second time
+    with open(os.path.join(registry.directory, f"{os.getpid()}.json")) as f:
+        snapshot = json.load(f)
+    assert snapshot["counters"] == [["hatch_requests_total", [], 1]]
+    assert snapshot["gauges"] == []
+
+
+def test_a_failing_collector_does_not_break_the_scrape(registry):
+    def broken():
+        raise OSError("pool file unreadable")
+
+    registry.collectors.append(broken)
+    registry.inc("hatch_requests_total")
+
+    assert samples(registry, "hatch_requests_total") == ["hatch_requests_total 1"]
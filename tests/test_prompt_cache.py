@@ -0,0 +1,65 @@
+"""Tests for prompt_cache.PromptCache: lookups and writes shared between workers"""
+
+import multiprocessing
+
+import pytest
+
+from prompt_cache import PromptCache
+
+DESCRIPTORS = ["whimsical", "verdant"]
+DESCRIPTION = "a mossy egg with tiny golden flowers growing from its cracks"
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "prompt_cache.json")
+
+
+def test_exact_and_fingerprint_hits(path):
+    cache = PromptCache(path)
+    cache.store("prompt", DESCRIPTION, DESCRIPTORS, "/static/images/a.png")
+
+    assert cache.lookup("prompt", "", [])["match"] == "exact"
+    hit = cache.lookup("other prompt", DESCRIPTION + " today", ["Verdant", "whimsical"])
+    assert hit["match"] == "fingerprint" and hit["image_url"] == "/static/images/a.png"
+    assert cache.lookup("other prompt", "a smooth glass egg", DESCRIPTORS) is None
+
+
+def test_invalidate_forgets_the_image(path):
+    cache = PromptCache(path)
+    cache.store("prompt", DESCRIPTION, DESCRIPTORS, "/static/images/a.png")
+
+    cache.invalidate("/static/images/a.png")
+
+    assert PromptCache(path).lookup("prompt", DESCRIPTION, DESCRIPTORS) is None
+
+
+def test_a_store_keeps_entries_another_worker_just_wrote(path):
+    first = PromptCache(path)
+    second = PromptCache(path)
+
+    first.store("one", DESCRIPTION, DESCRIPTORS, "/static/images/1.png")
+    # second's in-memory copy predates that write (possibly within the same mtime tick)
+    second.store("two", DESCRIPTION, DESCRIPTORS, "/static/images/2.png")
+
+    reader = PromptCache(path)
+    assert reader.lookup("one", "", [])["image_url"] == "/static/images/1.png"
+    assert reader.lookup("two", "", [])["image_url"] == "/static/images/2.png"
+
+
+def store_many(path, worker, count):
+    cache = PromptCache(path)
+    for i in range(count):
+        cache.store(f"prompt {worker} {i}", DESCRIPTION, DESCRIPTORS, f"/static/images/{worker}-{i}.png")
+
+
+def test_concurrent_workers_lose_no_entries(path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=store_many, args=(path, worker, 25)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    assert PromptCache(path).stats()["entries"] == 100
@@ -0,0 +1,133 @@
+"""Tests for record_store.RecordStore: group commit, error propagation and the read cache"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from record_store import RecordStore, _Pending
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "eggs_data.json")
+
+
+def read_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_append_and_update_are_on_disk(path):
+    store = RecordStore(path, fsync=False)
+    store.append({"id": "a", "status": "egg"})
+    store.append({"id": "b", "status": "egg"})
+
+    assert store.update("a", status="hatched") == {"id": "a", "status": "hatched"}
+    assert store.update("missing", status="hatched") is None
+    assert read_file(path) == [{"id": "a", "status": "hatched"}, {"id": "b", "status": "egg"}]
+
+
+def test_concurrent_commits_are_batched(path):
+    store = RecordStore(path, fsync=False)
+    first_running = threading.Event()
+    release = threading.Event()
+
+    def slow_first(records):
+        first_running.set()
+        release.wait(5)
+        records.append({"id": "first"})
+
+    committer = threading.Thread(target=store.commit, args=(slow_first,))
+    committer.start()
+    assert first_running.wait(5)
+
+    # These queue up behind the running commit and go out together in the next one
+    writers = [threading.Thread(target=store.append, args=({"id": f"r{i}"},)) for i in range(8)]
+    for writer in writers:
+        writer.start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with store._cond:
+            if len(store._pending) == len(writers):
+                break
+        time.sleep(0.001)
+    release.set()
+    committer.join(5)
+    for writer in writers:
+        writer.join(5)
+
+    assert sorted(record["id"] for record in read_file(path)) == ["first"] + sorted(f"r{i}" for i in range(8))
+    stats = store.stats()
+    assert stats["mutations"] == 9
+    assert stats["commits"] == 2
+    assert stats["max_batch"] == 8
+
+
+def test_failing_mutation_only_fails_its_own_caller(path):
+    store = RecordStore(path, fsync=False)
+    store.append({"id": "a"})
+
+    def broken(records):
+        raise KeyError("boom")
+
+    with pytest.raises(KeyError):
+        store.commit(broken)
+    store.append({"id": "b"})
+    assert [record["id"] for record in read_file(path)] == ["a", "b"]
+    assert store.stats()["errors"] == 0
+
+
+def test_write_failure_reaches_every_caller_in_the_batch(path, monkeypatch):
+    store = RecordStore(path, fsync=False)
+    store.append({"id": "a"})
+
+    def failing_write(records):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_write", failing_write)
+    batch = [_Pending(lambda records, record_id=record_id: records.append({"id": record_id}))
+             for record_id in ("x", "y")]
+    store._commit_batch(batch)
+
+    assert all(pending.done and isinstance(pending.error, OSError) for pending in batch)
+    assert store.stats()["errors"] == 1
+    # The mutations never reached the disk, so the cached collection must not keep them
+    assert store._records is None
+
+    with pytest.raises(OSError):
+        store.append({"id": "z"})
+
+    monkeypatch.undo()
+    store.append({"id": "c"})
+    assert [record["id"] for record in read_file(path)] == ["a", "c"]
+
+
+def test_read_sees_an_external_rewrite(path):
+    store = RecordStore(path, fsync=False)
+    store.append({"id": "a"})
+
+    # Another worker replaces the file (new inode), as RecordStore itself does
+    other = RecordStore(path, fsync=False)
+    other.append({"id": "from-other-worker"})
+
+    store.append({"id": "b"})
+    assert [record["id"] for record in read_file(path)] == ["a", "from-other-worker", "b"]
+
+
+def test_read_sees_an_in_place_rewrite_of_the_same_size(path):
+    store = RecordStore(path, fsync=False)
+    store.append({"id": "a"})
+    inode = os.stat(path).st_ino
+
+    # Same inode and size: only the mtime tells the cache the file changed
+    with open(path, "w") as f:
+        f.write('[\n{"id":"z"}\n]\n')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert os.stat(path).st_ino == inode
+
+    store.append({"id": "b"})
+    assert [record["id"] for record in read_file(path)] == ["z", "b"]
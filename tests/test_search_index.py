@@ -0,0 +1,62 @@
+"""Tests for search_index.SearchIndex: queries and what other connections see"""
+
+import pytest
+
+from search_index import SearchIndex
+
+
+def egg(egg_id, descriptors, description="", created_at="2024-01-01T00:00:00"):
+    return {"id": egg_id, "descriptors": descriptors, "description": description,
+            "created_at": created_at, "status": "egg"}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "search_index.db")
+
+
+@pytest.fixture
+def index(db_path):
+    index = SearchIndex(db_path)
+    yield index
+    index.close()
+
+
+def ids(result):
+    return [record["id"] for record in result["eggs"] + result["creatures"]]
+
+
+def test_and_or_and_text_queries(index):
+    index.add_egg(egg("a", ["Verdant", "whimsical"], "covered in vines", "2024-01-02"))
+    index.add_egg(egg("b", ["verdant"], "smooth and glossy", "2024-01-01"))
+
+    assert ids(index.search(descriptors=["verdant!", "Whimsical"])) == ["a"]
+    assert ids(index.search(descriptors=["verdant", "whimsical"], mode="or")) == ["a", "b"]
+    assert ids(index.search(q="vine")) == ["a"]
+    result = index.search(descriptors=["verdant"])
+    assert result["total"] == 2
+    assert result["facets"]["descriptors"][0] == {"descriptor": "verdant", "count": 2}
+
+
+def test_search_leaves_no_transaction_open(index):
+    index.add_egg(egg("a", ["verdant"]))
+
+    index.search(descriptors=["verdant"])
+
+    assert not index._conn.in_transaction
+
+
+def test_search_sees_records_added_by_another_connection(index, db_path):
+    # Each worker process has its own connection to the same database
+    other = SearchIndex(db_path)
+    try:
+        assert index.search(descriptors=["verdant"])["total"] == 0
+
+        other.add_egg(egg("from-other-worker", ["verdant"]))
+
+        assert ids(index.search(descriptors=["verdant"])) == ["from-other-worker"]
+        # No reader holds an old snapshot, so the WAL can be checkpointed completely
+        busy, _, _ = other._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        assert busy == 0
+    finally:
+        other.close()
@@ -0,0 +1,268 @@
+"""
+Token and Cost Accounting for the Hatch Application
+
+Every OpenAI call's usage (prompt/completion/cached tokens, images generated,
+TTS characters) is written to a small SQLite ledger together with an estimated
+cost, and attributed to whatever it was done for: the browser session, the egg
+or creature record and the pipeline stage (operation).
+
+USAGE:
+- Attribute the calls this thread makes from now on:
+  set_usage_scope(session_id=sid)                       # start of a request / background task
+  update_usage_scope(kind="egg", record_id=egg_id)      # once the pipeline knows its record
+
+- Record a call:
+  ledger.record("chat.concept", "gpt-4o", prompt_tokens=812, completion_tokens=64, **current_scope())
+
+- Roll it up:
+  ledger.summary(since=midnight)            # totals, by stage, by model, top records
+  ledger.record_usage("creature", creature_id)
+
+SPEND ALARMS:
+Daily, per-session and per-record USD thresholds. Crossing one logs a warning
+once (per day / session / record, across all workers) and the alarm is listed
+in the /api/usage summary.
+
+PRICES:
+USD list prices per model; override or extend with USAGE_PRICES (JSON with the
+same shape as DEFAULT_PRICES).
+"""
+
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Text models: USD per 1M tokens. Image models: USD per image by "quality:size".
+# TTS models: USD per 1M input characters.
+DEFAULT_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "dall-e-3": {"image": {"standard:1024x1024": 0.040, "standard:1024x1792": 0.080, "standard:1792x1024": 0.080,
+                           "hd:1024x1024": 0.080, "hd:1024x1792": 0.120, "hd:1792x1024": 0.120}},
+    "tts-1": {"characters": 15.00},
+    "tts-1-hd": {"characters": 30.00},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    session_id TEXT,
+    kind TEXT,
+    record_id TEXT,
+    operation TEXT NOT NULL,
+    model TEXT,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS calls_by_time ON calls (ts);
+CREATE INDEX IF NOT EXISTS calls_by_record ON calls (kind, record_id);
+CREATE INDEX IF NOT EXISTS calls_by_session ON calls (session_id);
+
+CREATE TABLE IF NOT EXISTS alarms (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    threshold_usd REAL NOT NULL,
+    spent_usd REAL NOT NULL,
+    triggered_at REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+"""
+
+# A context variable rather than a thread-local, so concurrent requests on one
+# asyncio event loop (app_async.py) each keep their own attribution
+_scope = contextvars.ContextVar("usage_scope", default={})
+
+
+def set_usage_scope(**attributes):
+    """Replace the attribution (session_id, kind, record_id) for this thread's / task's calls"""
+    _scope.set({k: v for k, v in attributes.items() if v is not None})
+
+
+def update_usage_scope(**attributes):
+    """Add to the attribution for this thread's / task's calls"""
+    _scope.set({**current_scope(), **{k: v for k, v in attributes.items() if v is not None}})
+
+
+def current_scope():
+    return dict(_scope.get())
+
+
+def estimate_cost(prices, model, prompt_tokens=0, completion_tokens=0, cached_tokens=0,
+                  images=0, image_variant=None, characters=0):
+    """Estimated USD cost of one call (0.0 for models without a price)"""
+    price = prices.get(model)
+    if not price:
+        return 0.0
+
+    cost = 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    cost += uncached * price.get("input", 0.0) / 1_000_000
+    cost += cached_tokens * price.get("cached_input", price.get("input", 0.0)) / 1_000_000
+    cost += completion_tokens * price.get("output", 0.0) / 1_000_000
+    cost += characters * price.get("characters", 0.0) / 1_000_000
+    if images:
+        per_image = price.get("image", {})
+        cost += images * per_image.get(image_variant, max(per_image.values(), default=0.0))
+    return cost
+
+
+def _start_of_day(now):
+    return datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+class UsageLedger:
+    def __init__(self, db_path, prices=None, daily_alarm_usd=None, session_alarm_usd=None,
+                 record_alarm_usd=None, on_alarm=None):
+        self.db_path = db_path
+        self.prices = {**DEFAULT_PRICES, **(prices or {})}
+        self.daily_alarm_usd = daily_alarm_usd
+        self.session_alarm_usd = session_alarm_usd
+        self.record_alarm_usd = record_alarm_usd
+        self.on_alarm = on_alarm
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def record(self, operation, model, prompt_tokens=0, completion_tokens=0, cached_tokens=0,
+               images=0, image_variant=None, characters=0, session_id=None, kind=None, record_id=None):
+        """Write one call to the ledger and check the spend alarms. Returns its estimated cost."""
+        cost = estimate_cost(self.prices, model, prompt_tokens, completion_tokens, cached_tokens,
+                             images, image_variant, characters)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO calls (ts, session_id, kind, record_id, operation, model, prompt_tokens, "
+                "completion_tokens, cached_tokens, images, characters, cost_usd) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, session_id, kind, record_id, operation, model, prompt_tokens,
+                 completion_tokens, cached_tokens, images, characters, cost)
+            )
+            triggered = self._check_alarms(now, session_id, kind, record_id)
+
+        for alarm in triggered:
+            logger.warning(f"Spend alarm: {alarm['scope']} {alarm['key']} has spent "
+                           f"${alarm['spent_usd']:.2f} (threshold ${alarm['threshold_usd']:.2f})")
+            if self.on_alarm:
+                self.on_alarm(alarm)
+        return cost
+
+    def _check_alarms(self, now, session_id, kind, record_id):
+        """Newly crossed thresholds (each fires once per key); called inside the write transaction"""
+        checks = []
+        if self.daily_alarm_usd:
+            day = datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+            checks.append(("daily", day, self.daily_alarm_usd, "ts >= ?", (_start_of_day(now),)))
+        if self.session_alarm_usd and session_id:
+            checks.append(("session", session_id, self.session_alarm_usd, "session_id = ?", (session_id,)))
+        if self.record_alarm_usd and record_id:
+            checks.append(("record", f"{kind}:{record_id}", self.record_alarm_usd,
+                           "kind = ? AND record_id = ?", (kind, record_id)))
+
+        triggered = []
+        for scope, key, threshold, where, params in checks:
+            spent = self._conn.execute(f"SELECT COALESCE(SUM(cost_usd), 0) FROM calls WHERE {where}", params).fetchone()[0]
+            if spent < threshold:
+                continue
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO alarms (scope, key, threshold_usd, spent_usd, triggered_at) VALUES (?, ?, ?, ?, ?)",
+                (scope, key, threshold, spent, now)
+            ).rowcount
+            if inserted:
+                triggered.append({"scope": scope, "key": key, "threshold_usd": threshold,
+                                  "spent_usd": round(spent, 4), "triggered_at": now})
+        return triggered
+
+    # ------------------------------------------------------------------
+    # Roll-ups
+    # ------------------------------------------------------------------
+
+    def _totals(self, where="1", params=()):
+        row = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), "
+            "COALESCE(SUM(cached_tokens), 0), COALESCE(SUM(images), 0), COALESCE(SUM(characters), 0), "
+            f"COALESCE(SUM(cost_usd), 0) FROM calls WHERE {where}", params
+        ).fetchone()
+        return {
+            "calls": row[0],
+            "prompt_tokens": row[1],
+            "completion_tokens": row[2],
+            "cached_tokens": row[3],
+            "images": row[4],
+            "tts_characters": row[5],
+            "cost_usd": round(row[6], 4),
+        }
+
+    def _grouped(self, column, where="1", params=()):
+        rows = self._conn.execute(
+            f"SELECT {column}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(images), "
+            f"SUM(characters), SUM(cost_usd) FROM calls WHERE {where} GROUP BY {column} ORDER BY SUM(cost_usd) DESC",
+            params
+        ).fetchall()
+        return [{
+            column: row[0],
+            "calls": row[1],
+            "prompt_tokens": row[2],
+            "completion_tokens": row[3],
+            "images": row[4],
+            "tts_characters": row[5],
+            "cost_usd": round(row[6], 4),
+        } for row in rows]
+
+    def record_usage(self, kind, record_id):
+        """Totals and per-stage breakdown for one egg or creature"""
+        with self._lock:
+            where, params = "kind = ? AND record_id = ?", (kind, record_id)
+            return {**self._totals(where, params), "by_stage": self._grouped("operation", where, params)}
+
+    def summary(self, since=None, session_id=None, top=10):
+        """Totals by stage, model and record; restricted to a time window and/or session"""
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        where = " AND ".join(clauses) or "1"
+        params = tuple(params)
+
+        with self._lock:
+            top_records = self._conn.execute(
+                f"SELECT kind, record_id, COUNT(*), SUM(cost_usd) FROM calls WHERE {where} AND record_id IS NOT NULL "
+                "GROUP BY kind, record_id ORDER BY SUM(cost_usd) DESC LIMIT ?", params + (top,)
+            ).fetchall()
+            alarms = self._conn.execute(
+                "SELECT scope, key, threshold_usd, spent_usd, triggered_at FROM alarms ORDER BY triggered_at DESC LIMIT 50"
+            ).fetchall()
+            return {
+                "totals": self._totals(where, params),
+                "by_stage": self._grouped("operation", where, params),
+                "by_model": self._grouped("model", where, params),
+                "by_kind": self._grouped("kind", where, params),
+                "top_records": [{"kind": r[0], "record_id": r[1], "calls": r[2], "cost_usd": round(r[3], 4)}
+                                for r in top_records],
+                "alarms": [{"scope": a[0], "key": a[1], "threshold_usd": a[2], "spent_usd": round(a[3], 4),
+                            "triggered_at": a[4]} for a in alarms],
+            }